@@ -0,0 +1,222 @@
+"""Minimal stand-in for the bpy and mathutils modules
+
+Only implements what the add-on touches so the operator, the legacy turtle
+and the curve builder can run outside of Blender. install() registers the
+modules in sys.modules.
+"""
+import sys
+import types
+from math import sin, cos, sqrt
+
+
+class Vector:
+    def __init__(self, values=(0, 0, 0)):
+        self.values = [float(v) for v in values]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __add__(self, other):
+        return Vector(a + b for a, b in zip(self, other))
+
+    def __sub__(self, other):
+        return Vector(a - b for a, b in zip(self, other))
+
+    def __mul__(self, other):
+        if isinstance(other, Matrix):
+            # Row vector times matrix
+            return Vector(sum(self[i] * other.rows[i][j] for i in range(3))
+                          for j in range(3))
+        return Vector(a * other for a in self)
+
+    def __truediv__(self, other):
+        return Vector(a / other for a in self)
+
+    def normalized(self):
+        length = sqrt(sum(a * a for a in self))
+        return Vector(a / length for a in self) if length else Vector(self)
+
+    def copy(self):
+        return Vector(self)
+
+
+class Matrix:
+    def __init__(self, rows):
+        self.rows = rows
+
+    @staticmethod
+    def Rotation(angle, size, axis):
+        c = cos(angle)
+        s = sin(angle)
+        if axis == 'X':
+            return Matrix([[1, 0, 0], [0, c, -s], [0, s, c]])
+        if axis == 'Y':
+            return Matrix([[c, 0, s], [0, 1, 0], [-s, 0, c]])
+        return Matrix([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+
+class BezierPoint:
+    def __init__(self):
+        self._co = Vector()
+        self._handle_left = Vector()
+        self._handle_right = Vector()
+        self.radius = 1.0
+
+    def _vector(name):
+        def get(self):
+            return getattr(self, name)
+
+        def set(self, value):
+            setattr(self, name, Vector(value))
+
+        return property(get, set)
+
+    co = _vector('_co')
+    handle_left = _vector('_handle_left')
+    handle_right = _vector('_handle_right')
+
+
+class PointCollection(list):
+    def __init__(self, point_type, count=1):
+        super().__init__(point_type() for i in range(count))
+        self.point_type = point_type
+
+    def add(self, count=1):
+        self.extend(self.point_type() for i in range(count))
+
+    def foreach_set(self, attribute, values):
+        width = len(values) // len(self) if len(self) else 0
+        if len(values) != width * len(self):
+            raise RuntimeError("foreach_set: {} values for {} items".format(len(values),
+                                                                            len(self)))
+        for i, point in enumerate(self):
+            value = values[i * width:(i + 1) * width]
+            setattr(point, attribute, value if width > 1 else value[0])
+
+    def foreach_get(self, attribute, values):
+        i = 0
+        for point in self:
+            value = getattr(point, attribute)
+            value = list(value) if hasattr(value, '__iter__') else [value]
+            values[i:i + len(value)] = value
+            i += len(value)
+
+
+class SplinePoint:
+    def __init__(self):
+        self.co = (0.0, 0.0, 0.0, 0.0)
+        self.radius = 1.0
+
+
+class Spline:
+    def __init__(self, spline_type):
+        self.type = spline_type
+        self.bezier_points = PointCollection(BezierPoint, spline_type == 'BEZIER')
+        self.points = PointCollection(SplinePoint, spline_type != 'BEZIER')
+        self.use_smooth = True
+
+
+class Splines(list):
+    def new(self, spline_type):
+        spline = Spline(spline_type)
+        self.append(spline)
+        return spline
+
+
+class Curve:
+    def __init__(self, name, curve_type):
+        self.name = name
+        self.splines = Splines()
+        self.bevel_depth = 0
+        self.bevel_resolution = 0
+
+
+class Object:
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+        self.location = Vector()
+        self.rotation_euler = Vector()
+        self.parent = None
+
+
+class MeshVertex:
+    def __init__(self):
+        self.co = (0.0, 0.0, 0.0)
+
+
+class MeshEdge:
+    def __init__(self):
+        self.vertices = (0, 0)
+
+
+class Mesh:
+    def __init__(self, name):
+        self.name = name
+        self.vertices = PointCollection(MeshVertex, 0)
+        self.edges = PointCollection(MeshEdge, 0)
+
+    def from_pydata(self, vertices, edges, faces):
+        self.vertices.add(len(vertices))
+        for vertex, co in zip(self.vertices, vertices):
+            vertex.co = tuple(co)
+        self.edges.add(len(edges))
+        for edge, indices in zip(self.edges, edges):
+            edge.vertices = tuple(indices)
+
+    def update(self):
+        pass
+
+
+class DataCollection(list):
+    def __init__(self, factory):
+        super().__init__()
+        self.factory = factory
+
+    def new(self, *args):
+        item = self.factory(*args)
+        self.append(item)
+        return item
+
+
+def _property(*args, **kwargs):
+    return kwargs.get('default')
+
+
+def install():
+    """Register mock bpy and mathutils modules"""
+    mathutils = types.ModuleType('mathutils')
+    mathutils.Vector = Vector
+    mathutils.Matrix = Matrix
+    mathutils.__all__ = ['Vector', 'Matrix']
+
+    bpy = types.ModuleType('bpy')
+    bpy.data = types.SimpleNamespace(curves=DataCollection(Curve),
+                                     objects=DataCollection(Object),
+                                     meshes=DataCollection(Mesh))
+    scene = types.SimpleNamespace(cursor_location=Vector(),
+                                  objects=types.SimpleNamespace(link=lambda obj: None))
+    bpy.context = types.SimpleNamespace(scene=scene)
+
+    props = types.ModuleType('bpy.props')
+    for name in ('StringProperty', 'IntProperty', 'FloatProperty', 'CollectionProperty',
+                 'PointerProperty', 'BoolProperty', 'EnumProperty'):
+        setattr(props, name, _property)
+    bpy.props = props
+
+    bpy_types = types.ModuleType('bpy.types')
+    bpy_types.Operator = object
+    bpy_types.PropertyGroup = object
+    bpy.types = bpy_types
+    bpy.utils = types.SimpleNamespace(register_module=lambda name: None,
+                                      unregister_module=lambda name: None)
+
+    sys.modules.update({'bpy': bpy, 'bpy.props': props, 'bpy.types': bpy_types,
+                        'mathutils': mathutils})
+    return bpy
@@ -0,0 +1,119 @@
+"""Cost of saving and restoring the turtle state at brackets
+
+Compares copying a turtle object like the original TurtleMovement, the
+immutable records of _walk and a preallocated array stack, on bracket
+heavy grammars. Only the state machine runs, no geometry is built.
+
+Run from the repository root: python -m benchmarks.branching [iterations]
+"""
+import sys
+from array import array
+from copy import copy
+from math import radians
+from benchmarks.common import start_tokens, measure, report
+from lindenmayer_system_analytics import analyze
+from lindenmayer_system_derivation import apply_rules, rules_from_strings
+from lindenmayer_system_turtle import PUSH, POP, ROTATIONS, _actions, _rotate, _walk
+
+GRAMMARS = {
+    'flower_f': ('X', ['X:=F-[[X]+X]+F[+FX]-X', 'F:=FF']),
+    'bushy': ('X', ['X:=F[+X][-X][X]', 'F:=F']),
+}
+
+
+class Turtle:
+    def __init__(self):
+        self.direction = [0.0, 0.0, 1.0]
+        self.changed = True
+        self.spline = 0
+
+
+def copied_objects(system, angle):
+    turtle = Turtle()
+    stack = []
+    splines = 0
+    for action in _actions(system):
+        if action == PUSH:
+            stack.append(copy(turtle))
+            turtle.direction = list(turtle.direction)
+            splines += 1
+            turtle.spline = splines
+        elif action == POP:
+            turtle = stack.pop()
+        elif action > POP:
+            axis, sign = ROTATIONS[action]
+            turtle.direction = list(_rotate(turtle.direction, sign * angle, axis))
+            turtle.changed = True
+    return splines
+
+
+def records(system, angle):
+    direction = (0.0, 0.0, 1.0)
+    changed = True
+    spline = splines = 0
+    stack = []
+    for action in _actions(system):
+        if action == PUSH:
+            stack.append((direction, changed, spline))
+            splines += 1
+            spline = splines
+        elif action == POP:
+            direction, changed, spline = stack.pop()
+        elif action > POP:
+            axis, sign = ROTATIONS[action]
+            direction = _rotate(direction, sign * angle, axis)
+            changed = True
+    return splines
+
+
+def array_stack(system, angle, depth):
+    x, y, z = 0.0, 0.0, 1.0
+    changed = True
+    spline = splines = 0
+    saved = array('d', bytes(24 * depth))
+    saved_changed = array('b', bytes(depth))
+    saved_spline = array('q', bytes(8 * depth))
+    top = 0
+    for action in _actions(system):
+        if action == PUSH:
+            saved[top * 3:top * 3 + 3] = array('d', (x, y, z))
+            saved_changed[top] = changed
+            saved_spline[top] = spline
+            top += 1
+            splines += 1
+            spline = splines
+        elif action == POP:
+            top -= 1
+            x, y, z = saved[top * 3:top * 3 + 3]
+            changed = saved_changed[top]
+            spline = saved_spline[top]
+        elif action > POP:
+            axis, sign = ROTATIONS[action]
+            x, y, z = _rotate((x, y, z), sign * angle, axis)
+            changed = True
+    return splines
+
+
+def main(iterations):
+    angle = radians(25.7)
+    for name, (start, strings) in sorted(GRAMMARS.items()):
+        rules = rules_from_strings(strings)
+        statistics = analyze(start_tokens(start), rules, iterations)
+        system = apply_rules(start_tokens(start), rules, iterations, 0)
+
+        print("{} ({} tokens, {} branches, depth {})".format(
+            name, len(system), statistics.branches, statistics.depth))
+        for label, function, args in (("copied turtle objects", copied_objects, ()),
+                                      ("immutable records", records, ()),
+                                      ("preallocated arrays", array_stack,
+                                       (statistics.depth,))):
+            result, elapsed, peak = measure(function, system, angle, *args)
+            assert result == statistics.branches
+            report("  " + label, elapsed, peak)
+
+        result, elapsed, peak = measure(_walk, system, lambda: angle, (0.0, 0.0, 1.0))
+        report("  _walk with geometry events", elapsed, peak)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 7)
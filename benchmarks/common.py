@@ -0,0 +1,59 @@
+import time
+import tracemalloc
+from lindenmayer_system_parser import Token
+
+# Grammars of the shipped presets and stochastic variants, in stochastic_f
+# every rewritten symbol is stochastic
+SYSTEMS = {
+    'flower_a': ('F', ['F:=F[+F]F[-F]F'], None),
+    'flower_c': ('F', ['F:=FF-[-F+F+F]+[+F-F-F]'], None),
+    'flower_d': ('X', ['X:=F[+X]F[-X]+X', 'F:=FF'], None),
+    'flower_e': ('X', ['X:=F[+X][-X]FX', 'F:=FF'], None),
+    'flower_f': ('X', ['X:=F-[[X]+X]+F[+FX]-X', 'F:=FF'], None),
+    'stochastic': ('X', ['X:=F[+X]F[-X]+X', 'X:=F[-X]F[+X]-X', 'F:=FF'],
+                   [0.5, 0.5, 1]),
+    'stochastic_f': ('F', ['F:=F[+F]F[-F]F', 'F:=F[-F]F[+F]F'], [0.5, 0.5]),
+}
+
+
+def start_tokens(start):
+    return [Token('SYMBOL', s) for s in start]
+
+
+def measure(function, *args):
+    """Run function and return (result, seconds, peak bytes)"""
+    tracemalloc.start()
+    begin = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - begin
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return result, elapsed, peak
+
+
+def report(name, elapsed, peak):
+    print("{:<34} {:>10.3f} s {:>12.1f} MiB".format(name, elapsed, peak / 2**20))
+
+
+def make_operator(start, strings, probabilities=None, iterations=0, **settings):
+    """LindenmayerSystem operator configured like a preset
+
+    Requires benchmarks.blender_mock to be installed.
+    """
+    import lindenmayer_system
+
+    operator = lindenmayer_system.LindenmayerSystem()
+    operator.productions = []
+    for i, string in enumerate(strings):
+        production = lindenmayer_system.ProductionItem()
+        production.rule = string
+        production.probability = probabilities[i] if probabilities else 1.0
+        operator.productions.append(production)
+
+    operator.start_symbol = start
+    operator.iterations = iterations
+    for name, value in settings.items():
+        setattr(operator, name, value)
+
+    return operator
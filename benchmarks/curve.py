@@ -0,0 +1,41 @@
+"""Compare building the curve point by point with the bulk builder
+
+Runs against benchmarks.blender_mock, so the numbers show the number of
+calls into the curve API rather than the cost of Blender itself.
+Run from the repository root: python -m benchmarks.curve [iterations]
+"""
+import sys
+from math import radians
+from benchmarks import blender_mock
+from benchmarks.common import SYSTEMS, start_tokens, measure, report
+from lindenmayer_system_derivation import apply_rules, rules_from_strings
+from lindenmayer_system_turtle import interpret
+from lindenmayer_system_curve import build_curve
+
+bpy = blender_mock.install()
+from benchmarks import legacy_turtle
+
+
+def build(system, length, get_angle):
+    geometry = interpret(system, length, get_angle)
+    return build_curve(bpy.data.curves.new('LSystem', 'CURVE'), geometry)
+
+
+def main(iterations):
+    for name, (start, strings, probabilities) in sorted(SYSTEMS.items()):
+        rules = rules_from_strings(strings, probabilities)
+        system = apply_rules(start_tokens(start), rules, iterations, 1)
+        get_angle = lambda: radians(25.7)
+
+        old, old_time, old_peak = measure(legacy_turtle.interpret, system, 0.1, get_angle)
+        new, new_time, new_peak = measure(build, system, 0.1, get_angle)
+        assert [len(s.bezier_points) for s in old.splines] == \
+               [len(s.bezier_points) for s in new.splines], name
+
+        print("{} ({} splines)".format(name, len(new.splines)))
+        report("  incremental", old_time, old_peak)
+        report("  foreach_set", new_time, new_peak)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,38 @@
+"""Compare the list based, the encoded and the streaming derivation engine
+
+Run from the repository root: python -m benchmarks.derivation [iterations]
+"""
+import sys
+from benchmarks import legacy
+from benchmarks.common import SYSTEMS, start_tokens, measure, report
+from lindenmayer_system_derivation import apply_rules, stream_rules, rules_from_strings
+
+
+def main(iterations):
+    for name, (start, strings, probabilities) in sorted(SYSTEMS.items()):
+        rules = rules_from_strings(strings, probabilities)
+
+        old, old_time, old_peak = measure(legacy.apply_rules,
+                                          start_tokens(start), rules, iterations, 1)
+        new, new_time, new_peak = measure(apply_rules,
+                                          start_tokens(start), rules, iterations, 1)
+
+        gen, gen_time, gen_peak = measure(apply_rules,
+                                          start_tokens(start), rules, iterations, 1, 0)
+        count, stream_time, stream_peak = measure(
+            lambda: sum(1 for t in stream_rules(start_tokens(start), rules, iterations, 1)))
+
+        old = [t for t in old if t.type != 'EMPTY']
+        assert old == list(new), name
+        assert count == len(new), name
+        assert gen.codes == new.codes, name
+
+        print("{} ({} tokens)".format(name, len(new)))
+        report("  list of tokens", old_time, old_peak)
+        report("  encoded by generation", gen_time, gen_peak)
+        report("  encoded with subtree cache", new_time, new_peak)
+        report("  streamed", stream_time, stream_peak)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 8)
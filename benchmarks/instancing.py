@@ -0,0 +1,37 @@
+"""Compare full geometry with instanced repeated branches
+
+Run from the repository root: python -m benchmarks.instancing [iterations]
+"""
+import sys
+from math import radians
+from benchmarks.common import SYSTEMS, start_tokens, measure, report
+from lindenmayer_system_derivation import apply_rules, rules_from_strings
+from lindenmayer_system_turtle import interpret
+from lindenmayer_system_instancing import can_instance, instance, point_count
+
+
+def full(start, rules, iterations, angle):
+    return interpret(apply_rules(start, rules, iterations, 0), 0.01, lambda: angle)
+
+
+def main(iterations):
+    angle = radians(25)
+    for name, (start, strings, probabilities) in sorted(SYSTEMS.items()):
+        rules = rules_from_strings(strings, probabilities)
+        if not can_instance(rules, start_tokens(start), 0):
+            continue
+
+        geometry, full_time, full_peak = measure(full, start_tokens(start), rules,
+                                                 iterations, angle)
+        instanced, instance_time, instance_peak = measure(instance, start_tokens(start), rules,
+                                                          iterations, 0.01, angle)
+
+        print("{} ({} points, {} stored with {} prototypes and {} instances)".format(
+            name, len(geometry.points) // 3, point_count(instanced),
+            len(instanced.prototypes), len(instanced.instances.prototype)))
+        report("  full geometry", full_time, full_peak)
+        report("  instanced", instance_time, instance_peak)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 7)
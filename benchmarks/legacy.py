@@ -0,0 +1,58 @@
+"""Reference implementation of the original list based engine
+
+Kept for equivalence checks and as baseline of the benchmarks.
+"""
+from random import random, seed
+
+
+def apply_single_rule(start, rules):
+    lsystem = []
+    for token in start:
+        if token.type == 'SYMBOL':
+            if token.value in rules:
+                rewrite_rule = rules[token.value]
+
+                if len(rewrite_rule) > 1:
+                    # Rules with probability
+                    rnd = random()
+                    probability = 0
+                    for r in rewrite_rule:
+                        probability += r.probability
+                        if rnd <= probability:
+                            lsystem.extend(r.right)
+                            break
+                else:
+                    lsystem.extend(rewrite_rule[0].right)
+            else:
+                lsystem.append(token)
+        else:
+            lsystem.append(token)
+
+    return lsystem
+
+
+def apply_rules(start, rules, times, rseed):
+    lsystem = start
+    seed(rseed)
+    for i in range(times):
+        lsystem = apply_single_rule(lsystem, rules)
+
+    return lsystem
+
+
+def calculate_length(system, basic_length):
+    cnt = 0
+    stack = []
+
+    for token in system:
+        if token.type == 'SYMBOL' and token.value == 'F' and not stack:
+            cnt+=1
+            continue
+
+        if token.type == 'PUSH':
+            stack.append('[')
+
+        if token.type == 'POP':
+            stack.pop()
+
+    return basic_length / cnt if cnt else 0
@@ -0,0 +1,162 @@
+"""Reference implementation of the original per point turtle
+
+Imports bpy and mathutils, install benchmarks.blender_mock first when
+running outside of Blender.
+"""
+import bpy
+import numpy as np
+from copy import copy
+from mathutils import Vector, Matrix
+
+
+def new_spline(curve, position):
+    curve.splines.new('BEZIER')
+    spline = curve.splines[-1]
+    spline.bezier_points[-1].co = position
+    return spline
+
+
+class TurtleMovement:
+
+    def __init__(self, vector, length):
+        self._has_changed = True
+        self._facing_direction = vector
+        self._basic_length = length
+
+        # Create new curve object
+        self._curve = bpy.data.curves.new('LSystem', 'CURVE')
+        self._curve.dimensions = '3D'
+        self._curve.fill_mode = 'FULL'
+        self._curve.resolution_u = 1
+
+        self._object = bpy.data.objects.new('LSystem', self._curve)
+        self._object.location = bpy.context.scene.cursor_location
+        bpy.context.scene.objects.link(self._object)
+
+        self.branch_at(Vector((0, 0, 0)))
+
+    def forward(self, amount):
+        direction = self._facing_direction
+        direction = direction * self._basic_length
+        new_position = self._spline.bezier_points[-1].co + direction
+
+        if self.has_changed() or len(self._spline.bezier_points) == 1:
+            # Add second point
+            self._spline.bezier_points.add()
+
+        p1 = self._spline.bezier_points[-1]
+        p2 = self._spline.bezier_points[-2]
+
+        p1.co = new_position
+        new_handle = direction / 5
+
+        p1.handle_left = p1.co - new_handle
+        handle_direction = (p2.co - p1.co ).normalized()
+        handle_direction = handle_direction * self._basic_length / 5
+        p1.handle_right = p1.co - handle_direction
+        p2.handle_right = p2.co + new_handle
+
+    def branch_at(self, position):
+        self._spline = new_spline(self._curve, position)
+
+        p = self._spline.bezier_points[-1]
+        p.handle_left = p.co - self._facing_direction * self._basic_length / 5
+
+    def branch(self):
+        self.branch_at(self._spline.bezier_points[-1].co)
+
+    def branch_end(self):
+        if len(self._spline.bezier_points) == 1:
+            self.remove_spline()
+
+    def remove_spline(self):
+        self._curve.splines.remove(self._spline)
+
+    def get_curve(self):
+        return self._curve
+
+    def rotate(self, amount, axis):
+        self._has_changed = True
+        self._facing_direction = self._facing_direction * Matrix.Rotation(amount, 3, axis)
+
+    def yaw(self, amount):
+        self._has_changed = True
+        self.rotate(amount, 'Y')
+
+    def pitch(self, amount):
+        self._has_changed = True
+        self.rotate(amount, 'X')
+
+    def roll(self, amount):
+        self._has_changed = True
+        self.rotate(amount, 'Z')
+
+    def has_changed(self):
+        if self._has_changed:
+            self._has_changed = False
+            return True
+        else:
+            return False
+
+
+def interpret(system, length, get_angle):
+    """Token loop of the original apply_turtle, returns the curve"""
+    turtle = TurtleMovement(Vector((0, 0, 1)), length)
+    curve = turtle.get_curve()
+    stack = []
+
+    for token in system:
+        if (token.type == 'SYMBOL'):
+            if (token.value == 'F'):
+                turtle.forward(length)
+                continue
+
+        if (token.type == 'DIRECTION'):
+            if (token.value == '+'):
+                turtle.yaw(get_angle())
+                continue
+
+            if (token.value == '-'):
+                turtle.yaw(-get_angle())
+                continue
+
+            if (token.value == '^'):
+                turtle.pitch(get_angle())
+                continue
+
+            if (token.value == '&'):
+                turtle.pitch(-get_angle())
+                continue
+
+            if (token.value == '\\'):
+                turtle.roll(get_angle())
+                continue
+
+            if (token.value == '/'):
+                turtle.roll(-get_angle())
+                continue
+
+        if (token.type == 'PUSH'):
+            stack.append(copy(turtle))
+            turtle.branch()
+            continue
+
+        if (token.type == 'POP'):
+            turtle.branch_end()
+            turtle = stack.pop()
+            continue
+
+    return curve
+
+
+def curve_arrays(curve):
+    """Flat (points, handles_left, handles_right, offsets) of a bezier curve"""
+    arrays = ([], [], [])
+    offsets = [0]
+    for spline in curve.splines:
+        for point in spline.bezier_points:
+            for values, attribute in zip(arrays, ('co', 'handle_left', 'handle_right')):
+                values.extend(getattr(point, attribute))
+        offsets.append(offsets[-1] + len(spline.bezier_points))
+
+    return tuple(np.array(a, dtype=np.float32) for a in arrays) + (np.array(offsets),)
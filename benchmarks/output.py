@@ -0,0 +1,47 @@
+"""Compare the bezier, poly and mesh output of the turtle geometry
+
+Runs against benchmarks.blender_mock, so the numbers show the number of
+calls into the Blender API rather than the cost of Blender itself, the
+tessellation of the bezier splines is not part of the mock.
+Run from the repository root: python -m benchmarks.output [iterations]
+"""
+import sys
+from math import radians
+from benchmarks import blender_mock
+from benchmarks.common import SYSTEMS, start_tokens, measure, report
+from lindenmayer_system_derivation import apply_rules, rules_from_strings
+from lindenmayer_system_turtle import interpret
+from lindenmayer_system_curve import build_curve, build_poly, build_mesh, point_radii
+
+bpy = blender_mock.install()
+
+
+def bezier(geometry):
+    return build_curve(bpy.data.curves.new('LSystem', 'CURVE'), geometry,
+                       point_radii(geometry, 0.8))
+
+
+def poly(geometry):
+    return build_poly(bpy.data.curves.new('LSystem', 'CURVE'), geometry,
+                      point_radii(geometry, 0.8))
+
+
+def mesh(geometry):
+    return build_mesh(bpy.data.meshes.new('LSystem'), geometry)
+
+
+def main(iterations):
+    for name, (start, strings, probabilities) in sorted(SYSTEMS.items()):
+        rules = rules_from_strings(strings, probabilities)
+        system = apply_rules(start_tokens(start), rules, iterations, 1)
+        geometry = interpret(system, 0.1, lambda: radians(25.7))
+
+        print("{} ({} splines, {} points)".format(name, len(geometry.offsets) - 1,
+                                                  geometry.offsets[-1]))
+        for build in (bezier, poly, mesh):
+            result, elapsed, peak = measure(build, geometry)
+            report("  " + build.__name__, elapsed, peak)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,40 @@
+"""Scaling of the parallel derivation with the number of processes
+
+Run from the repository root: python -m benchmarks.parallel [iterations]
+"""
+import os
+import sys
+import time
+from benchmarks.common import SYSTEMS, start_tokens
+from lindenmayer_system_derivation import apply_rules, rules_from_strings
+from lindenmayer_system_parallel import apply_rules_parallel
+
+PROCESSES = (1, 2, 4, 8, 16)
+
+
+def timed(function, *args):
+    begin = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - begin
+
+
+def main(iterations):
+    print("{} cores available".format(os.cpu_count()))
+    for name in ('flower_c', 'stochastic_f'):
+        start, strings, probabilities = SYSTEMS[name]
+        rules = rules_from_strings(strings, probabilities)
+
+        # The default serial derivation, with the subtree cache
+        word, serial = timed(apply_rules, start_tokens(start), rules, iterations, 1)
+        print("{} ({} tokens)".format(name, len(word)))
+        print("  {:<12} {:>8.3f} s".format("serial", serial))
+
+        for processes in PROCESSES:
+            word, elapsed = timed(apply_rules_parallel, start_tokens(start), rules,
+                                  iterations, 1, processes, 1 << 18)
+            print("  {:<12} {:>8.3f} s {:>6.2f}x".format("{} processes".format(processes),
+                                                        elapsed, serial / elapsed))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 8)
@@ -0,0 +1,50 @@
+"""Compare the recursive descent and the single pass parser
+
+Run from the repository root: python -m benchmarks.parser
+"""
+import time
+from benchmarks.legacy_parser import LindenmayerSystemParser as RecursiveParser
+from lindenmayer_system_parser import LindenmayerSystemParser
+
+SIZES = (10, 100, 1000, 10000, 100000)
+
+# Repeated to the requested number of symbols
+PATTERN = "F[+X]-F[-X]+"
+
+
+def make_rule(size):
+    right = (PATTERN * (size // len(PATTERN) + 1))[:size]
+    # Brackets may be cut in half at the end
+    right += "]" * (right.count("[") - right.count("]"))
+    return "X:=" + right
+
+
+def timed(parser, rule, repeat):
+    begin = time.perf_counter()
+    for i in range(repeat):
+        tokens = parser.parse(rule)
+    return tokens, (time.perf_counter() - begin) / repeat
+
+
+def main():
+    recursive = RecursiveParser()
+    single_pass = LindenmayerSystemParser()
+
+    for size in SIZES:
+        rule = make_rule(size)
+        repeat = max(1, 100000 // size)
+
+        new, new_time = timed(single_pass, rule, repeat)
+        try:
+            old, old_time = timed(recursive, rule, repeat)
+            assert [t for t in old if t.type != 'EMPTY'] == [t for t in new if t.type != 'EMPTY']
+            old_result = "{:>10.3f} ms".format(old_time * 1000)
+        except RecursionError:
+            old_result = "{:>13}".format("recursion")
+
+        print("{:>7} symbols  recursive {}  single pass {:>10.3f} ms".format(
+            size, old_result, new_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
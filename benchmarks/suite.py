@@ -0,0 +1,183 @@
+"""Time every stage of the add-on on the shipped presets
+
+For every preset and number of iterations the rules are parsed, derived,
+measured with calculate_length, interpreted by the turtle and built into a
+curve of benchmarks.blender_mock. The best time of --repeat runs and the
+peak memory of every stage go into a JSON report, which can be compared
+against an earlier report. Systems predicted to grow beyond --max-tokens
+are skipped.
+
+Run from the repository root:
+python -m benchmarks.suite [--iterations 1-8] [--repeat 5] [--output report.json]
+                           [--baseline old.json]
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import numpy as np
+from benchmarks import blender_mock
+from benchmarks.common import measure
+from lindenmayer_system_parser import Token, parse_rule
+from lindenmayer_system_derivation import apply_rules
+from lindenmayer_system_analytics import analyze, calculate_length
+from lindenmayer_system_turtle import interpret, angle_function
+from lindenmayer_system_curve import build_curve
+from lindenmayer_system_random import random_stream
+from lindenmayer_system_core import PRESETS, load_preset, get_rules
+
+# Systems predicted to be longer are not derived
+MAX_TOKENS = 50000000
+
+# Runs of every stage, the best time is reported
+REPEAT = 5
+
+# Stages slower than the baseline by this factor are reported
+REGRESSION_FACTOR = 1.2
+
+# Seconds a stage may be slower than the baseline without being reported,
+# below it timer noise exceeds REGRESSION_FACTOR
+REGRESSION_FLOOR = 0.01
+
+
+def _stage(function, repeat):
+    """Run function repeat times, returns (result, measurements)
+
+    The peak memory is traced on the first run, the best time is taken
+    from the other runs, which are not slowed down by tracemalloc.
+    """
+    result, seconds, peak = measure(function)
+    timings = []
+    for i in range(repeat - 1):
+        begin = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - begin)
+    return result, {'seconds': min(timings, default=seconds), 'peak_bytes': peak}
+
+
+def run_preset(settings, iterations, repeat=REPEAT):
+    """Stage measurements of settings derived iterations times
+
+    Every run of a stage starts from a cleared parse cache and fresh
+    random generators, so all runs do the same work.
+    """
+    def parse():
+        parse_rule.cache_clear()
+        return get_rules(settings.productions)
+
+    rules, parse_stage = _stage(parse, repeat)
+    start = [Token('SYMBOL', settings.start_symbol)]
+
+    system, derive = _stage(lambda: apply_rules(start, rules, iterations, settings.rule_seed),
+                            repeat)
+    length, measure_length = _stage(lambda: calculate_length(system, settings.basic_length),
+                                    repeat)
+
+    def turtle():
+        get_angle = angle_function(settings.angle, settings.random_angle,
+                                   random_stream(settings.angle_seed))
+        return interpret(system, length, get_angle)
+
+    geometry, turtle_stage = _stage(turtle, repeat)
+    curve, curve_stage = _stage(
+        lambda: build_curve(blender_mock.Curve('LSystem', 'CURVE'), geometry), repeat)
+
+    return {'tokens': len(system),
+            'splines': len(geometry.offsets) - 1,
+            'points': int(geometry.offsets[-1]),
+            'stages': {'parse': parse_stage, 'derive': derive, 'length': measure_length,
+                       'turtle': turtle_stage, 'curve': curve_stage}}
+
+
+def run(presets, iterations, max_tokens, repeat=REPEAT):
+    results = []
+    for path in presets:
+        name = os.path.splitext(os.path.basename(path))[0]
+        settings = load_preset(path)
+        start = [Token('SYMBOL', settings.start_symbol)]
+        rules = get_rules(settings.productions)
+
+        for times in iterations:
+            predicted = analyze(start, rules, times).length
+            entry = {'preset': name, 'iterations': times, 'predicted_tokens': predicted}
+            if predicted > max_tokens:
+                entry['skipped'] = True
+            else:
+                entry.update(run_preset(settings, times, repeat))
+            results.append(entry)
+
+            stages = entry.get('stages', {})
+            print("{:<10} {} {:>12} tokens {}".format(
+                name, times, predicted,
+                ' '.join("{} {:.3f}s".format(stage, value['seconds'])
+                         for stage, value in stages.items()) or "skipped"))
+
+    return results
+
+
+def compare(results, baseline):
+    """Stages of results slower than in baseline by REGRESSION_FACTOR and
+    by more than REGRESSION_FLOOR seconds
+    """
+    old = {(entry['preset'], entry['iterations']): entry.get('stages', {})
+           for entry in baseline['results']}
+
+    regressions = []
+    for entry in results:
+        previous = old.get((entry['preset'], entry['iterations']), {})
+        for stage, value in entry.get('stages', {}).items():
+            if stage not in previous:
+                continue
+            seconds, old_seconds = value['seconds'], previous[stage]['seconds']
+            if (seconds - old_seconds > REGRESSION_FLOOR and
+                seconds > old_seconds * REGRESSION_FACTOR):
+                regressions.append((entry['preset'], entry['iterations'], stage,
+                                    old_seconds, seconds))
+
+    return regressions
+
+
+def iteration_range(text):
+    first, _, last = text.partition('-')
+    return range(int(first), int(last or first) + 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the stages on the presets")
+    parser.add_argument('--iterations', type=iteration_range, default=range(1, 9),
+                        help="Iterations or range of iterations, e.g. 1-8")
+    parser.add_argument('--presets', nargs='*',
+                        default=sorted(glob.glob(os.path.join(PRESETS, '*.py'))))
+    parser.add_argument('--max-tokens', type=int, default=MAX_TOKENS)
+    parser.add_argument('--repeat', type=int, default=REPEAT,
+                        help="Runs of every stage, the best time is reported")
+    parser.add_argument('--output', help="Write the JSON report to this file")
+    parser.add_argument('--baseline', help="Report regressions against this JSON report")
+    args = parser.parse_args(argv)
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'machine': platform.machine(),
+              'repeat': args.repeat,
+              'results': run(args.presets, args.iterations, args.max_tokens, args.repeat)}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report['results'], json.load(f))
+        for preset, times, stage, old, new in regressions:
+            print("{} {} {}: {:.3f}s -> {:.3f}s".format(preset, times, stage, old, new))
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,39 @@
+"""Compare the per point turtle with the array turtle
+
+Run from the repository root: python -m benchmarks.turtle [iterations]
+"""
+import sys
+import numpy as np
+from benchmarks import blender_mock
+from benchmarks.common import SYSTEMS, start_tokens, measure, report
+from lindenmayer_system_derivation import apply_rules, rules_from_strings
+from lindenmayer_system_turtle import interpret
+from math import radians
+
+blender_mock.install()
+from benchmarks import legacy_turtle
+
+
+def check(curve, geometry):
+    expected = legacy_turtle.curve_arrays(curve)
+    for values, result in zip(expected, geometry):
+        np.testing.assert_allclose(result, values, atol=1e-4)
+
+
+def main(iterations):
+    for name, (start, strings, probabilities) in sorted(SYSTEMS.items()):
+        rules = rules_from_strings(strings, probabilities)
+        system = apply_rules(start_tokens(start), rules, iterations, 1)
+        get_angle = lambda: radians(25.7)
+
+        curve, old_time, old_peak = measure(legacy_turtle.interpret, list(system), 0.1, get_angle)
+        geometry, new_time, new_peak = measure(interpret, system, 0.1, get_angle)
+        check(curve, geometry)
+
+        print("{} ({} points)".format(name, len(geometry.points) // 3))
+        report("  per point", old_time, old_peak)
+        report("  arrays", new_time, new_peak)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -17,19 +17,24 @@
 # ##### END GPL LICENSE BLOCK #####
 
 import bpy
-from copy import copy
-from mathutils import *
-from math import radians, pi
-from random import random, seed
-from collections import namedtuple
+from math import radians
 from bpy.props import StringProperty
 from bpy.props import IntProperty
 from bpy.props import FloatProperty
 from bpy.props import CollectionProperty
 from bpy.props import PointerProperty
 from bpy.props import BoolProperty
+from bpy.props import EnumProperty
 from bpy.types import PropertyGroup
-from lindenmayer_system_parser import LindenmayerSystemParser, Token
+from lindenmayer_system_parser import Token, parse_rule, rule_valid
+from lindenmayer_system_analytics import analyze
+from lindenmayer_system_core import (get_rules, generate, generate_instanced, refine,
+                                     settings_budget, budget_iterations, PREVIEW_BUDGET)
+from lindenmayer_system_budget import MAX_TOKENS, MAX_POINTS
+from lindenmayer_system_curve import build_curve, build_poly, build_mesh, point_radii
+from lindenmayer_system_simplify import simplify, simplify_instanced, point_count
+from lindenmayer_system_instancing import point_count as instanced_point_count
+from lindenmayer_system_profile import Profile, NO_PROFILE
 
 bl_info = {
     "name"     : "Lindenmayer system",
@@ -41,7 +46,12 @@ bl_info = {
     "warning"  : "Under development"
 }
 
-Rule = namedtuple('Rule', ['left', 'right', 'probability'])
+# Words longer than this get a warning in the operator panel
+WORD_LENGTH_WARNING = 50000000
+
+# Profile of the last execution with profiling enabled, read it from the
+# Python console with lindenmayer_system.last_profile.as_dict()
+last_profile = None
 
 def draw_rule(layout, rule, index):
     """Draw a Lindenmayer rule on the layout
@@ -89,7 +99,7 @@ def draw_rule(layout, rule, index):
     return box
 
 def check_rule(self, context):
-    if self.parser.rule_valid(self.rule):
+    if rule_valid(self.rule):
         self.is_valid = True
     else:
         self.is_valid = False
@@ -106,12 +116,8 @@ class ProductionItem(bpy.types.PropertyGroup):
                                 max=1,
                                 default=1)
 
-    parser = LindenmayerSystemParser()
-    
     def get_parsed(self):
-        p = self.parser.parse(self.rule)
-        
-        return (p[0], p[2:])
+        return parse_rule(self.rule)
 
 
 class ProductionShowExtended(bpy.types.Operator):
@@ -177,6 +183,10 @@ class LindenmayerSystem(bpy.types.Operator):
     bl_options = {'REGISTER', 'UNDO', 'PRESET'}
     
     start_symbol = StringProperty(name="Start Symbol", default="F")
+    context_ignore = StringProperty(name="Context Ignore",
+                                    default="",
+                                    description="Symbols skipped when matching the "
+                                                "context of a rule, like +-F")
     production = PointerProperty(type=ProductionItem, name="Production")
 
     iterations = IntProperty(name="Iterations",
@@ -184,6 +194,93 @@ class LindenmayerSystem(bpy.types.Operator):
                              max=8,
                              default=0,
                              description="Number of iterations for rule application")
+
+    stream_derivation = BoolProperty(name="Stream",
+                                     default=False,
+                                     description="Derive the system token by token instead of storing the whole word")
+
+    preview = BoolProperty(name="Preview",
+                           default=False,
+                           description="Build a reduced system within the token budget")
+
+    preview_budget = IntProperty(name="Budget",
+                                 min=1000,
+                                 default=PREVIEW_BUDGET,
+                                 description="Maximum number of tokens of the preview")
+
+    instancing = BoolProperty(name="Instances",
+                              default=False,
+                              description="Build repeated branches once and place linked duplicates")
+
+    simplify = BoolProperty(name="Simplify",
+                            default=False,
+                            description="Remove points where the curve keeps its direction")
+
+    simplify_tolerance = FloatProperty(name="Tolerance",
+                                       subtype="ANGLE",
+                                       unit='ROTATION',
+                                       min=0,
+                                       default=radians(1),
+                                       description="Largest direction change of a removed point")
+
+    output_type = EnumProperty(name="Output",
+                               items=[('BEZIER', "Bezier", "Bezier curve with smooth handles"),
+                                      ('POLY', "Poly", "Poly curve through the turtle positions"),
+                                      ('MESH', "Mesh", "Mesh with an edge per turtle step")],
+                               default='BEZIER',
+                               description="Type of the created object")
+
+    radius_falloff = FloatProperty(name="Radius Falloff",
+                                   min=0,
+                                   max=1,
+                                   precision=3,
+                                   step=0.1,
+                                   default=1,
+                                   description="Factor of the curve radius per branch depth")
+
+    max_tokens = IntProperty(name="Max Tokens",
+                             min=0,
+                             default=MAX_TOKENS,
+                             description="Largest derived word, 0 is unlimited")
+
+    max_points = IntProperty(name="Max Points",
+                             min=0,
+                             default=MAX_POINTS,
+                             description="Largest number of curve points, 0 is unlimited")
+
+    max_seconds = FloatProperty(name="Max Seconds",
+                                min=0,
+                                default=0,
+                                description="Longest derivation and turtle time, 0 is unlimited")
+
+    budget_action = EnumProperty(name="Over Budget",
+                                 items=[('CANCEL', "Cancel", "Cancel the operator"),
+                                        ('TRUNCATE', "Truncate",
+                                         "Use the last iteration that fits the budget")],
+                                 default='CANCEL',
+                                 description="What to do with a system exceeding the budget")
+
+    disk_cache = BoolProperty(name="Disk Cache",
+                              default=False,
+                              description="Keep derived words and geometry on disk, shared with "
+                                          "the command line")
+
+    disk_cache_directory = StringProperty(name="Directory",
+                                          subtype='DIR_PATH',
+                                          default="",
+                                          description="Directory of the disk cache, empty uses "
+                                                      "the user cache directory")
+
+    profile = BoolProperty(name="Profile",
+                           default=False,
+                           description="Measure time and memory of every stage, "
+                                       "the result is kept in lindenmayer_system.last_profile")
+
+    # Not a property, the derivation stays in Blender's process. A process
+    # pool would start Blender itself as worker where processes are spawned,
+    # and parallel stochastic words differ from the serial ones for a seed.
+    # Parallel derivation is left to the command line and batch.
+    processes = 0
     
     angle = FloatProperty(name="Angle", 
                           subtype="ANGLE",
@@ -232,21 +329,25 @@ class LindenmayerSystem(bpy.types.Operator):
         return True
         
     def execute(self, context):
-        self.apply_turtle(self)
+        global last_profile
+        profile = Profile() if self.profile else NO_PROFILE
+        try:
+            self.apply_turtle(self, profile)
+        except (SyntaxError, ValueError) as error:
+            self.report({'ERROR'}, str(error))
+            return {'CANCELLED'}
+        finally:
+            if self.profile:
+                last_profile = profile
+
+        if self.profile:
+            self.report({'INFO'}, profile.summary())
 
         return {'FINISHED'}
 
     def invoke(self, context, event):
         return self.execute(context)
         
-    def get_angle(self):
-        if self.random_angle != 0:
-            var = pi / 4 * self.random_angle
-            var = var * (1 - random() * 2)
-            return self.angle + var
-        else:
-            return self.angle
-
     def draw(self, context):
         settings = context.active_operator
         layout = self.layout
@@ -263,6 +364,27 @@ class LindenmayerSystem(bpy.types.Operator):
         row = column.row()
         row.prop(settings, "rule_seed")
         row.prop(settings, "iterations")
+        row = column.row()
+        row.prop(settings, "stream_derivation")
+        row = column.row()
+        row.prop(settings, "preview")
+        row.prop(settings, "preview_budget")
+        row = column.row()
+        row.prop(settings, "instancing")
+        row.prop(settings, "profile")
+        row = column.row()
+        row.prop(settings, "simplify")
+        row.prop(settings, "simplify_tolerance")
+
+        try:
+            start = [Token(type='SYMBOL', value=settings.start_symbol)]
+            statistics = analyze(start, get_rules(settings.productions), settings.iterations)
+        except (SyntaxError, ValueError):
+            statistics = None
+
+        if statistics and statistics.length > WORD_LENGTH_WARNING:
+            column.label("Word has {:.0f} million tokens".format(statistics.length / 1e6),
+                         icon='ERROR')
         column.separator()
 
         for idx, prop in enumerate(settings.productions):
@@ -272,152 +394,123 @@ class LindenmayerSystem(bpy.types.Operator):
         column.separator()
         column.label("Settings:")
         column.prop(settings, "start_symbol")
+        column.prop(settings, "context_ignore")
         column2 = column.column(align=True)
         column2.prop(settings, "angle")
         column2.prop(settings, "random_angle")
         column2.prop(settings, "angle_seed")
         column.prop(settings, "bevel_depth")
         column.prop(settings, "bevel_resolution")
+        row = column.row()
+        row.prop(settings, "output_type")
+        row.prop(settings, "radius_falloff")
         column.prop(settings, "basic_length")
 
-    def apply_turtle(self, settings):
-        direction = Vector((0, 0, 1))
-        stack = []
-
-        # Create start token
-        start = [Token(type='SYMBOL', value=settings.start_symbol)]
-
-        # Construct dictionary rules
-        rules = {}
-        for production in settings.productions:
-            l, r = production.get_parsed()
-            new_rule = Rule(l, r, production.probability)
-
-            if l.value in rules:
-                rules[l.value].append(new_rule)
-            else:
-                rules[l.value] = [new_rule]
-
-        system = apply_rules(start, rules, settings.iterations, self.rule_seed)
-        length = calculate_length(system, settings.basic_length)
-
-        turtle = TurtleMovement(direction, length)
-
-        # Get curve
-        curve = turtle.get_curve()
-        curve.bevel_depth = settings.bevel_depth
-        curve.bevel_resolution = settings.bevel_resolution
-
-        # Initialize seed for angle variations
-        seed(self.angle_seed)
-
-        for token in system:
-            if (token.type == 'SYMBOL'):
-                if (token.value == 'F'):
-                    turtle.forward(length)
-                    continue
-
-            if (token.type == 'DIRECTION'):
-                if (token.value == '+'):
-                    turtle.yaw(self.get_angle())
-                    continue
-                
-                if (token.value == '-'):
-                    turtle.yaw(-self.get_angle())
-                    continue
-                
-                if (token.value == '^'):
-                    turtle.pitch(self.get_angle())
-                    continue
-
-                if (token.value == '&'):
-                    turtle.pitch(-self.get_angle())
-                    continue
-
-                if (token.value == '\\'):
-                    turtle.roll(self.get_angle())
-                    continue
-
-                if (token.value == '/'):
-                    turtle.roll(-self.get_angle())
-                    continue
-
-            if (token.type == 'PUSH'):
-                stack.append(copy(turtle))
-                turtle.branch()
-                continue
-
-            if (token.type == 'POP'):
-                turtle.branch_end()
-                turtle = stack.pop()
-                continue
-
-def system_to_human(system):
-    string = ""
-    for token in system:
-        if token.type == 'SYMBOL' or token.type == 'DIRECTION' or token.type == 'PUSH' or token.type == 'POP':
-            string += token.value
-
-    return string
-
-def apply_single_rule(start, rules):
-    lsystem = []
-    for token in start:
-        if token.type == 'SYMBOL':
-            if token.value in rules:
-                rewrite_rule = rules[token.value]
-
-                if len(rewrite_rule) > 1:
-                    # Rules with probability
-                    rnd = random()
-                    probability = 0
-                    for r in rewrite_rule:
-                        probability += r.probability
-                        if rnd <= probability:
-                            lsystem.extend(r.right)
-                            break
-                else:
-                    lsystem.extend(rewrite_rule[0].right)
+        # Budget
+        column.separator()
+        column.label("Budget:")
+        row = column.row(align=True)
+        row.prop(settings, "max_tokens")
+        row.prop(settings, "max_points")
+        row = column.row()
+        row.prop(settings, "max_seconds")
+        row.prop(settings, "budget_action", text="")
+        row = column.row()
+        row.prop(settings, "disk_cache")
+        row.prop(settings, "disk_cache_directory", text="")
+
+    def apply_turtle(self, settings, profile=NO_PROFILE):
+        if settings.instancing and not settings.preview:
+            try:
+                instanced = generate_instanced(settings, profile)
+            except ValueError as error:
+                self.report({'WARNING'}, str(error))
             else:
-                lsystem.append(token)
+                if settings.simplify:
+                    before = instanced_point_count(instanced)
+                    with profile.stage('simplify'):
+                        instanced = simplify_instanced(instanced, settings.simplify_tolerance)
+                    self.report_simplified(before, instanced_point_count(instanced))
+                with profile.stage('build'):
+                    self.apply_instances(settings, instanced)
+                return
+
+        if settings.preview:
+            # First pass of the refinement, the full system is built without preview
+            with profile.stage('preview'):
+                geometry = next(refine(settings, settings.preview_budget))
+            profile.count(splines=len(geometry.offsets) - 1, points=point_count(geometry))
         else:
-            lsystem.append(token)
+            budget = settings_budget(settings)
+            if budget is not None:
+                iterations = budget_iterations(settings, budget)
+                if iterations != settings.iterations:
+                    self.report({'WARNING'}, "Reduced to {} iterations to stay within the "
+                                             "budget".format(iterations))
+            geometry = generate(settings, profile=profile)
+
+        if settings.simplify:
+            before = point_count(geometry)
+            with profile.stage('simplify'):
+                geometry = simplify(geometry, settings.simplify_tolerance)
+            self.report_simplified(before, point_count(geometry))
+            profile.count(simplified_points=point_count(geometry))
+
+        with profile.stage('build'):
+            link_object('LSystem', build_data(settings, geometry))
+
+    def report_simplified(self, before, after):
+        self.report({'INFO'}, "Simplified {} points to {}".format(before, after))
+
+    def apply_instances(self, settings, instanced):
+        parent = link_object('LSystem', build_data(settings, instanced.geometry))
+
+        # Every prototype is shared by all of its instances, so the radius
+        # of a prototype falls off from the start of its branch
+        data = []
+        for geometry in instanced.prototypes:
+            data.append(build_data(settings, geometry))
+
+        for prototype, translation, angle in zip(*instanced.instances):
+            obj = link_object('LSystemBranch', data[prototype])
+            obj.parent = parent
+            obj.location = translation.tolist()
+            obj.rotation_euler = (0, -angle, 0)
+
+def new_curve(settings):
+    """Create a curve with the bevel of settings"""
+    curve = bpy.data.curves.new('LSystem', 'CURVE')
+    curve.dimensions = '3D'
+    curve.fill_mode = 'FULL'
+    curve.resolution_u = 1
+    curve.bevel_depth = settings.bevel_depth
+    curve.bevel_resolution = settings.bevel_resolution
+
+    return curve
+
+def build_data(settings, geometry):
+    """Create the curve or mesh of geometry for the output type of settings"""
+    if settings.output_type == 'MESH':
+        return build_mesh(bpy.data.meshes.new('LSystem'), geometry)
+
+    radii = None
+    if settings.radius_falloff != 1:
+        radii = point_radii(geometry, settings.radius_falloff)
+
+    curve = new_curve(settings)
+    if settings.output_type == 'POLY':
+        return build_poly(curve, geometry, radii)
+
+    return build_curve(curve, geometry, radii)
+
+def link_object(name, data):
+    """Create an object for data at the cursor and link it to the scene"""
+    obj = bpy.data.objects.new(name, data)
+    obj.location = bpy.context.scene.cursor_location
+    bpy.context.scene.objects.link(obj)
+
+    return obj
 
-    return lsystem
-    
-def apply_rules(start, rules, times, rseed):
-    lsystem = start
-    seed(rseed)
-    for i in range(times):
-        lsystem = apply_single_rule(lsystem, rules)
-
-    return lsystem
-
-def calculate_length(system, basic_length):
-    cnt = 0
-    stack = []
-
-    for token in system:
-        if token.type == 'SYMBOL' and token.value == 'F' and not stack:
-            cnt+=1
-            continue
-
-        if token.type == 'PUSH':
-            stack.append('[')
-
-        if token.type == 'POP':
-            stack.pop()
-
-    return basic_length / cnt if cnt else 0
-        
-    
-def new_spline(curve, position):
-    curve.splines.new('BEZIER')
-    spline = curve.splines[-1]
-    spline.bezier_points[-1].co = position
-    return spline
-
-    
 def menu_func(self, context):
     self.layout.operator(LindenmayerSystem.bl_idname, text="L-system", icon='PLUGIN')
 
@@ -429,98 +522,5 @@ def unregister():
     bpy.utils.unregister_module(__name__)
     bpy.types.INFO_MT_curve_add.remove(menu_func)
 
-class TurtleMovement:
-
-    def __init__(self, vector, length):
-        self._has_changed = True
-        self._facing_direction = vector
-        self._basic_length = length
-
-        # Create new curve object
-        self._curve = bpy.data.curves.new('LSystem', 'CURVE')
-        self._curve.dimensions = '3D'
-        self._curve.fill_mode = 'FULL'
-        self._curve.resolution_u = 1
-
-        self._object = bpy.data.objects.new('LSystem', self._curve)
-        self._object.location = bpy.context.scene.cursor_location
-        bpy.context.scene.objects.link(self._object)
-        
-        self.branch_at(Vector((0, 0, 0)))
-        
-    def forward(self, amount):
-        direction = self._facing_direction
-        direction = direction * self._basic_length
-        new_position = self._spline.bezier_points[-1].co + direction
-
-        if self.has_changed() or len(self._spline.bezier_points) == 1:
-            # Add second point
-            self._spline.bezier_points.add()
-
-        p1 = self._spline.bezier_points[-1]
-        p2 = self._spline.bezier_points[-2]
-
-        p1.co = new_position
-        new_handle = direction / 5
-
-        p1.handle_left = p1.co - new_handle
-        handle_direction = (p2.co - p1.co ).normalized()
-        handle_direction = handle_direction * self._basic_length / 5
-        p1.handle_right = p1.co - handle_direction
-        p2.handle_right = p2.co + new_handle
-
-    def branch_at(self, position):
-        """Creates a branch in curve at position
-        
-        Arguments:
-        curve    -- Blender curve
-        position -- Starting point of the new branch
-        """
-    
-        # New spline (automatically creates a bezier point)
-        self._spline = new_spline(self._curve, position)
-        
-        p = self._spline.bezier_points[-1]
-        p.handle_left = p.co - self._facing_direction * self._basic_length / 5
-            
-    def branch(self):
-        self.branch_at(self._spline.bezier_points[-1].co)
-        
-
-    def branch_end(self):
-        if len(self._spline.bezier_points) == 1:
-            self.remove_spline()
-
-    # Just temporary
-    def remove_spline(self):
-        self._curve.splines.remove(self._spline)
-
-    # Just temporary
-    def get_curve(self):
-        return self._curve
-
-    def rotate(self, amount, axis):
-        self._has_changed = True
-        self._facing_direction = self._facing_direction * Matrix.Rotation(amount, 3, axis)
-            
-    def yaw(self, amount):
-        self._has_changed = True
-        self.rotate(amount, 'Y')
-
-    def pitch(self, amount):
-        self._has_changed = True
-        self.rotate(amount, 'X')
-
-    def roll(self, amount):
-        self._has_changed = True
-        self.rotate(amount, 'Z')
-
-    def has_changed(self):
-        if self._has_changed:
-            self._has_changed = False
-            return True
-        else:
-            return False
-            
 if __name__ == '__main__':
     register()
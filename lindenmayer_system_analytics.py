@@ -0,0 +1,216 @@
+import unittest
+from collections import namedtuple, defaultdict
+from lindenmayer_system_parser import Token
+from lindenmayer_system_derivation import apply_rules, rules_from_strings, rule_probabilities
+
+FORWARD = Token('SYMBOL', 'F')
+PUSH = Token('PUSH', '[')
+
+Statistics = namedtuple('Statistics', ['counts', 'length', 'segments', 'top_level_segments',
+                                       'branches', 'depth', 'exact'])
+Statistics.__doc__ = """Properties of a derived system
+
+counts             -- token -> number of occurrences
+length             -- number of tokens of the word
+segments           -- number of F tokens
+top_level_segments -- number of F tokens outside of any branch
+branches           -- number of [ tokens
+depth              -- maximum bracket depth (an upper bound for stochastic systems)
+exact              -- False if the numbers are expectations of a stochastic system
+"""
+
+
+def _right_side(tokens):
+    return [t for t in tokens if t.type != 'EMPTY']
+
+
+def growth_matrices(rules):
+    """Growth matrices of a rule dictionary
+
+    Returns (matrix, top_level, exact). matrix[a][b] is the (expected)
+    number of b in the right side of a, top_level only counts the b outside
+    of brackets. Tokens without a rule are not part of the matrices and
+    map to themselves.
+    """
+    matrix = {}
+    top_level = {}
+    exact = True
+
+    for symbol, rewrite_rule in rules.items():
+        row = defaultdict(float if len(rewrite_rule) > 1 else int)
+        top_row = defaultdict(float if len(rewrite_rule) > 1 else int)
+
+        if len(rewrite_rule) > 1:
+            exact = False
+            choices = [(weight, r.right) for weight, r in
+                       zip(rule_probabilities(symbol, rewrite_rule), rewrite_rule)]
+        else:
+            choices = [(1, rewrite_rule[0].right)]
+
+        for weight, right in choices:
+            depth = 0
+            for token in _right_side(right):
+                row[token] += weight
+                if depth == 0:
+                    top_row[token] += weight
+                if token.type == 'PUSH':
+                    depth += 1
+                elif token.type == 'POP':
+                    depth -= 1
+
+        matrix[Token('SYMBOL', symbol)] = row
+        top_level[Token('SYMBOL', symbol)] = top_row
+
+    return matrix, top_level, exact
+
+
+def _multiply(vector, matrix):
+    result = defaultdict(int)
+    for token, count in vector.items():
+        if token in matrix:
+            for other, weight in matrix[token].items():
+                result[other] += count * weight
+        else:
+            result[token] += count
+
+    return result
+
+
+def _depths(start, rules, times):
+    """Maximum bracket depth of the derivation of start"""
+    rights = {Token('SYMBOL', s): [_right_side(r.right) for r in rewrite_rule]
+              for s, rewrite_rule in rules.items()}
+
+    depth = {}
+
+    def word_depth(word, level):
+        open_brackets = 0
+        result = 0
+        for token in word:
+            if token.type == 'PUSH':
+                open_brackets += 1
+                result = max(result, open_brackets)
+            elif token.type == 'POP':
+                open_brackets -= 1
+            elif level and token in rights:
+                result = max(result, open_brackets + symbol_depth(token, level))
+
+        return result
+
+    def symbol_depth(token, level):
+        key = (token, level)
+        if key not in depth:
+            depth[key] = max(word_depth(right, level - 1) for right in rights[token])
+        return depth[key]
+
+    return word_depth(_right_side(start), times)
+
+
+def analyze(start, rules, times):
+    """Compute Statistics of a system without deriving it"""
+    matrix, top_level, exact = growth_matrices(rules)
+
+    counts = defaultdict(int)
+    top_counts = defaultdict(int)
+    depth = 0
+    for token in _right_side(start):
+        counts[token] += 1
+        if depth == 0:
+            top_counts[token] += 1
+        if token.type == 'PUSH':
+            depth += 1
+        elif token.type == 'POP':
+            depth -= 1
+
+    for i in range(times):
+        counts = _multiply(counts, matrix)
+        top_counts = _multiply(top_counts, top_level)
+
+    return Statistics(counts=dict(counts),
+                      length=sum(counts.values()),
+                      segments=counts.get(FORWARD, 0),
+                      top_level_segments=top_counts.get(FORWARD, 0),
+                      branches=counts.get(PUSH, 0),
+                      depth=_depths(start, rules, times),
+                      exact=exact)
+
+
+def count_top_level_segments(system):
+    """Number of F tokens outside of any branch of a derived system"""
+    cnt = 0
+    stack = []
+
+    for token in system:
+        if token.type == 'SYMBOL' and token.value == 'F' and not stack:
+            cnt+=1
+            continue
+
+        if token.type == 'PUSH':
+            stack.append('[')
+
+        if token.type == 'POP':
+            stack.pop()
+
+    return cnt
+
+
+def calculate_length(system, basic_length):
+    cnt = count_top_level_segments(system)
+    return basic_length / cnt if cnt else 0
+
+
+def segment_length(statistics, basic_length):
+    """Length of a single F so the top level path has basic_length"""
+    cnt = statistics.top_level_segments
+    return basic_length / cnt if cnt else 0
+
+
+class TestAnalyticsFunctions(unittest.TestCase):
+    def check(self, start, strings, times):
+        rules = rules_from_strings(strings)
+        start = [Token('SYMBOL', s) for s in start]
+        word = list(apply_rules(start, rules, times, 0))
+        statistics = analyze(start, rules, times)
+
+        self.assertTrue(statistics.exact)
+        self.assertEqual(statistics.length, len(word))
+        self.assertEqual(statistics.segments, word.count(FORWARD))
+        self.assertEqual(statistics.branches, word.count(PUSH))
+        self.assertEqual(segment_length(statistics, 2.0), calculate_length(word, 2.0))
+
+        depth = 0
+        max_depth = 0
+        for token in word:
+            depth += {'PUSH': 1, 'POP': -1}.get(token.type, 0)
+            max_depth = max(max_depth, depth)
+        self.assertEqual(statistics.depth, max_depth)
+
+    def test_flower_f(self):
+        self.check('X', ['X:=F-[[X]+X]+F[+FX]-X', 'F:=FF'], 5)
+
+    def test_flower_c(self):
+        self.check('F', ['F:=FF-[-F+F+F]+[+F-F-F]'], 3)
+
+    def test_no_iterations(self):
+        self.check('F', ['F:=F[+F]F'], 0)
+
+    def test_erase(self):
+        self.check('X', ['X:=F[X]Y', 'Y:='], 4)
+
+    def test_expected_counts(self):
+        rules = rules_from_strings(['F:=FF', 'F:=F'], [0.5, 0.5])
+        statistics = analyze([FORWARD], rules, 2)
+        self.assertFalse(statistics.exact)
+        self.assertAlmostEqual(statistics.segments, 1.5 ** 2)
+
+    def test_expected_counts_normalized(self):
+        rules = rules_from_strings(['F:=FF', 'F:=F'], [0.2, 0.2])
+        self.assertAlmostEqual(analyze([FORWARD], rules, 2).segments, 1.5 ** 2)
+
+    def test_large(self):
+        rules = rules_from_strings(['F:=FFFFF'])
+        self.assertEqual(analyze([FORWARD], rules, 12).length, 5 ** 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
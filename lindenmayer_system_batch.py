@@ -0,0 +1,138 @@
+"""Generate many Lindenmayer systems in parallel
+
+Usage: python lindenmayer_system_batch.py jobs.csv output_directory
+
+Every line of the job file is preset,rule_seed,angle_seed[,iterations].
+Every job is written to its own file in the binary geometry format, the
+workers only send back the file name and a few counts.
+"""
+import os
+import sys
+import csv
+import argparse
+import tempfile
+import unittest
+from multiprocessing import Pool
+from collections import namedtuple
+from lindenmayer_system_core import load_preset, generate, PRESETS
+from lindenmayer_system_export import write_binary, read_binary_file
+
+Job = namedtuple('Job', ['preset', 'rule_seed', 'angle_seed', 'iterations'])
+Job.__new__.__defaults__ = (None,)
+
+Result = namedtuple('Result', ['job', 'path', 'points', 'splines'])
+
+
+def job_filename(job):
+    name = os.path.splitext(os.path.basename(job.preset))[0]
+    iterations = '' if job.iterations is None else '_i{}'.format(job.iterations)
+    return '{}_r{}_a{}{}.lsg'.format(name, job.rule_seed, job.angle_seed, iterations)
+
+
+def run_job(job, output_directory):
+    """Generate a single job and write its geometry, returns a Result"""
+    settings = load_preset(job.preset)
+    settings.rule_seed = job.rule_seed
+    settings.angle_seed = job.angle_seed
+    if job.iterations is not None:
+        settings.iterations = job.iterations
+
+    # Jobs rarely repeat, workers do not keep their words
+    geometry = generate(settings, cache=False)
+    path = os.path.join(output_directory, job_filename(job))
+    with open(path, 'wb') as f:
+        write_binary(f, geometry)
+
+    return Result(job, path, len(geometry.points) // 3, len(geometry.offsets) - 1)
+
+
+def run_batch(jobs, output_directory, processes=None):
+    """Run jobs on a pool of processes, returns the Results in job order
+
+    The seeds of a job fully determine its output, so the result does not
+    depend on the worker that ran it.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    arguments = [(job, output_directory) for job in jobs]
+
+    if processes == 1:
+        return [run_job(*a) for a in arguments]
+
+    with Pool(processes) as pool:
+        return pool.starmap(run_job, arguments, chunksize=1)
+
+
+def read_jobs(f):
+    """Jobs of the lines of a job file
+
+    Raises ValueError naming the line of the first row without a preset
+    and integer seeds and iterations.
+    """
+    jobs = []
+    reader = csv.reader(f)
+    for row in reader:
+        if not row or row[0].startswith('#'):
+            continue
+
+        try:
+            if not 3 <= len(row) <= 4 or not row[0].strip():
+                raise ValueError("expected preset,rule_seed,angle_seed[,iterations]")
+            preset, rule_seed, angle_seed = row[0].strip(), int(row[1]), int(row[2])
+            iterations = int(row[3]) if len(row) > 3 and row[3].strip() else None
+        except ValueError as error:
+            raise ValueError("Invalid job on line {}: {}".format(reader.line_num, error))
+        jobs.append(Job(preset, rule_seed, angle_seed, iterations))
+
+    return jobs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate many Lindenmayer systems in parallel")
+    parser.add_argument('jobs', help="CSV file with preset,rule_seed,angle_seed[,iterations]")
+    parser.add_argument('output', help="directory for the generated geometry")
+    parser.add_argument('-j', '--processes', type=int, help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.jobs, newline='') as f:
+            jobs = read_jobs(f)
+    except (OSError, ValueError) as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    for result in run_batch(jobs, args.output, args.processes):
+        print("{} {} points {} splines".format(result.path, result.points, result.splines))
+
+    return 0
+
+
+class TestBatchFunctions(unittest.TestCase):
+    def test_workers_deterministic(self):
+        preset = os.path.join(PRESETS, 'flower_d.py')
+        jobs = [Job(preset, rule_seed, angle_seed, 3)
+                for rule_seed in range(2) for angle_seed in range(2)]
+
+        with tempfile.TemporaryDirectory() as serial, tempfile.TemporaryDirectory() as parallel:
+            expected = run_batch(jobs, serial, 1)
+            results = run_batch(list(reversed(jobs)), parallel, 2)
+
+            for a, b in zip(expected, reversed(results)):
+                self.assertEqual(a.job, b.job)
+                with open(a.path, 'rb') as f, open(b.path, 'rb') as g:
+                    self.assertEqual(f.read(), g.read())
+
+            geometry = read_binary_file(results[0].path)
+            self.assertEqual(len(geometry.points) // 3, results[0].points)
+
+    def test_read_jobs(self):
+        jobs = read_jobs(['# preset,rule,angle', 'a.py, 1, 2', 'b.py,3,4,5'])
+        self.assertEqual(jobs, [Job('a.py', 1, 2), Job('b.py', 3, 4, 5)])
+
+    def test_read_jobs_errors(self):
+        for line in ('a.py,1', 'a.py,x,2', 'a.py,1,2,three', ',1,2', 'a.py,1,2,3,4'):
+            with self.assertRaisesRegex(ValueError, 'line 2'):
+                read_jobs(['a.py,1,2', line])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""Limits on the size and time of a single generation
+
+A Budget is checked while the word is derived and while the turtle walks
+it, exceeding it raises BudgetExceeded before the memory is spent. The
+number of generations that fit can be predicted from the Statistics of a
+system without deriving it.
+"""
+import time
+import unittest
+from collections import namedtuple
+
+# Tokens of the derived word, 0 is unlimited
+MAX_TOKENS = 50000000
+
+# Points of the created curve, 0 is unlimited
+MAX_POINTS = 5000000
+
+# Turtle actions between two checks of the budget
+CHECK_INTERVAL = 1 << 16
+
+
+class BudgetExceeded(ValueError):
+    """Raised when a generation exceeds its Budget
+
+    resource -- 'tokens', 'points' or 'seconds'
+    limit    -- the limit of the Budget
+    value    -- the value that exceeded it, a prediction if predicted
+    """
+    def __init__(self, resource, limit, value, predicted=False):
+        self.resource = resource
+        self.limit = limit
+        self.value = value
+        self.predicted = predicted
+        if predicted:
+            message = "System would need {} {}, the budget is {}"
+        else:
+            message = "System reached {} {}, the budget is {}"
+        super().__init__(message.format(_amount(value), resource, _amount(limit)))
+
+
+def _amount(value):
+    return '{:.2f}'.format(value) if isinstance(value, float) else str(value)
+
+
+class Budget:
+    """Maximum tokens, points and seconds of a generation
+
+    A limit of 0 or None is unlimited. The time is measured from the
+    creation of the Budget.
+    """
+    def __init__(self, max_tokens=None, max_points=None, max_seconds=None):
+        self.max_tokens = max_tokens or None
+        self.max_points = max_points or None
+        self.max_seconds = max_seconds or None
+        self.started = time.perf_counter()
+
+    def __bool__(self):
+        return any((self.max_tokens, self.max_points, self.max_seconds))
+
+    def check(self, tokens=0, points=0):
+        """Raise BudgetExceeded if tokens, points or the time since the
+        creation exceed the budget
+        """
+        if self.max_tokens and tokens > self.max_tokens:
+            raise BudgetExceeded('tokens', self.max_tokens, tokens)
+        if self.max_points and points > self.max_points:
+            raise BudgetExceeded('points', self.max_points, points)
+        if self.max_seconds:
+            elapsed = time.perf_counter() - self.started
+            if elapsed > self.max_seconds:
+                raise BudgetExceeded('seconds', self.max_seconds, elapsed)
+
+    def check_statistics(self, statistics):
+        """Raise BudgetExceeded if the predicted size of a system exceeds
+        the budget
+        """
+        if self.max_tokens and statistics.length > self.max_tokens:
+            raise BudgetExceeded('tokens', self.max_tokens, statistics.length, True)
+        points = predicted_points(statistics)
+        if self.max_points and points > self.max_points:
+            raise BudgetExceeded('points', self.max_points, points, True)
+
+    def fits(self, statistics):
+        try:
+            self.check_statistics(statistics)
+        except BudgetExceeded:
+            return False
+        return True
+
+
+def predicted_points(statistics):
+    """Upper bound of the points of a system, every F and every branch
+    adds at most one point
+    """
+    return statistics.segments + statistics.branches + 1
+
+
+class TestBudgetFunctions(unittest.TestCase):
+    Statistics = namedtuple('Statistics', ['length', 'segments', 'branches'])
+
+    def test_check(self):
+        budget = Budget(max_tokens=10, max_points=5)
+        budget.check(tokens=10, points=5)
+        with self.assertRaises(BudgetExceeded) as context:
+            budget.check(tokens=11)
+        self.assertEqual(context.exception.resource, 'tokens')
+        self.assertRaises(BudgetExceeded, budget.check, points=6)
+
+    def test_unlimited(self):
+        budget = Budget(0, 0, 0)
+        self.assertFalse(budget)
+        budget.check(tokens=10 ** 12, points=10 ** 12)
+        self.assertTrue(budget.fits(self.Statistics(10 ** 12, 10 ** 12, 0)))
+
+    def test_time(self):
+        budget = Budget(max_seconds=1e-9)
+        time.sleep(0.001)
+        self.assertRaisesRegex(BudgetExceeded, 'seconds', budget.check)
+
+    def test_statistics(self):
+        budget = Budget(max_tokens=100, max_points=50)
+        self.assertTrue(budget.fits(self.Statistics(100, 40, 9)))
+        self.assertFalse(budget.fits(self.Statistics(101, 40, 9)))
+        with self.assertRaisesRegex(BudgetExceeded, 'would need 51 points'):
+            budget.check_statistics(self.Statistics(100, 40, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
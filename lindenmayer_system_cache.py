@@ -0,0 +1,86 @@
+import unittest
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entries
+
+    max_size -- upper bound for the summed size of all entries
+    size     -- function returning the size of a value, defaults to 1 per
+                entry so max_size is the number of entries
+    """
+    def __init__(self, max_size, size=None):
+        self.max_size = max_size
+        self.size = size or (lambda value: 1)
+        self.current_size = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        try:
+            self._entries.move_to_end(key)
+        except KeyError:
+            return default
+
+        return self._entries[key][0]
+
+    def put(self, key, value):
+        """Insert value, values larger than the cache are not stored"""
+        size = self.size(value)
+        self.discard(key)
+        if size > self.max_size:
+            return
+
+        self._entries[key] = (value, size)
+        self.current_size += size
+
+        while self.current_size > self.max_size:
+            key, (value, size) = self._entries.popitem(last=False)
+            self.current_size -= size
+
+    def discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_size -= entry[1]
+
+    def clear(self):
+        self._entries.clear()
+        self.current_size = 0
+
+
+class TestCacheFunctions(unittest.TestCase):
+    def test_get_put(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+
+    def test_evict_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+
+    def test_size_bound(self):
+        cache = LRUCache(10, len)
+        cache.put('a', b'12345')
+        cache.put('b', b'123456')
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.current_size, 6)
+
+    def test_too_large(self):
+        cache = LRUCache(4, len)
+        cache.put('a', b'12345')
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
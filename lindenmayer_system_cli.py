@@ -0,0 +1,200 @@
+"""Generate Lindenmayer system geometry from operator presets
+
+Usage: python lindenmayer_system_cli.py preset.py output.obj|output.lsg
+"""
+import io
+import os
+import sys
+import argparse
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+from lindenmayer_system_profile import Profile, NO_PROFILE
+from lindenmayer_system_core import load_preset, generate, generate_instanced
+from lindenmayer_system_export import write_obj, write_binary, write_instanced_binary
+from lindenmayer_system_simplify import simplify, simplify_instanced, point_count
+from lindenmayer_system_instancing import point_count as instanced_point_count
+
+
+def write_geometry(path, geometry, format=None):
+    """Write geometry to path, the format defaults to the file extension"""
+    if format is None:
+        format = 'obj' if path.endswith('.obj') else 'lsg'
+
+    if format == 'obj':
+        with open(path, 'w') as f:
+            write_obj(f, geometry)
+    else:
+        with open(path, 'wb') as f:
+            write_binary(f, geometry)
+
+
+def apply_overrides(settings, args):
+    for name in ('iterations', 'rule_seed', 'angle_seed', 'random_angle', 'processes',
+                 'max_tokens', 'max_points', 'max_seconds'):
+        value = getattr(args, name)
+        if value is not None:
+            setattr(settings, name, value)
+    if args.truncate:
+        settings.budget_action = 'TRUNCATE'
+    if args.disk_cache or args.cache_dir:
+        settings.disk_cache = True
+        settings.disk_cache_directory = args.cache_dir or ''
+
+
+def add_setting_arguments(parser):
+    parser.add_argument('--iterations', type=int, help="override the number of iterations")
+    parser.add_argument('--rule-seed', type=int, help="override the rule seed")
+    parser.add_argument('--angle-seed', type=int, help="override the angle seed")
+    parser.add_argument('--random-angle', type=float, help="override the angle variation")
+    parser.add_argument('--processes', type=int, help="derive a single system on this many "
+                                                      "processes")
+    parser.add_argument('--max-tokens', type=int, help="largest derived word, 0 is unlimited")
+    parser.add_argument('--max-points', type=int, help="largest number of points, "
+                                                       "0 is unlimited")
+    parser.add_argument('--max-seconds', type=float, help="longest derivation and turtle "
+                                                          "time, 0 is unlimited")
+    parser.add_argument('--truncate', action='store_true',
+                        help="derive the last iteration within the budget instead of failing")
+    parser.add_argument('--disk-cache', action='store_true',
+                        help="reuse words and geometry from the disk cache shared with Blender")
+    parser.add_argument('--cache-dir', help="directory of the disk cache, implies --disk-cache")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate Lindenmayer system geometry "
+                                                 "from an operator preset")
+    parser.add_argument('preset', help="preset file of the L-system operator")
+    parser.add_argument('output', help="output file, .obj for OBJ polylines, "
+                                       "otherwise the binary format")
+    parser.add_argument('--format', choices=('obj', 'lsg'), help="output format")
+    parser.add_argument('--instances', action='store_true',
+                        help="write repeated branches once with their placements, "
+                             "binary format only")
+    parser.add_argument('--simplify', type=float, metavar='TOLERANCE',
+                        help="remove points where the curve turns by at most TOLERANCE "
+                             "radians and print the point counts")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="write the time, memory and counts of every stage as JSON "
+                             "to FILE, - prints them")
+    add_setting_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.instances and (args.format == 'obj' or
+                           args.format is None and args.output.endswith('.obj')):
+        parser.error("--instances needs the binary format")
+
+    profile = Profile() if args.profile else NO_PROFILE
+    try:
+        settings = load_preset(args.preset)
+        apply_overrides(settings, args)
+        if args.instances:
+            instanced = generate_instanced(settings, profile)
+        else:
+            geometry = generate(settings, profile=profile)
+    except (OSError, SyntaxError, ValueError) as error:
+        # Unreadable or invalid presets and rules, systems that can not be
+        # instanced and BudgetExceeded
+        print(error, file=sys.stderr)
+        return 1
+
+    if args.instances:
+        if args.simplify is not None:
+            before = instanced_point_count(instanced)
+            with profile.stage('simplify'):
+                instanced = simplify_instanced(instanced, args.simplify)
+            print("Simplified {} points to {}".format(before, instanced_point_count(instanced)))
+        with profile.stage('write'), open(args.output, 'wb') as f:
+            write_instanced_binary(f, instanced)
+    else:
+        if args.simplify is not None:
+            before = point_count(geometry)
+            with profile.stage('simplify'):
+                geometry = simplify(geometry, args.simplify)
+            print("Simplified {} points to {}".format(before, point_count(geometry)))
+        with profile.stage('write'):
+            write_geometry(args.output, geometry, args.format)
+
+    if args.profile == '-':
+        print(profile.to_json())
+    elif args.profile:
+        with open(args.profile, 'w') as f:
+            f.write(profile.to_json())
+
+    return 0
+
+
+PRESET = """import bpy
+op = bpy.context.active_operator
+op.start_symbol = 'X'
+op.iterations = 3
+op.productions.clear()
+item_sub_1 = op.productions.add()
+item_sub_1.rule = {!r}
+"""
+
+
+class TestCliFunctions(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write_preset(self, rule=None, source=None):
+        path = os.path.join(self.directory, 'preset.py')
+        with open(path, 'w') as f:
+            f.write(PRESET.format(rule) if source is None else source)
+        return path
+
+    def run_main(self, *argv):
+        """Exit status and standard error of main"""
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            status = main(list(argv))
+        return status, stderr.getvalue()
+
+    def test_generate(self):
+        output = os.path.join(self.directory, 'out.lsg')
+        preset = self.write_preset('X:=F[+X]F[-X]+X')
+        self.assertEqual(self.run_main(preset, output), (0, ''))
+        self.assertTrue(os.path.getsize(output))
+        self.assertEqual(self.run_main(preset, output, '--instances'), (0, ''))
+
+    def test_preset_errors(self):
+        output = os.path.join(self.directory, 'out.lsg')
+        status, error = self.run_main(os.path.join(self.directory, 'missing.py'), output)
+        self.assertEqual(status, 1)
+        self.assertIn('missing.py', error)
+
+        preset = self.write_preset(source="print('preset')\n")
+        for argv in ([preset, output], [preset, output, '--instances']):
+            status, error = self.run_main(*argv)
+            self.assertEqual(status, 1)
+            self.assertIn('Unsupported statement', error)
+
+        status, error = self.run_main(self.write_preset(source="op.iterations = (\n"), output)
+        self.assertEqual(status, 1)
+        self.assertFalse(os.path.exists(output))
+
+    def test_system_errors(self):
+        output = os.path.join(self.directory, 'out.lsg')
+        preset = self.write_preset('X:=F[+X')
+        for argv in ([preset, output], [preset, output, '--instances']):
+            status, error = self.run_main(*argv)
+            self.assertEqual(status, 1)
+            self.assertIn('Invalid rule', error)
+
+        preset = self.write_preset('X:=F[+X]F[-X]+X')
+        status, error = self.run_main(preset, output, '--max-tokens', '10')
+        self.assertEqual(status, 1)
+        self.assertIn('budget', error)
+
+        # Parametric systems can not be instanced
+        status, error = self.run_main(self.write_preset('X:=F(2)[+X]X'), output, '--instances')
+        self.assertEqual(status, 1)
+        self.assertIn('Instances', error)
+        self.assertFalse(os.path.exists(output))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,764 @@
+"""Headless Lindenmayer system generation
+
+Everything needed to turn operator settings into turtle geometry without
+Blender: the operator settings as plain objects, a loader for the preset
+files and generate, which runs derivation and turtle interpretation.
+"""
+import ast
+import os
+import tempfile
+import unittest
+import numpy as np
+from types import SimpleNamespace
+from math import radians
+from random import Random
+from lindenmayer_system_parser import Token, parse_rule, parse_word
+from lindenmayer_system_derivation import (Rule, SymbolTable, apply_rules, stream_rules,
+                                           prune_rules, pruned_length, is_parametric,
+                                           compile_rules)
+from lindenmayer_system_parametric import (ParametricWord, apply_parametric_rules,
+                                           top_level_length, turtle_parameters)
+from lindenmayer_system_parallel import apply_rules_parallel
+from lindenmayer_system_analytics import analyze, count_top_level_segments
+from lindenmayer_system_cache import LRUCache
+from lindenmayer_system_turtle import interpret, angle_function
+from lindenmayer_system_instancing import can_instance, instance, flatten
+from lindenmayer_system_random import random_stream
+from lindenmayer_system_profile import Profile, NO_PROFILE
+from lindenmayer_system_budget import Budget, BudgetExceeded, MAX_TOKENS, MAX_POINTS
+from lindenmayer_system_store import Store, content_key
+
+
+# Tokens of the word derived for a preview
+PREVIEW_BUDGET = 200000
+
+
+class Production:
+    """Plain counterpart of the ProductionItem property group"""
+    def __init__(self, rule="F:=F", probability=1.0):
+        self.rule = rule
+        self.probability = probability
+
+
+class Productions(list):
+    """List with the add and clear methods of a Blender collection"""
+    def add(self):
+        self.append(Production())
+        return self[-1]
+
+
+class Settings:
+    """Plain counterpart of the LindenmayerSystem operator properties"""
+    def __init__(self, **kwargs):
+        self.start_symbol = "F"
+        # Symbols and directions skipped by the contexts of rules
+        self.context_ignore = ""
+        self.production = Production()
+        self.productions = Productions()
+        self.iterations = 0
+        self.stream_derivation = False
+        self.preview = False
+        self.preview_budget = PREVIEW_BUDGET
+        self.instancing = False
+        # Derive on this many processes, 0 derives in this process
+        self.processes = 0
+        self.angle = radians(60)
+        self.rule_seed = 0
+        self.angle_seed = 0
+        self.random_angle = 0
+        self.bevel_depth = 0
+        self.bevel_resolution = 0
+        self.basic_length = 2
+        self.output_type = 'BEZIER'
+        self.radius_falloff = 1
+        # Limits of generate, 0 is unlimited
+        self.max_tokens = MAX_TOKENS
+        self.max_points = MAX_POINTS
+        self.max_seconds = 0
+        # 'CANCEL' raises BudgetExceeded, 'TRUNCATE' derives fewer iterations
+        self.budget_action = 'CANCEL'
+        # Keep words and geometry in a Store, an empty directory is the default
+        self.disk_cache = False
+        self.disk_cache_directory = ''
+
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+
+def _evaluate(node, names):
+    if isinstance(node, ast.Name):
+        return names[node.id]
+
+    if isinstance(node, ast.Attribute) and not node.attr.startswith('_'):
+        return getattr(_evaluate(node.value, names), node.attr)
+
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and
+        node.func.attr in ('add', 'clear') and not node.args and not node.keywords):
+        return getattr(_evaluate(node.func.value, names), node.func.attr)()
+
+    return ast.literal_eval(node)
+
+
+def load_preset(path):
+    """Read an operator preset file into Settings
+
+    Presets are Python scripts setting attributes of
+    bpy.context.active_operator. They are interpreted statement by statement
+    instead of being executed, only assignments of literals and the add and
+    clear calls of the productions collection are supported.
+    """
+    with open(path) as f:
+        source = f.read()
+
+    settings = Settings()
+    bpy = SimpleNamespace(context=SimpleNamespace(active_operator=settings))
+    names = {'bpy': bpy}
+
+    for statement in ast.parse(source, path).body:
+        try:
+            if isinstance(statement, ast.Import):
+                continue
+            elif isinstance(statement, ast.Expr):
+                _evaluate(statement.value, names)
+            elif isinstance(statement, ast.Assign) and len(statement.targets) == 1:
+                target = statement.targets[0]
+                value = _evaluate(statement.value, names)
+                if isinstance(target, ast.Name):
+                    names[target.id] = value
+                elif isinstance(target, ast.Attribute):
+                    setattr(_evaluate(target.value, names), target.attr, value)
+                else:
+                    raise ValueError()
+            else:
+                raise ValueError()
+        except (ValueError, KeyError, AttributeError):
+            raise ValueError("Unsupported statement in {} line {}".format(path, statement.lineno))
+
+    return settings
+
+
+def get_rules(productions):
+    """Construct the rule dictionary from productions
+
+    All rules are validated before the dictionary is built, the SyntaxError
+    names the first invalid rule. Parsed rules come from the parse cache.
+    """
+    parsed = []
+    for production in productions:
+        try:
+            parsed.append((parse_rule(production.rule), production.probability))
+        except SyntaxError as error:
+            raise SyntaxError("Invalid rule {!r}: {}".format(production.rule, error))
+
+    rules = {}
+    for p, probability in parsed:
+        new_rule = Rule(p.left, p.right, probability, *p[2:])
+
+        if p.left.value in rules:
+            rules[p.left.value].append(new_rule)
+        else:
+            rules[p.left.value] = [new_rule]
+
+    return rules
+
+
+# Bytes of derived words kept for interactive changes of the interpretation
+DERIVATION_CACHE_SIZE = 1 << 27
+
+# Bytes of geometry kept for changes that do not touch the geometry
+GEOMETRY_CACHE_SIZE = 1 << 27
+
+
+def word_bytes(word):
+    """Bytes of an encoded word, with the arguments of a ParametricWord"""
+    size = len(word.codes)
+    if isinstance(word, ParametricWord):
+        size += word.counts.nbytes + word.values.nbytes
+    return size
+
+
+_derivations = LRUCache(DERIVATION_CACHE_SIZE, lambda derived: word_bytes(derived[0]))
+_geometries = LRUCache(GEOMETRY_CACHE_SIZE,
+                       lambda geometry: sum(a.nbytes for a in geometry if a is not None))
+
+
+def rules_key(rules):
+    """Hashable key of a rule dictionary"""
+    return tuple(sorted((symbol, tuple((r.right,) + r[2:] for r in rewrite_rule))
+                        for symbol, rewrite_rule in rules.items()))
+
+
+_stores = {}
+
+
+def clear_caches():
+    """Drop all derived words and geometry kept in memory by generate"""
+    _derivations.clear()
+    _geometries.clear()
+
+
+def get_store(settings):
+    """Store of settings or None if the disk cache is disabled"""
+    if not settings.disk_cache:
+        return None
+
+    directory = settings.disk_cache_directory or None
+    if directory not in _stores:
+        _stores[directory] = Store(directory)
+    return _stores[directory]
+
+
+def _read_only(geometry):
+    for array in geometry:
+        if array is not None:
+            array.flags.writeable = False
+    return geometry
+
+
+def parametric_settings(settings, rules):
+    """True if settings describe a parametric system, its start word or
+    rules have parameters
+    """
+    return is_parametric(rules) or '(' in settings.start_symbol
+
+
+def _derive(start, rules, settings, rule_rng, budget=None):
+    """Derive the word of settings, returns (word, top level segments)
+
+    Deterministic systems get the segment count without derivation and
+    are derived in this process, processes only applies to stochastic ones.
+    Parametric systems are derived in this process whatever the settings
+    of the stream and the processes, their segments are the summed lengths
+    of the top level.
+    """
+    if parametric_settings(settings, rules):
+        system = apply_parametric_rules(*parse_word(settings.start_symbol), rules=rules,
+                                        times=settings.iterations, budget=budget,
+                                        ignore=settings.context_ignore)
+        return system, top_level_length(system)
+
+    statistics = analyze(start, rules, settings.iterations)
+
+    if settings.stream_derivation:
+        if not statistics.exact:
+            # The stream is consumed twice, once for the length and once by the turtle
+            state = rule_rng.getstate()
+            segments = count_top_level_segments(stream_rules(start, rules, settings.iterations,
+                                                             rule_rng))
+            rule_rng.setstate(state)
+        system = stream_rules(start, rules, settings.iterations, rule_rng)
+    elif settings.processes and compile_rules(rules, SymbolTable()).stochastic:
+        # Counter based random numbers, stochastic systems differ from the serial result.
+        # Deterministic systems are faster with the subtree cache of apply_rules
+        system = apply_rules_parallel(start, rules, settings.iterations, settings.rule_seed,
+                                      settings.processes, budget=budget)
+    else:
+        system = apply_rules(start, rules, settings.iterations, rule_rng, budget=budget)
+
+    if statistics.exact:
+        segments = statistics.top_level_segments
+    elif not settings.stream_derivation:
+        segments = count_top_level_segments(system)
+
+    return system, segments
+
+
+def _count_word(profile, start, rules, settings, system):
+    """Add the token counts of the derivation to profile"""
+    if profile is NO_PROFILE:
+        return
+
+    if isinstance(system, ParametricWord):
+        # Conditions decide the lengths, only the derived word is known
+        profile.count(word_tokens=len(system), word_bytes=word_bytes(system))
+        return
+
+    statistics = [analyze(start, rules, i) for i in range(settings.iterations + 1)]
+    # Expected lengths for stochastic systems
+    profile.count(generation_tokens=[s.length for s in statistics],
+                  exact=statistics[-1].exact)
+    if hasattr(system, 'codes'):
+        profile.count(word_tokens=len(system), word_bytes=word_bytes(system))
+
+
+def _count_geometry(profile, geometry):
+    profile.count(splines=len(geometry.offsets) - 1, points=len(geometry.points) // 3)
+
+
+def settings_budget(settings):
+    """Budget of settings or None if it is unlimited"""
+    budget = Budget(settings.max_tokens, settings.max_points, settings.max_seconds)
+    return budget if budget else None
+
+
+def budget_iterations(settings, budget):
+    """Iterations generate derives for settings within budget
+
+    Systems predicted to exceed the budget raise BudgetExceeded, unless
+    budget_action is 'TRUNCATE', which selects the last generation whose
+    predicted size fits.
+    """
+    start = [Token(type='SYMBOL', value=settings.start_symbol)]
+    rules = get_rules(settings.productions)
+    if parametric_settings(settings, rules):
+        # Conditions decide the lengths, only the derivation checks the budget
+        return settings.iterations
+
+    statistics = analyze(start, rules, settings.iterations)
+    if budget.fits(statistics):
+        return settings.iterations
+
+    if settings.budget_action != 'TRUNCATE':
+        budget.check_statistics(statistics)
+
+    iterations = 0
+    for i in range(1, settings.iterations):
+        if not budget.fits(analyze(start, rules, i)):
+            break
+        iterations = i
+
+    return iterations
+
+
+def generate(settings, rule_rng=None, angle_rng=None, cache=True, profile=NO_PROFILE):
+    """Derive and interpret the system described by settings, returns Geometry
+
+    The derivation and the turtle are limited by the budget of settings,
+    see budget_iterations. A stochastic system that exceeds it although
+    its expected size fits is derived again with one iteration less when
+    truncating.
+    """
+    budget = settings_budget(settings)
+    if budget is None:
+        return _generate(settings, rule_rng, angle_rng, cache, profile)
+
+    iterations = budget_iterations(settings, budget)
+    while True:
+        if iterations != settings.iterations:
+            profile.count(iterations=iterations)
+        try:
+            return _generate(_Override(settings, iterations=iterations), rule_rng, angle_rng,
+                             cache, profile, budget)
+        except BudgetExceeded as error:
+            if (settings.budget_action != 'TRUNCATE' or error.resource == 'seconds' or
+                iterations == 0):
+                raise
+            iterations -= 1
+
+
+def _generate(settings, rule_rng, angle_rng, cache, profile, budget=None):
+    """Derive and interpret the system described by settings, returns Geometry
+
+    rule_rng and angle_rng are the independent random number generators of
+    the stochastic rules and the angle variation, by default they are
+    seeded with rule_seed and angle_seed.
+
+    Unless cache is False, seeded derivations are kept per start symbol,
+    rules, iterations, rule seed and budget, so changing only the
+    interpretation settings reuses the word. The geometry is kept as well and returned
+    read only when none of the settings used here changed. With
+    disk_cache both are also kept in the Store of settings.
+
+    The stages are measured by profile, a streamed derivation is only
+    consumed by the turtle stage.
+    """
+    with profile.stage('parse'):
+        start = [Token(type='SYMBOL', value=settings.start_symbol)]
+        rules = get_rules(settings.productions)
+
+    # Stream and parallel derivation yield different words for stochastic systems.
+    # A result is only valid for the budget it was checked against
+    key = (settings.start_symbol, rules_key(rules), settings.iterations, settings.rule_seed,
+           bool(settings.processes) and not settings.stream_derivation,
+           settings.context_ignore, settings.max_tokens, settings.max_points,
+           settings.max_seconds, settings.budget_action)
+    geometry_key = key + (settings.angle, settings.random_angle, settings.angle_seed,
+                          settings.basic_length)
+    cache_derivation = cache and rule_rng is None
+    cache_geometry = cache_derivation and angle_rng is None
+    store = get_store(settings) if cache_derivation else None
+    # A stream is not stored, that would defeat its purpose, parametric
+    # words have no file format
+    store_derivation = (store is not None and not settings.stream_derivation and
+                        not parametric_settings(settings, rules))
+
+    if cache_geometry:
+        geometry = _geometries.get(geometry_key)
+        if geometry is None and store is not None:
+            geometry = store.get_geometry(content_key(*geometry_key))
+            if geometry is not None:
+                _geometries.put(geometry_key, geometry)
+                profile.count(cached='disk geometry')
+        elif geometry is not None:
+            profile.count(cached='geometry')
+
+        if geometry is not None:
+            _count_geometry(profile, geometry)
+            return geometry
+
+    rule_rng = random_stream(settings.rule_seed if rule_rng is None else rule_rng)
+    angle_rng = random_stream(settings.angle_seed if angle_rng is None else angle_rng)
+
+    derived = _derivations.get(key) if cache_derivation else None
+    if derived is not None:
+        profile.count(cached='derivation')
+    elif store_derivation:
+        derived = store.get_word(content_key(*key))
+        if derived is not None:
+            _derivations.put(key, derived)
+            profile.count(cached='disk derivation')
+
+    if derived is None:
+        with profile.stage('derive'):
+            derived = _derive(start, rules, settings, rule_rng, budget)
+        # A stream is not stored, that would defeat its purpose
+        if cache_derivation and not settings.stream_derivation:
+            _derivations.put(key, derived)
+        if store_derivation:
+            store.put_word(content_key(*key), *derived)
+
+    system, segments = derived
+    length = settings.basic_length / segments if segments else 0
+    _count_word(profile, start, rules, settings, system)
+
+    get_angle = angle_function(settings.angle, settings.random_angle, angle_rng)
+    lengths = None
+    if isinstance(system, ParametricWord):
+        lengths, get_angle = turtle_parameters(system, length, get_angle)
+    with profile.stage('turtle'):
+        geometry = interpret(system, length, get_angle, budget=budget, lengths=lengths)
+    _count_geometry(profile, geometry)
+
+    if cache_geometry:
+        _geometries.put(geometry_key, _read_only(geometry))
+        if store is not None:
+            store.put_geometry(content_key(*geometry_key), geometry)
+
+    return geometry
+
+
+def generate_instanced(settings, profile=NO_PROFILE):
+    """Interpret the system of settings with repeated branches as
+    instances, returns InstancedGeometry
+
+    Raises ValueError if the branches can not be instanced, see
+    can_instance.
+    """
+    with profile.stage('parse'):
+        start = [Token(type='SYMBOL', value=settings.start_symbol)]
+        rules = get_rules(settings.productions)
+    if '(' in settings.start_symbol or not can_instance(rules, start, settings.random_angle):
+        raise ValueError("Instances need a deterministic system without parameters "
+                         "turning with + and - by a constant angle")
+
+    cnt = analyze(start, rules, settings.iterations).top_level_segments
+    length = settings.basic_length / cnt if cnt else 0
+    with profile.stage('instance'):
+        instanced = instance(start, rules, settings.iterations, length, settings.angle)
+
+    _count_geometry(profile, instanced.geometry)
+    profile.count(prototypes=len(instanced.prototypes),
+                  instances=len(instanced.instances.prototype),
+                  prototype_points=sum(len(p.points) for p in instanced.prototypes) // 3)
+    return instanced
+
+
+class _Override:
+    """Settings with some values replaced"""
+    def __init__(self, settings, **values):
+        self._settings = settings
+        self.__dict__.update(values)
+
+    def __getattr__(self, name):
+        return getattr(self._settings, name)
+
+
+def _pruned_depth(start, rules, iterations, statistics, budget):
+    """Deepest bracket depth whose pruned word fits the budget or None"""
+    depth = None
+    for d in range(statistics.depth):
+        if pruned_length(start, rules, iterations, d) > budget:
+            break
+        depth = d
+
+    return depth
+
+
+def refine(settings, budget=PREVIEW_BUDGET):
+    """Yield Geometry of settings in passes of increasing detail
+
+    The first pass derives at most budget tokens. Deterministic systems
+    keep the requested iterations and drop the branches nested too deep
+    for the budget, other systems are derived with fewer iterations. The
+    last pass is the result of generate.
+    """
+    start = [Token(type='SYMBOL', value=settings.start_symbol)]
+    rules = get_rules(settings.productions)
+    if parametric_settings(settings, rules):
+        yield generate(settings)
+        return
+
+    statistics = analyze(start, rules, settings.iterations)
+
+    if statistics.length > budget:
+        depth = None
+        if statistics.exact:
+            depth = _pruned_depth(start, rules, settings.iterations, statistics, budget)
+
+        if depth is not None:
+            # The top level is kept so the segments have their final length
+            cnt = statistics.top_level_segments
+            length = settings.basic_length / cnt if cnt else 0
+            get_angle = angle_function(settings.angle, settings.random_angle,
+                                       random_stream(settings.angle_seed))
+            yield interpret(prune_rules(start, rules, settings.iterations, depth), length,
+                            get_angle)
+        else:
+            iterations = 0
+            for i in range(1, settings.iterations):
+                if analyze(start, rules, i).length > budget:
+                    break
+                iterations = i
+            yield generate(_Override(settings, iterations=iterations))
+
+    yield generate(settings)
+
+
+PRESETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'presets')
+
+
+class TestCoreFunctions(unittest.TestCase):
+    def test_load_preset(self):
+        settings = load_preset(os.path.join(PRESETS, 'flower_f.py'))
+        self.assertEqual(settings.start_symbol, 'X')
+        self.assertEqual(settings.iterations, 5)
+        self.assertEqual([p.rule for p in settings.productions],
+                         ['X:=F-[[X]+X]+F[+FX]-X', 'F:=FF'])
+
+    def test_get_rules_invalid(self):
+        productions = Productions()
+        productions.add().rule = 'F:=F[+F]F'
+        productions.add().rule = 'F:=F]'
+        with self.assertRaisesRegex(SyntaxError, 'F:=F]'):
+            get_rules(productions)
+
+    def test_generate(self):
+        settings = Settings(start_symbol='F', iterations=1)
+        settings.productions.add().rule = 'F:=F[+F]F'
+        geometry = generate(settings)
+        self.assertEqual(geometry.offsets.tolist(), [0, 2, 4])
+        # The branch starts in the middle of the stem
+        self.assertEqual(geometry.points[6:9].tolist(), [0, 0, 1])
+
+    def test_derivation_cached(self):
+        clear_caches()
+        settings = Settings(start_symbol='F', iterations=3)
+        settings.productions.add().rule = 'F:=F[+F]F'
+        geometry = generate(settings)
+        self.assertIs(generate(settings), geometry)
+        self.assertFalse(geometry.points.flags.writeable)
+
+        settings.bevel_depth = 0.5
+        self.assertIs(generate(settings), geometry)
+
+        settings.angle = 0.5
+        changed = generate(settings)
+        self.assertIsNot(changed, geometry)
+        self.assertEqual(len(changed.points), len(geometry.points))
+        self.assertEqual(len(_derivations), 1)
+
+        settings.rule_seed = 1
+        generate(settings)
+        self.assertEqual(len(_derivations), 2)
+
+    def test_cache_bypassed(self):
+        clear_caches()
+        settings = Settings(start_symbol='F', iterations=2)
+        settings.productions.add().rule = 'F:=F[+F]F'
+        self.assertIsNot(generate(settings, cache=False), generate(settings, cache=False))
+        self.assertIsNot(generate(settings, Random(0)), generate(settings, Random(0)))
+        self.assertEqual(len(_derivations), 0)
+
+    def test_profile(self):
+        clear_caches()
+        settings = Settings(start_symbol='F', iterations=3)
+        settings.productions.add().rule = 'F:=F[+F]F'
+        profile = Profile(memory=False)
+        geometry = generate(settings, profile=profile)
+        self.assertEqual([s['name'] for s in profile.stages], ['parse', 'derive', 'turtle'])
+        self.assertEqual(profile.counts['generation_tokens'], [1, 6, 21, 66])
+        self.assertEqual(profile.counts['word_tokens'], 66)
+        self.assertEqual(profile.counts['points'], len(geometry.points) // 3)
+
+        profile = Profile(memory=False)
+        generate(settings, profile=profile)
+        self.assertEqual(profile.counts['cached'], 'geometry')
+
+    def test_budget(self):
+        settings = Settings(start_symbol='F', iterations=8, max_tokens=10000)
+        settings.productions.add().rule = 'F:=FFFFF'
+        with self.assertRaisesRegex(BudgetExceeded, 'would need 390625 tokens'):
+            generate(settings)
+
+        settings.budget_action = 'TRUNCATE'
+        self.assertEqual(budget_iterations(settings, settings_budget(settings)), 5)
+        profile = Profile(memory=False)
+        geometry = generate(settings, cache=False, profile=profile)
+        self.assertEqual(profile.counts['iterations'], 5)
+        self.assertEqual(profile.counts['word_tokens'], 3125)
+
+        settings.max_tokens = 0
+        settings.max_points = 0
+        self.assertIsNone(settings_budget(settings))
+
+    def test_budget_stochastic(self):
+        settings = Settings(start_symbol='F', iterations=6, max_tokens=1000,
+                            budget_action='TRUNCATE')
+        settings.productions.add().rule = 'F:=FF[+F]F'
+        settings.productions.add().rule = 'F:=F'
+        for production in settings.productions:
+            production.probability = 0.5
+        # The expected length fits, some seeds exceed it and are derived again
+        truncated = 0
+        for rule_seed in range(10):
+            settings.rule_seed = rule_seed
+            profile = Profile(memory=False)
+            generate(settings, cache=False, profile=profile)
+            self.assertLessEqual(profile.counts['word_tokens'], 1000)
+            truncated += profile.counts.get('iterations') == 5
+        self.assertGreater(truncated, 0)
+
+    def test_disk_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            settings = Settings(start_symbol='X', iterations=4, disk_cache=True,
+                                disk_cache_directory=directory)
+            settings.productions.add().rule = 'X:=F[+X]F[-X]+X'
+            settings.productions.add().rule = 'F:=FF'
+            clear_caches()
+            geometry = generate(settings)
+            self.assertEqual(len(get_store(settings).entries()), 2)
+
+            # A new session finds the geometry, other angles reuse the word
+            clear_caches()
+            profile = Profile(memory=False)
+            stored = generate(settings, profile=profile)
+            self.assertEqual(profile.counts['cached'], 'disk geometry')
+            self.assertEqual(stored.points.tolist(), geometry.points.tolist())
+            self.assertEqual(stored.depths.tolist(), geometry.depths.tolist())
+
+            clear_caches()
+            settings.angle = 0.3
+            profile = Profile(memory=False)
+            generate(settings, profile=profile)
+            self.assertEqual(profile.counts['cached'], 'disk derivation')
+            self.assertEqual(profile.counts['word_tokens'], 491)
+            _stores.clear()
+
+    def test_parametric(self):
+        settings = Settings(start_symbol='A(1)', iterations=3, basic_length=1)
+        settings.productions.add().rule = 'A(l):l>0.3:=F(l)[+(90)A(l*0.5)]A(l*0.5)'
+        geometry = generate(settings)
+        # Every branch is half as long as its parent
+        np.testing.assert_allclose(self.points(geometry, 0), [[0, 0, 0], [0, 0, 1]])
+        np.testing.assert_allclose(self.points(geometry, 1), [[0, 0, 2 / 3], [-1 / 3, 0, 2 / 3]],
+                                   atol=1e-6)
+        self.assertIs(generate(settings), geometry)
+
+        # The arguments are part of the size of the cached word
+        clear_caches()
+        generate(settings)
+        word = _derivations.get(next(iter(_derivations._entries)))[0]
+        self.assertEqual(_derivations.current_size,
+                         len(word.codes) + word.counts.nbytes + word.values.nbytes)
+
+        settings.budget_action = 'TRUNCATE'
+        settings.max_tokens = 10
+        profile = Profile(memory=False)
+        generate(settings, cache=False, profile=profile)
+        self.assertEqual(profile.counts['iterations'], 1)
+        self.assertEqual(len(list(refine(settings))), 1)
+        self.assertRaises(ValueError, generate_instanced, settings)
+
+    def test_budget_not_cached(self):
+        # Parametric systems are only checked while they are derived
+        settings = Settings(start_symbol='A(1)', iterations=6)
+        settings.productions.add().rule = 'A(l):=F(l)[+(90)A(l*0.5)]A(l*0.5)'
+        geometry = generate(settings)
+        settings.max_tokens = 10
+        self.assertRaises(BudgetExceeded, generate, settings)
+
+        settings.budget_action = 'TRUNCATE'
+        truncated = generate(settings)
+        self.assertLess(len(truncated.points), len(geometry.points))
+        settings.max_tokens = MAX_TOKENS
+        settings.budget_action = 'CANCEL'
+        self.assertIs(generate(settings), geometry)
+
+    def test_context_sensitive(self):
+        settings = Settings(start_symbol='BF+A', iterations=1)
+        settings.productions.add().rule = 'B<A:=[+F]'
+        self.assertEqual(len(generate(settings).offsets), 2)
+
+        settings.context_ignore = '+F'
+        self.assertEqual(len(generate(settings).offsets), 3)
+        self.assertRaises(ValueError, generate_instanced, settings)
+
+    def points(self, geometry, spline):
+        begin, end = geometry.offsets[spline:spline + 2]
+        return geometry.points[begin * 3:end * 3].reshape(-1, 3).tolist()
+
+    def test_refine(self):
+        settings = Settings(start_symbol='X', iterations=5)
+        settings.productions.add().rule = 'X:=F[+X]F[-X]+X'
+        settings.productions.add().rule = 'F:=FF'
+        passes = list(refine(settings, 1000))
+        self.assertEqual(len(passes), 2)
+        self.assertLess(len(passes[0].points), len(passes[1].points))
+        self.assertEqual(passes[-1].points.tolist(), generate(settings).points.tolist())
+        # Pruning keeps the stem
+        stem = [g.points[:g.offsets[1] * 3].tolist() for g in passes]
+        self.assertEqual(stem[0], stem[1])
+
+    def test_refine_stochastic(self):
+        settings = Settings(start_symbol='F', iterations=6)
+        settings.productions.add().rule = 'F:=F[+F]F'
+        settings.productions.add().rule = 'F:=F[-F]F'
+        preview = next(refine(settings, 100))
+        self.assertLessEqual(len(preview.points) // 3, 100)
+        self.assertEqual(len(list(refine(settings, 10 ** 9))), 1)
+
+    def test_generate_instanced(self):
+        settings = load_preset(os.path.join(PRESETS, 'flower_c.py'))
+        settings.iterations = 4
+        instanced = generate_instanced(settings)
+        self.assertGreater(len(instanced.instances.prototype), 0)
+        self.assertEqual(len(flatten(instanced).points), len(generate(settings).points))
+
+        settings.random_angle = 0.5
+        self.assertRaises(ValueError, generate_instanced, settings)
+
+    def test_stream_matches(self):
+        settings = load_preset(os.path.join(PRESETS, 'flower_d.py'))
+        settings.iterations = 3
+        settings.random_angle = 0.5
+        geometry = generate(settings)
+        settings.stream_derivation = True
+        self.assertEqual(generate(settings, cache=False).points.tolist(), geometry.points.tolist())
+
+    def test_stochastic_stream_matches(self):
+        settings = Settings(start_symbol='F', iterations=4, random_angle=0.3,
+                            rule_seed=2, angle_seed=5)
+        settings.productions.add().rule = 'F:=F[+F]F'
+        settings.productions.add().rule = 'F:=F[-F]'
+        for production in settings.productions:
+            production.probability = 0.5
+        geometry = generate(settings)
+
+        settings.stream_derivation = True
+        self.assertEqual(generate(settings, cache=False).points.tolist(), geometry.points.tolist())
+        self.assertEqual(generate(settings, Random(2), Random(5)).points.tolist(),
+                         geometry.points.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import unittest
+import numpy as np
+from lindenmayer_system_turtle import Geometry
+
+
+def point_radii(geometry, falloff):
+    """Radius of every point, falloff to the power of the bracket depth of
+    its spline, or None if the depths of geometry are unknown
+    """
+    if geometry.depths is None:
+        return None
+
+    radii = np.power(np.float32(falloff), geometry.depths.astype(np.float32))
+    return np.repeat(radii, np.diff(geometry.offsets))
+
+
+def build_curve(curve, geometry, radii=None):
+    """Add the splines of geometry to a Blender curve
+
+    Every spline is created with its final number of points and filled with
+    foreach_set, no attribute of a single point is touched. radii has one
+    value per point or is None to keep the default radius.
+    """
+    offsets = geometry.offsets
+    for i in range(len(offsets) - 1):
+        begin, end = offsets[i] * 3, offsets[i + 1] * 3
+
+        spline = curve.splines.new('BEZIER')
+        points = spline.bezier_points
+        # A new spline already has one point
+        points.add(offsets[i + 1] - offsets[i] - 1)
+
+        points.foreach_set('co', geometry.points[begin:end])
+        points.foreach_set('handle_left', geometry.handles_left[begin:end])
+        points.foreach_set('handle_right', geometry.handles_right[begin:end])
+        if radii is not None:
+            points.foreach_set('radius', radii[offsets[i]:offsets[i + 1]])
+
+    return curve
+
+
+def build_poly(curve, geometry, radii=None):
+    """Add the splines of geometry to a Blender curve as poly splines
+
+    The handles are dropped, poly points have a fourth coordinate which is
+    the weight.
+    """
+    count = len(geometry.points) // 3
+    co = np.ones((count, 4), dtype=np.float32)
+    co[:, :3] = geometry.points.reshape(-1, 3)
+    co = co.ravel()
+
+    offsets = geometry.offsets
+    for i in range(len(offsets) - 1):
+        begin, end = offsets[i], offsets[i + 1]
+
+        spline = curve.splines.new('POLY')
+        points = spline.points
+        # A new spline already has one point
+        points.add(end - begin - 1)
+
+        points.foreach_set('co', co[begin * 4:end * 4])
+        if radii is not None:
+            points.foreach_set('radius', radii[begin:end])
+
+    return curve
+
+
+def spline_edges(geometry):
+    """Flat int32 vertex indices of the edges between the consecutive points
+    of every spline
+    """
+    count = geometry.offsets[-1]
+    first = np.ones(max(count - 1, 0), dtype=bool)
+    # No edge from the last point of a spline to the first of the next
+    first[geometry.offsets[1:-1] - 1] = False
+    first = np.flatnonzero(first).astype(np.int32)
+
+    return np.stack((first, first + 1), axis=1).ravel()
+
+
+def build_mesh(mesh, geometry):
+    """Fill a Blender mesh with the points of geometry as vertices and the
+    segments of the splines as edges
+
+    Meshes have no radius, a skin or a curve bevel has to be added in
+    Blender.
+    """
+    edges = spline_edges(geometry)
+
+    mesh.vertices.add(len(geometry.points) // 3)
+    mesh.vertices.foreach_set('co', geometry.points)
+    mesh.edges.add(len(edges) // 2)
+    mesh.edges.foreach_set('vertices', edges)
+    mesh.update()
+
+    return mesh
+
+
+def _values(points, attribute):
+    values = []
+    points.foreach_get(attribute, values)
+    return values
+
+
+class TestCurveFunctions(unittest.TestCase):
+    def setUp(self):
+        # The stand-in for bpy is not shipped with the add-on
+        from benchmarks.blender_mock import Curve, Mesh
+        self.curve = lambda: Curve('LSystem', 'CURVE')
+        self.mesh = lambda: Mesh('LSystem')
+
+        points = np.arange(15, dtype=np.float32)
+        self.geometry = Geometry(points, points + 1, points + 2, np.array([0, 2, 5]),
+                                 np.array([0, 1]))
+
+    def test_spline_sizes(self):
+        curve = build_curve(self.curve(), self.geometry)
+        self.assertEqual([len(s.bezier_points) for s in curve.splines], [2, 3])
+        self.assertEqual([s.type for s in curve.splines], ['BEZIER', 'BEZIER'])
+
+    def test_values(self):
+        curve = build_curve(self.curve(), self.geometry)
+        second = curve.splines[1].bezier_points
+        self.assertEqual(_values(second, 'co'), list(range(6, 15)))
+        self.assertEqual(_values(second, 'handle_left'), list(range(7, 16)))
+        self.assertEqual(_values(second, 'handle_right'), list(range(8, 17)))
+
+    def test_radii(self):
+        radii = point_radii(self.geometry, 0.5)
+        self.assertEqual(radii.tolist(), [1, 1, 0.5, 0.5, 0.5])
+        curve = build_curve(self.curve(), self.geometry, radii)
+        self.assertEqual(_values(curve.splines[1].bezier_points, 'radius'), [0.5] * 3)
+        self.assertIsNone(point_radii(self.geometry._replace(depths=None), 0.5))
+
+    def test_poly(self):
+        curve = build_poly(self.curve(), self.geometry, point_radii(self.geometry, 0.5))
+        self.assertEqual([s.type for s in curve.splines], ['POLY', 'POLY'])
+        self.assertEqual([len(s.points) for s in curve.splines], [2, 3])
+        self.assertEqual(_values(curve.splines[0].points, 'co'), [0, 1, 2, 1, 3, 4, 5, 1])
+        self.assertEqual(_values(curve.splines[1].points, 'radius'), [0.5] * 3)
+
+    def test_mesh(self):
+        mesh = build_mesh(self.mesh(), self.geometry)
+        self.assertEqual(len(mesh.vertices), 5)
+        self.assertEqual(_values(mesh.vertices, 'co'), list(range(15)))
+        self.assertEqual(len(mesh.edges), 3)
+        self.assertEqual(_values(mesh.edges, 'vertices'), [0, 1, 2, 3, 3, 4])
+
+    def test_empty(self):
+        geometry = Geometry(*(np.zeros(0, dtype=np.float32),) * 3 + (np.array([0]),))
+        self.assertEqual(len(build_curve(self.curve(), geometry).splines), 0)
+        self.assertEqual(len(build_poly(self.curve(), geometry).splines), 0)
+        self.assertEqual(len(build_mesh(self.mesh(), geometry).edges), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,825 @@
+import unittest
+import numpy as np
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+from collections import namedtuple
+from lindenmayer_system_parser import Token, parse_rule
+from lindenmayer_system_cache import LRUCache
+from lindenmayer_system_random import random_stream
+from lindenmayer_system_budget import Budget, BudgetExceeded
+
+Rule = namedtuple('Rule', ['left', 'right', 'probability', 'parameters', 'condition',
+                           'arguments', 'left_context', 'right_context'])
+Rule.__new__.__defaults__ = ((), None, None, (), ())
+
+# Number of codes rewritten per join, bounds the temporary list of segments
+CHUNK_SIZE = 1 << 16
+
+# Bytes of expanded segments kept by the subtree cache
+CACHE_SIZE = 1 << 24
+
+# Tokens rewritten per generation with numpy in the time the subtree cache
+# follows one symbol that can reach a stochastic symbol
+CACHE_VISIT_COST = 16
+
+
+class SymbolTable:
+    """Maps tokens to single byte codes
+
+    Every distinct token of a system gets a code in the range 0-255, the
+    derived word is then stored as a bytes object of these codes.
+    """
+    def __init__(self):
+        self.tokens = []
+        self.codes = {}
+
+    def code(self, token):
+        try:
+            return self.codes[token]
+        except KeyError:
+            if len(self.tokens) == 256:
+                raise ValueError("Too many distinct symbols in system")
+
+            code = len(self.tokens)
+            self.codes[token] = code
+            self.tokens.append(token)
+            return code
+
+    def encode(self, tokens):
+        # The EMPTY token only marks the end of a parsed rule
+        return bytes(self.code(t) for t in tokens if t.type != 'EMPTY')
+
+    def decode(self, codes):
+        return list(map(self.tokens.__getitem__, codes))
+
+
+class Word:
+    """Derived word as a sequence of symbol codes
+
+    Iterating a word yields the Token of every code, the Token objects are
+    shared with the symbol table so no per-token objects are created.
+    """
+    __slots__ = ('codes', 'table')
+
+    def __init__(self, codes, table):
+        self.codes = codes
+        self.table = table
+
+    def __iter__(self):
+        return map(self.table.tokens.__getitem__, self.codes)
+
+    def __len__(self):
+        return len(self.codes)
+
+
+def rule_probabilities(symbol, rewrite_rule):
+    """Normalized selection probabilities of the rules of a symbol
+
+    A single rule is always applied whatever its probability. Raises
+    ValueError for negative probabilities and if no rule of a stochastic
+    symbol can ever be selected.
+    """
+    if len(rewrite_rule) == 1:
+        return (1.0,)
+
+    probabilities = [r.probability for r in rewrite_rule]
+    if min(probabilities) < 0:
+        raise ValueError("Negative probability in the rules of {}".format(symbol))
+
+    total = sum(probabilities)
+    if total <= 0:
+        raise ValueError("The rules of {} have no probability".format(symbol))
+
+    return tuple(p / total for p in probabilities)
+
+
+def is_parametric(rules):
+    """True if a rule has parameters, a condition, arguments or a context,
+    such systems are derived by apply_parametric_rules
+    """
+    return any(r.parameters or r.condition is not None or r.arguments is not None or
+               r.left_context or r.right_context
+               for rewrite_rule in rules.values() for r in rewrite_rule)
+
+
+class Gather(namedtuple('Gather', ['rights', 'offsets', 'lengths', 'first_choice',
+                                   'is_stochastic', 'cumulative'])):
+    """Right sides of compiled rules as numpy arrays for rewriting whole
+    generations of stochastic systems at once
+
+    rights        -- all right sides concatenated, the expansions of the
+                     256 codes followed by the choices of the stochastic codes
+    offsets       -- start of every right side in rights
+    lengths       -- length of every right side
+    first_choice  -- index of the first choice of every stochastic code
+    is_stochastic -- boolean lookup table of the stochastic codes
+    cumulative    -- cumulative probabilities of every stochastic code
+    """
+    __slots__ = ()
+
+
+def _gather(expansions, choices, cumulative, stochastic):
+    rights = list(expansions)
+    first_choice = {}
+    for code in sorted(stochastic):
+        first_choice[code] = len(rights)
+        rights.extend(choices[code])
+
+    lengths = np.array([len(r) for r in rights], np.intp)
+    offsets = np.zeros(len(rights), np.intp)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    is_stochastic = np.zeros(256, bool)
+    is_stochastic[list(stochastic)] = True
+
+    return Gather(rights=np.frombuffer(b''.join(rights), np.uint8),
+                  offsets=offsets,
+                  lengths=lengths,
+                  first_choice=first_choice,
+                  is_stochastic=is_stochastic,
+                  cumulative={code: np.array(cumulative[code]) for code in stochastic})
+
+
+class CompiledRules(namedtuple('CompiledRules', ['expansions', 'cumulative', 'choices',
+                                                 'rewritten', 'stochastic', 'reaching',
+                                                 'gather'])):
+    """Rule dictionary compiled to code level by compile_rules
+
+    All fields are indexed directly by code and never change after
+    compilation, so a compiled table can be shared and sent to other
+    processes.
+
+    expansions -- right side of every code, codes without a rule map to
+                  themselves
+    cumulative -- normalized cumulative probabilities of the rules of a
+                  stochastic code, None for every other code
+    choices    -- encoded right sides matching cumulative
+    rewritten  -- codes with at least one rule
+    stochastic -- codes with more than one rule
+    reaching   -- codes whose derivation can contain a stochastic symbol
+    gather     -- Gather of the right sides, None without stochastic codes
+    """
+    __slots__ = ()
+
+    def choose_index(self, code, rnd):
+        """Index of the rule of a stochastic code for rnd in [0, 1)"""
+        return bisect_left(self.cumulative[code], rnd)
+
+    def choose_many(self, codes, randoms):
+        """Rule indices for a sequence of stochastic codes, one random
+        number each
+        """
+        return array('B', map(bisect_left, map(self.cumulative.__getitem__, codes), randoms))
+
+    def choose(self, code, rnd):
+        """Select the right side of a stochastic symbol"""
+        return self.choices[code][bisect_left(self.cumulative[code], rnd)]
+
+    def rewrite(self, codes, rng, budget=None):
+        """Apply one generation of rules to the encoded word codes"""
+        random = rng.random
+        return self.rewrite_positions(codes, lambda positions: [random() for p in positions],
+                                      budget)
+
+    def rewrite_positions(self, codes, draw, budget=None):
+        """Apply one generation of rules, draw(positions) returns the random
+        numbers for the stochastic symbols at the ascending positions of
+        codes
+
+        Stochastic generations are rewritten CHUNK_SIZE codes at a time by
+        gathering the selected right sides with numpy. budget is checked
+        against the rewritten codes after every chunk.
+        """
+        out = bytearray()
+
+        if self.gather is None:
+            expand = self.expansions.__getitem__
+            for i in range(0, len(codes), CHUNK_SIZE):
+                out += b''.join(map(expand, codes[i:i + CHUNK_SIZE]))
+                if budget is not None:
+                    budget.check(tokens=len(out))
+            return out
+
+        gather = self.gather
+        word = np.frombuffer(codes, np.uint8)
+        for i in range(0, len(word), CHUNK_SIZE):
+            chunk = word[i:i + CHUNK_SIZE]
+            # Index of the right side of every code
+            sides = chunk.astype(np.intp)
+            positions = np.flatnonzero(gather.is_stochastic[chunk])
+            randoms = np.array(draw(positions + i), float)
+            occurrences = chunk[positions]
+            for code, cumulative in gather.cumulative.items():
+                selected = occurrences == code
+                sides[positions[selected]] = (gather.first_choice[code] +
+                                              np.searchsorted(cumulative, randoms[selected]))
+
+            lengths = gather.lengths[sides]
+            ends = np.cumsum(lengths)
+            if len(ends) and ends[-1]:
+                indices = np.repeat(gather.offsets[sides] - (ends - lengths), lengths)
+                indices += np.arange(ends[-1])
+                out += gather.rights[indices].tobytes()
+            if budget is not None:
+                budget.check(tokens=len(out))
+
+        return out
+
+
+def _reaching(expansions, rewritten, stochastic):
+    """Codes whose derivation can contain a stochastic symbol"""
+    reaching = set(stochastic)
+    changed = True
+    while changed:
+        changed = False
+        for code in rewritten - reaching:
+            if reaching.intersection(expansions[code]):
+                reaching.add(code)
+                changed = True
+
+    return frozenset(reaching)
+
+
+def compile_rules(rules, table):
+    """Compile a rule dictionary with the codes of table
+
+    Symbols of the rules are added to table. Raises ValueError if the
+    probabilities of a stochastic symbol are invalid.
+    """
+    identity = [bytes((c,)) for c in range(256)]
+    expansions = list(identity)
+    cumulative = [None] * 256
+    choices = [None] * 256
+
+    for symbol, rewrite_rule in rules.items():
+        code = table.code(Token('SYMBOL', symbol))
+        probabilities = rule_probabilities(symbol, rewrite_rule)
+
+        if len(rewrite_rule) > 1:
+            # The last bound is exactly one so every random number selects a rule
+            bounds = list(accumulate(probabilities))
+            bounds[-1] = 1.0
+            cumulative[code] = tuple(bounds)
+            choices[code] = tuple(table.encode(r.right) for r in rewrite_rule)
+        else:
+            expansions[code] = table.encode(rewrite_rule[0].right)
+
+    stochastic = frozenset(c for c in range(256) if cumulative[c] is not None)
+    rewritten = stochastic.union(c for c in range(256) if expansions[c] != identity[c])
+
+    return CompiledRules(expansions=tuple(expansions),
+                         cumulative=tuple(cumulative),
+                         choices=tuple(choices),
+                         rewritten=rewritten,
+                         stochastic=stochastic,
+                         reaching=_reaching(expansions, rewritten, stochastic),
+                         gather=(_gather(expansions, choices, cumulative, stochastic)
+                                 if stochastic else None))
+
+
+class ExpansionTable:
+    """Derivation of compiled rules with a cache of expanded segments
+
+    cache -- expansion of deterministic symbols keyed by
+             (code, remaining generations)
+    """
+    def __init__(self, compiled, table, cache_size=CACHE_SIZE):
+        self.compiled = compiled
+        self.table = table
+        self.cache = LRUCache(cache_size, len)
+        self._lengths = {}
+        self.identity = [bytes((c,)) for c in range(256)]
+
+    def expand(self, code, depth):
+        """Derive a symbol that never reaches a stochastic symbol
+
+        Segments are cached per (code, depth), repeated occurrences share
+        the same bytes object.
+        """
+        if depth == 0 or code not in self.compiled.rewritten:
+            return self.identity[code]
+
+        key = (code, depth)
+        segment = self.cache.get(key)
+        if segment is None:
+            segment = b''.join([self.expand(c, depth - 1) for c in self.compiled.expansions[code]])
+            self.cache.put(key, segment)
+
+        return segment
+
+    def derive(self, codes, times, rng, budget=None):
+        """Derive the word depth first using the subtree cache
+
+        Symbols that can reach a stochastic symbol are rewritten one level
+        at a time with the choices of draw_choices, every other symbol is
+        spliced in as cached segment. The length of every piece is checked
+        against budget before it is expanded, the choices are checked while
+        they are drawn.
+        """
+        compiled = self.compiled
+        reaching = compiled.reaching
+        stochastic = compiled.stochastic
+        selected = self.draw_choices(codes, times, rng, budget) if stochastic else None
+        positions = [0] * times
+        pieces = []
+        length = 0
+
+        def derive_level(codes, level):
+            nonlocal length
+            for c in codes:
+                if c not in reaching:
+                    if budget is not None:
+                        length += self.segment_length(c, times - level)
+                        budget.check(tokens=length)
+                    pieces.append(self.expand(c, times - level))
+                    continue
+
+                if c in stochastic:
+                    right = compiled.choices[c][selected[level][positions[level]]]
+                    positions[level] += 1
+                else:
+                    right = compiled.expansions[c]
+
+                if level + 1 == times:
+                    if budget is not None:
+                        length += len(right)
+                        budget.check(tokens=length)
+                    pieces.append(right)
+                else:
+                    derive_level(right, level + 1)
+
+        if times == 0:
+            return codes
+
+        derive_level(codes, 0)
+        return b''.join(pieces)
+
+    def segment_length(self, code, depth):
+        """Length of the derivation of a deterministic symbol"""
+        key = (code, depth)
+        length = self._lengths.get(key)
+        if length is None:
+            if depth == 0 or code not in self.compiled.rewritten:
+                length = 1
+            else:
+                length = sum(self.segment_length(c, depth - 1)
+                             for c in self.compiled.expansions[code])
+            self._lengths[key] = length
+
+        return length
+
+    def draw_choices(self, codes, times, rng, budget=None):
+        """Draw the stochastic choices of every generation
+
+        The random numbers are drawn in the same order as rewriting the
+        whole word generation by generation would do. Only symbols that can
+        reach a stochastic symbol are followed, the rest of the word is never
+        derived. Returns one array of rule indices per generation.
+
+        The followed symbols are part of the word, budget is checked against
+        their number and the time after every generation.
+        """
+        compiled = self.compiled
+        reaching = compiled.reaching
+        stochastic = compiled.stochastic
+        follow = [bytes(c for c in compiled.expansions[c] if c in reaching)
+                  for c in range(256)]
+        follow_choice = {code: [bytes(c for c in right if c in reaching)
+                                for right in compiled.choices[code]]
+                         for code in stochastic}
+
+        skeleton = bytes(c for c in codes if c in reaching)
+        choices = []
+        for i in range(times):
+            occurrences = bytes(c for c in skeleton if c in stochastic)
+            level = compiled.choose_many(occurrences, [rng.random() for c in occurrences])
+
+            following = bytearray()
+            indices = iter(level)
+            for c in skeleton:
+                if c in stochastic:
+                    following += follow_choice[c][next(indices)]
+                else:
+                    following += follow[c]
+
+            choices.append(level)
+            skeleton = following
+            if budget is not None:
+                budget.check(tokens=len(following))
+
+        return choices
+
+    def stream(self, codes, times, rng):
+        """Yield the tokens of the derived word depth first
+
+        Only the path from the start symbol to the current token is kept,
+        memory grows with the number of generations instead of the length
+        of the word. Stochastic choices are drawn up front by draw_choices,
+        whose memory grows with the number of stochastic occurrences.
+        """
+        compiled = self.compiled
+        tokens = self.table.tokens
+        expansions = compiled.expansions
+        rewritten = compiled.rewritten
+        reaching = compiled.reaching
+        stochastic = compiled.stochastic
+        selected = self.draw_choices(codes, times, rng) if stochastic else None
+        positions = [0] * times
+
+        # Larger segments are derived further instead of being materialized
+        splice_length = self.cache.max_size // 16
+
+        stack = [iter(codes)]
+        while stack:
+            level = len(stack) - 1
+            if level == times:
+                yield from map(tokens.__getitem__, stack.pop())
+                continue
+
+            for c in stack[-1]:
+                if (c in rewritten and c not in reaching and
+                    self.segment_length(c, times - level) <= splice_length):
+                    yield from map(tokens.__getitem__, self.expand(c, times - level))
+                    continue
+
+                if c in rewritten:
+                    if c in stochastic:
+                        right = compiled.choices[c][selected[level][positions[level]]]
+                        positions[level] += 1
+                    else:
+                        right = expansions[c]
+
+                    stack.append(iter(right))
+                    break
+
+                yield tokens[c]
+            else:
+                stack.pop()
+
+    def pruned_length(self, codes, times, max_depth):
+        """Length of the word derived by prune"""
+        compiled = self.compiled
+        push, pop = self._brackets()
+        lengths = {}
+
+        def length(code, remaining, allowed):
+            if remaining == 0 or code not in compiled.rewritten:
+                return 1
+
+            key = (code, remaining, allowed)
+            if key not in lengths:
+                lengths[key] = sequence(compiled.expansions[code], remaining - 1, allowed)
+            return lengths[key]
+
+        def sequence(codes, remaining, allowed):
+            total = 0
+            depth = 0
+            skipped = 0
+            for c in codes:
+                if skipped:
+                    skipped += (c == push) - (c == pop)
+                elif c == push and depth == allowed:
+                    skipped = 1
+                else:
+                    if c == push:
+                        depth += 1
+                    elif c == pop:
+                        depth -= 1
+                    total += length(c, remaining, allowed - depth)
+            return total
+
+        return sequence(codes, times, max_depth)
+
+    def prune(self, codes, times, max_depth):
+        """Yield the codes of the derived word without the branches nested
+        deeper than max_depth
+
+        Branches are dropped before they are derived, so the work is
+        proportional to the pruned word. Only for systems without
+        stochastic symbols, pruning would change the order of the random
+        numbers.
+        """
+        compiled = self.compiled
+        if compiled.stochastic:
+            raise ValueError("Stochastic systems can not be pruned")
+
+        expansions = compiled.expansions
+        rewritten = compiled.rewritten
+        push, pop = self._brackets()
+        depth = 0
+
+        stack = [(iter(codes), times)]
+        while stack:
+            right, remaining = stack[-1]
+            for c in right:
+                if c == push:
+                    if depth == max_depth:
+                        # Brackets are balanced within every right side
+                        nested = 1
+                        for c in right:
+                            nested += (c == push) - (c == pop)
+                            if not nested:
+                                break
+                        continue
+                    depth += 1
+                elif c == pop:
+                    depth -= 1
+                elif remaining and c in rewritten:
+                    stack.append((iter(expansions[c]), remaining - 1))
+                    break
+
+                yield c
+            else:
+                stack.pop()
+
+    def _brackets(self):
+        codes = self.table.codes
+        return codes.get(Token('PUSH', '[')), codes.get(Token('POP', ']'))
+
+
+def _encode_start(start, table):
+    if isinstance(start, Word):
+        return start.codes
+    return table.encode(start)
+
+
+def apply_single_rule(start, rules, rng):
+    table = start.table if isinstance(start, Word) else SymbolTable()
+    compiled = compile_rules(rules, table)
+
+    return Word(compiled.rewrite(_encode_start(start, table), rng), table)
+
+
+def _cache_pays(compiled, codes, times):
+    """True if the subtree cache is expected to derive a stochastic system
+    faster than rewriting it generation by generation
+
+    The cache follows every symbol that can reach a stochastic symbol one
+    at a time, it pays when those are rare compared to the tokens of all
+    generations. Both are estimated from the expected number of every code
+    per generation.
+    """
+    # Expected number of every code in the right side of every code
+    matrix = np.identity(256)
+    for code in compiled.rewritten:
+        matrix[code, code] = 0
+        if code in compiled.stochastic:
+            probabilities = np.diff((0,) + compiled.cumulative[code])
+            sides = zip(probabilities, compiled.choices[code])
+        else:
+            sides = [(1, compiled.expansions[code])]
+        for probability, right in sides:
+            matrix[code] += probability * np.bincount(np.frombuffer(right, np.uint8),
+                                                      minlength=256)
+
+    lengths = matrix.sum(axis=1)
+    reaching = np.zeros(256, bool)
+    reaching[list(compiled.reaching)] = True
+    counts = np.bincount(np.frombuffer(codes, np.uint8), minlength=256).astype(float)
+
+    visits = tokens = 0
+    for i in range(times):
+        visits += counts[reaching] @ lengths[reaching]
+        counts = counts @ matrix
+        tokens += counts.sum()
+        if tokens > 1e15:
+            # Far beyond any budget, the ratio does not change anymore
+            break
+
+    return tokens > visits * CACHE_VISIT_COST
+
+
+def apply_rules(start, rules, times, rng, cache_size=CACHE_SIZE, budget=None):
+    """Derive the system
+
+    rng        -- rule seed or random number generator for stochastic rules
+    cache_size -- bytes of the subtree cache, 0 rewrites generation by
+                  generation
+    budget     -- Budget of the tokens and the time, checked while the word
+                  grows
+
+    Stochastic systems whose symbols mostly reach a stochastic symbol are
+    rewritten generation by generation even with a cache, see _cache_pays.
+    """
+    table = start.table if isinstance(start, Word) else SymbolTable()
+    compiled = compile_rules(rules, table)
+    codes = _encode_start(start, table)
+
+    rng = random_stream(rng)
+    if cache_size and (not compiled.stochastic or _cache_pays(compiled, codes, times)):
+        codes = ExpansionTable(compiled, table, cache_size).derive(codes, times, rng, budget)
+    else:
+        for i in range(times):
+            codes = compiled.rewrite(codes, rng, budget)
+
+    return Word(codes, table)
+
+
+def stream_rules(start, rules, times, rng, cache_size=CACHE_SIZE):
+    """Generator over the tokens of the derived system
+
+    Yields the same tokens as apply_rules without storing any generation.
+    For deterministic rules memory is bounded by cache_size. Stochastic
+    rules also keep the symbols that can reach a stochastic symbol and one
+    rule index per stochastic occurrence, see ExpansionTable.draw_choices,
+    so their memory grows with the number of stochastic occurrences. The
+    random numbers are drawn from rng when the first token is requested.
+    """
+    table = SymbolTable()
+    compiled = compile_rules(rules, table)
+    codes = _encode_start(start, table)
+
+    return ExpansionTable(compiled, table, cache_size).stream(codes, times, random_stream(rng))
+
+
+def prune_rules(start, rules, times, max_depth):
+    """Derive a deterministic system without the branches nested deeper
+    than max_depth, returns a Word
+    """
+    table = SymbolTable()
+    expansion = ExpansionTable(compile_rules(rules, table), table, 0)
+
+    return Word(bytes(expansion.prune(table.encode(start), times, max_depth)), table)
+
+
+def pruned_length(start, rules, times, max_depth):
+    """Number of tokens prune_rules would derive"""
+    table = SymbolTable()
+    expansion = ExpansionTable(compile_rules(rules, table), table, 0)
+
+    return expansion.pruned_length(table.encode(start), times, max_depth)
+
+
+def system_to_human(system):
+    string = ""
+    for token in system:
+        if token.type == 'SYMBOL' or token.type == 'DIRECTION' or token.type == 'PUSH' or token.type == 'POP':
+            string += token.value
+
+    return string
+
+
+def rules_from_strings(strings, probabilities=None):
+    """Build the rule dictionary for a list of rule strings"""
+    rules = {}
+    for i, string in enumerate(strings):
+        parsed = parse_rule(string)
+        probability = probabilities[i] if probabilities else 1
+        rules.setdefault(parsed.left.value, []).append(Rule(parsed.left, parsed.right, probability,
+                                                            *parsed[2:]))
+
+    return rules
+
+
+class TestDerivationFunctions(unittest.TestCase):
+    def derive(self, start, strings, times, probabilities=None, rseed=0):
+        rules = rules_from_strings(strings, probabilities)
+        start = [Token('SYMBOL', s) for s in start]
+        return system_to_human(apply_rules(start, rules, times, rseed))
+
+    def test_deterministic(self):
+        self.assertEqual(self.derive('X', ['X:=F[+X]-X', 'F:=FF'], 2),
+                         'FF[+F[+X]-X]-F[+X]-X')
+
+    def test_no_iterations(self):
+        self.assertEqual(self.derive('F', ['F:=FF'], 0), 'F')
+
+    def test_erase(self):
+        self.assertEqual(self.derive('FXF', ['X:='], 3), 'FF')
+
+    def test_stochastic_seed(self):
+        strings = ['F:=F[+F]', 'F:=F[-F]']
+        first = self.derive('F', strings, 4, [0.5, 0.5], rseed=3)
+        second = self.derive('F', strings, 4, [0.5, 0.5], rseed=3)
+        self.assertEqual(first, second)
+        self.assertEqual(len(first), 4 * 2 ** 4 - 3)
+
+    def test_word_iterates_tokens(self):
+        rules = rules_from_strings(['F:=F+F'])
+        word = apply_rules([Token('SYMBOL', 'F')], rules, 1, 0)
+        self.assertEqual(list(word), [Token('SYMBOL', 'F'),
+                                      Token('DIRECTION', '+'),
+                                      Token('SYMBOL', 'F')])
+
+    def test_stream_deterministic(self):
+        rules = rules_from_strings(['X:=F-[[X]+X]+F[+FX]-X', 'F:=FF'])
+        start = [Token('SYMBOL', 'X')]
+        self.assertEqual(list(stream_rules(start, rules, 4, 0)),
+                         list(apply_rules(start, rules, 4, 0)))
+        self.assertEqual(list(stream_rules(start, rules, 4, 0, 64)),
+                         list(apply_rules(start, rules, 4, 0)))
+
+    def test_stream_stochastic(self):
+        rules = rules_from_strings(['X:=F[+Y]X', 'Y:=F[-X]', 'Y:=FY', 'Y:=',
+                                    'F:=FF', 'Z:=XY'],
+                                   [1, 0.4, 0.4, 0.1, 1, 1])
+        start = [Token('SYMBOL', s) for s in 'ZFY']
+        for rseed in range(5):
+            self.assertEqual(list(stream_rules(start, rules, 6, rseed)),
+                             list(apply_rules(start, rules, 6, rseed)))
+
+    def test_budget(self):
+        rules = rules_from_strings(['F:=FFFFF'])
+        start = [Token('SYMBOL', 'F')]
+        self.assertEqual(len(apply_rules(start, rules, 4, 0, budget=Budget(625))), 625)
+        with self.assertRaises(BudgetExceeded) as context:
+            apply_rules(start, rules, 12, 0, budget=Budget(10 ** 6))
+        # Stopped before the segment was expanded
+        self.assertEqual(context.exception.value, 5 ** 12)
+        self.assertRaises(BudgetExceeded, apply_rules, start, rules, 5, 0, 0, Budget(625))
+
+    def test_budget_stochastic(self):
+        rules = rules_from_strings(['F:=F[+F]F', 'F:=F[-F]F'], [0.5, 0.5])
+        start = [Token('SYMBOL', 'F')]
+        self.assertRaises(BudgetExceeded, apply_rules, start, rules, 8, 0, budget=Budget(1000))
+        with self.assertRaises(BudgetExceeded) as context:
+            apply_rules(start, rules, 20, 0, budget=Budget(1000))
+        # Stopped in the generation that exceeds the budget
+        self.assertLess(context.exception.value, 1000 * 5)
+
+        table = SymbolTable()
+        expansion = ExpansionTable(compile_rules(rules, table), table)
+        with self.assertRaises(BudgetExceeded) as context:
+            expansion.derive(table.encode(start), 20, random_stream(0), Budget(1000))
+        # Stopped while drawing the choices of the seventh generation
+        self.assertEqual(context.exception.value, 3 ** 7)
+
+    def test_cache_disabled(self):
+        rules = rules_from_strings(['X:=F[+Y]X', 'Y:=F[-X]', 'Y:=FY',
+                                    'F:=FF', 'Z:=XY'],
+                                   [1, 0.5, 0.5, 1, 1])
+        start = [Token('SYMBOL', s) for s in 'ZFY']
+        for rseed in range(5):
+            word = apply_rules(start, rules, 6, rseed, 0)
+            self.assertEqual(apply_rules(start, rules, 6, rseed).codes, word.codes)
+            expansion = ExpansionTable(compile_rules(rules, word.table), word.table)
+            self.assertEqual(expansion.derive(word.table.encode(start), 6, random_stream(rseed)),
+                             word.codes)
+
+    def test_cache_pays(self):
+        table = SymbolTable()
+        start = table.encode([Token('SYMBOL', 'Z')])
+        # Only the first symbol is stochastic
+        compiled = compile_rules(rules_from_strings(['Z:=X', 'Z:=FX', 'X:=F[+X]F[-X]+X',
+                                                     'F:=FF'], [0.5, 0.5, 1, 1]), table)
+        self.assertTrue(_cache_pays(compiled, start, 8))
+        # Every rewritten symbol is stochastic
+        compiled = compile_rules(rules_from_strings(['Z:=Z[+Z]Z', 'Z:=Z[-Z]Z'], [0.5, 0.5]),
+                                 table)
+        self.assertFalse(_cache_pays(compiled, start, 8))
+
+    def test_cache_shares_segments(self):
+        table = SymbolTable()
+        compiled = ExpansionTable(compile_rules(rules_from_strings(['X:=F[+X]F[-X]+X', 'F:=FF']),
+                                                table), table)
+        f = table.code(Token('SYMBOL', 'F'))
+        self.assertIs(compiled.expand(f, 3), compiled.expand(f, 3))
+        self.assertEqual(len(compiled.expand(f, 3)), 8)
+
+    def test_cache_bounded(self):
+        table = SymbolTable()
+        compiled = ExpansionTable(compile_rules(rules_from_strings(['F:=FF']), table), table, 100)
+        compiled.expand(table.code(Token('SYMBOL', 'F')), 8)
+        self.assertLessEqual(compiled.cache.current_size, 100)
+
+    def test_prune(self):
+        rules = rules_from_strings(['X:=F[+X]F[-X]+X', 'F:=FF'])
+        start = [Token('SYMBOL', 'X')]
+        self.assertEqual(system_to_human(prune_rules(start, rules, 2, 0)), 'FFFF+FF+X')
+        self.assertEqual(system_to_human(prune_rules(start, rules, 2, 1)),
+                         'FF[+FF+X]FF[-FF+X]+F[+X]F[-X]+X')
+        for depth in range(4):
+            self.assertEqual(len(prune_rules(start, rules, 4, depth)),
+                             pruned_length(start, rules, 4, depth))
+        self.assertEqual(list(prune_rules(start, rules, 4, 4)),
+                         list(apply_rules(start, rules, 4, 0)))
+
+    def test_prune_stochastic(self):
+        rules = rules_from_strings(['F:=F[+F]', 'F:=F[-F]'], [0.5, 0.5])
+        with self.assertRaises(ValueError):
+            prune_rules([Token('SYMBOL', 'F')], rules, 2, 1)
+
+    def test_compiled_normalized(self):
+        table = SymbolTable()
+        compiled = compile_rules(rules_from_strings(['F:=F[+F]', 'F:=F[-F]', 'F:=F'],
+                                                    [1, 2, 1]), table)
+        f = table.code(Token('SYMBOL', 'F'))
+        self.assertEqual(compiled.cumulative[f], (0.25, 0.75, 1.0))
+        self.assertEqual(list(compiled.choose_many(bytes([f] * 4), [0.0, 0.3, 0.75, 0.9])),
+                         [0, 1, 1, 2])
+        self.assertEqual(compiled.choose(f, 0.9), bytes([f]))
+
+    def test_compiled_no_dropped_symbols(self):
+        # Probabilities that do not sum up to one still select a rule
+        for rseed in range(10):
+            self.assertIn(self.derive('F', ['F:=FF', 'F:=FFF'], 1, [0.2, 0.2], rseed), ('FF', 'FFF'))
+
+    def test_compile_errors(self):
+        with self.assertRaises(ValueError):
+            compile_rules(rules_from_strings(['F:=FF', 'F:=F'], [0, 0]), SymbolTable())
+        with self.assertRaises(ValueError):
+            compile_rules(rules_from_strings(['F:=FF', 'F:=F'], [1.5, -0.5]), SymbolTable())
+
+
+if __name__ == '__main__':
+    unittest.main()
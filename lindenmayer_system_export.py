@@ -0,0 +1,147 @@
+import io
+import struct
+import unittest
+import numpy as np
+from lindenmayer_system_turtle import Geometry
+from lindenmayer_system_instancing import InstancedGeometry, Instances
+
+# Magic, version, number of points and number of splines
+HEADER = struct.Struct('<4sIQQ')
+MAGIC = b'LSYG'
+VERSION = 1
+
+# Magic, version, number of prototypes and number of instances
+INSTANCED_HEADER = struct.Struct('<4sIQQ')
+INSTANCED_MAGIC = b'LSYI'
+
+
+def write_obj(f, geometry):
+    """Write the points of every spline as OBJ polyline to a text file"""
+    points = geometry.points.reshape(-1, 3)
+    for x, y, z in points.tolist():
+        f.write("v {:.6f} {:.6f} {:.6f}\n".format(x, y, z))
+
+    offsets = geometry.offsets.tolist()
+    for begin, end in zip(offsets, offsets[1:]):
+        if end - begin > 1:
+            f.write("l " + " ".join(str(i + 1) for i in range(begin, end)) + "\n")
+
+
+def write_binary(f, geometry):
+    """Write geometry in the compact binary format to a binary file
+
+    Header followed by the int64 spline offsets and the float32 points,
+    left handles and right handles, all little endian.
+    """
+    f.write(HEADER.pack(MAGIC, VERSION, len(geometry.points) // 3, len(geometry.offsets) - 1))
+    f.write(geometry.offsets.astype('<i8').tobytes())
+    for values in geometry.points, geometry.handles_left, geometry.handles_right:
+        f.write(values.astype('<f4').tobytes())
+
+
+def read_binary(buffer, offset=0):
+    """Geometry of a buffer in the binary format at offset, arrays share
+    its memory
+    """
+    magic, version, points, splines = HEADER.unpack_from(buffer, offset)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a Lindenmayer system geometry file")
+
+    position = offset + HEADER.size
+    offsets = np.frombuffer(buffer, '<i8', splines + 1, position)
+    position += offsets.nbytes
+
+    arrays = []
+    for i in range(3):
+        arrays.append(np.frombuffer(buffer, '<f4', points * 3, position))
+        position += points * 12
+
+    return Geometry(arrays[0], arrays[1], arrays[2], offsets)
+
+
+def read_binary_file(path):
+    with open(path, 'rb') as f:
+        return read_binary(f.read())
+
+
+def binary_size(geometry):
+    """Bytes write_binary writes for geometry"""
+    return HEADER.size + len(geometry.offsets) * 8 + len(geometry.points) * 12
+
+
+def write_instanced_binary(f, instanced):
+    """Write InstancedGeometry to a binary file
+
+    Header followed by the geometry and every prototype in the binary
+    format, then the int64 prototype index, the float64 translations and
+    the float64 yaw angles of the instances.
+    """
+    instances = instanced.instances
+    f.write(INSTANCED_HEADER.pack(INSTANCED_MAGIC, VERSION, len(instanced.prototypes),
+                                  len(instances.prototype)))
+    for geometry in [instanced.geometry] + list(instanced.prototypes):
+        write_binary(f, geometry)
+
+    f.write(instances.prototype.astype('<i8').tobytes())
+    f.write(instances.translation.astype('<f8').tobytes())
+    f.write(instances.angle.astype('<f8').tobytes())
+
+
+def read_instanced_binary(buffer):
+    """InstancedGeometry of a buffer written by write_instanced_binary"""
+    magic, version, prototypes, count = INSTANCED_HEADER.unpack_from(buffer)
+    if magic != INSTANCED_MAGIC or version != VERSION:
+        raise ValueError("Not a Lindenmayer system instance file")
+
+    position = INSTANCED_HEADER.size
+    geometries = []
+    for i in range(prototypes + 1):
+        geometries.append(read_binary(buffer, position))
+        position += binary_size(geometries[-1])
+
+    prototype = np.frombuffer(buffer, '<i8', count, position)
+    position += count * 8
+    translation = np.frombuffer(buffer, '<f8', count * 3, position).reshape(-1, 3)
+    position += count * 24
+    angle = np.frombuffer(buffer, '<f8', count, position)
+
+    return InstancedGeometry(geometries[0], geometries[1:],
+                             Instances(prototype, translation, angle))
+
+
+class TestExportFunctions(unittest.TestCase):
+    def setUp(self):
+        points = np.arange(9, dtype=np.float32)
+        self.geometry = Geometry(points, points + 1, points + 2, np.array([0, 2, 3]))
+
+    def test_obj(self):
+        f = io.StringIO()
+        write_obj(f, self.geometry)
+        lines = f.getvalue().splitlines()
+        self.assertEqual(lines[0], "v 0.000000 1.000000 2.000000")
+        self.assertEqual(lines[3:], ["l 1 2"])
+
+    def test_binary_round_trip(self):
+        f = io.BytesIO()
+        write_binary(f, self.geometry)
+        geometry = read_binary(f.getvalue())
+        for values, expected in zip(geometry[:4], self.geometry):
+            self.assertEqual(values.tolist(), expected.tolist())
+
+    def test_instanced_round_trip(self):
+        instances = Instances(np.array([0, 0]), np.arange(6.0).reshape(2, 3), np.array([0.5, 1]))
+        instanced = InstancedGeometry(self.geometry, [self.geometry], instances)
+        f = io.BytesIO()
+        write_instanced_binary(f, instanced)
+        result = read_instanced_binary(f.getvalue())
+        self.assertEqual(result.prototypes[0].points.tolist(), self.geometry.points.tolist())
+        self.assertEqual(result.geometry.offsets.tolist(), self.geometry.offsets.tolist())
+        for values, expected in zip(result.instances, instances):
+            self.assertEqual(values.tolist(), expected.tolist())
+
+    def test_binary_magic(self):
+        self.assertRaises(ValueError, read_binary, b'\0' * HEADER.size)
+
+
+if __name__ == '__main__':
+    unittest.main()
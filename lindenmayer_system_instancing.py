@@ -0,0 +1,302 @@
+"""Instanced geometry of deterministic systems
+
+A bracketed part of a right side derives to the same word wherever its
+rule is applied with the same number of remaining generations. If the
+turtle only yaws by a constant angle, the geometry of such a branch only
+differs by a rotation about Y and a translation, so it is built once as a
+prototype and placed as instance wherever it occurs.
+"""
+import unittest
+import numpy as np
+from math import pi
+from collections import namedtuple
+from lindenmayer_system_parser import Token
+from lindenmayer_system_derivation import (SymbolTable, ExpansionTable, compile_rules,
+                                           apply_rules, rules_from_strings, is_parametric)
+from lindenmayer_system_turtle import (Geometry, ACTIONS, NONE, ROTATIONS, interpret,
+                                       interpret_markers)
+
+# Branches deriving to fewer tokens are not instanced
+INSTANCE_MIN_TOKENS = 256
+
+MARKER_TOKEN = Token('MARKER', 'MARKER')
+
+InstancedGeometry = namedtuple('InstancedGeometry', ['geometry', 'prototypes', 'instances'])
+InstancedGeometry.__doc__ = """Geometry with repeated branches as instances
+
+geometry   -- Geometry of the system without the instanced branches
+prototypes -- Geometry of every instanced branch, built at the origin
+              facing +Z
+instances  -- Instances placing the prototypes relative to geometry
+"""
+
+Instances = namedtuple('Instances', ['prototype', 'translation', 'angle'])
+Instances.__doc__ = """Placements of prototypes
+
+prototype   -- int64 index into the prototypes
+translation -- (n, 3) float64 position of the branch
+angle       -- float64 yaw of the branch, rotating like the + token
+"""
+
+
+def can_instance(rules, start, random_angle):
+    """True if branches of the system can be instanced
+
+    The system has to be deterministic without parameters, only use + and
+    - as rotation and may not vary the angle.
+    """
+    if (random_angle != 0 or is_parametric(rules) or
+        any(len(rewrite_rule) > 1 for rewrite_rule in rules.values())):
+        return False
+
+    tokens = list(start)
+    for rewrite_rule in rules.values():
+        tokens.extend(rewrite_rule[0].right)
+
+    return all(ROTATIONS.get(ACTIONS.get(t, NONE), (1,))[0] == 1 for t in tokens)
+
+
+def _yaw(vectors, angles):
+    """Rotate (n, 3) vectors about Y like the turtle yaws by angles"""
+    c = np.cos(angles)
+    s = np.sin(angles)
+    x, y, z = vectors[:, 0], vectors[:, 1], vectors[:, 2]
+    return np.stack((c * x - s * z, y, s * x + c * z), axis=1)
+
+
+def _group_ends(right, push, pop):
+    """Index of the closing bracket of every opening bracket of right"""
+    ends = {}
+    opened = []
+    for i, c in enumerate(right):
+        if c == push:
+            opened.append(i)
+        elif c == pop:
+            ends[opened.pop()] = i
+
+    return ends
+
+
+class _Instancer:
+    """Splits the derivation of a system into prototypes
+
+    A group is identified by (code, index of its opening bracket in the
+    right side of code, remaining generations), code None is the start
+    word.
+    """
+    def __init__(self, rules, start, times, min_tokens):
+        self.table = SymbolTable()
+        self.compiled = compile_rules(rules, self.table)
+        self.expansion = ExpansionTable(self.compiled, self.table, 0)
+        self.start = self.table.encode(start)
+        self.times = times
+        self.min_tokens = min_tokens
+
+        codes = self.table.codes
+        self.push = codes.get(Token('PUSH', '['))
+        self.pop = codes.get(Token('POP', ']'))
+        self.ends = {None: _group_ends(self.start, self.push, self.pop)}
+        for code in self.compiled.rewritten:
+            self.ends[code] = _group_ends(self.compiled.expansions[code], self.push, self.pop)
+
+    def right(self, code):
+        return self.start if code is None else self.compiled.expansions[code]
+
+    def instanced(self, key):
+        code, begin, remaining = key
+        right = self.right(code)
+        end = self.ends[code][begin]
+        return sum(self.expansion.segment_length(c, remaining)
+                   for c in right[begin:end + 1]) >= self.min_tokens
+
+    def local_word(self, code, begin, end, remaining):
+        """Tokens of the derivation of right[begin:end] with every instanced
+        group replaced by a marker, and the keys of the markers
+        """
+        tokens = self.table.tokens
+        word = []
+        keys = []
+
+        def derive(code, begin, end, remaining):
+            right = self.right(code)
+            ends = self.ends[code]
+            i = begin
+            while i < end:
+                c = right[i]
+                if c == self.push and self.instanced((code, i, remaining)):
+                    word.append(MARKER_TOKEN)
+                    keys.append((code, i, remaining))
+                    i = ends[i] + 1
+                    continue
+
+                if remaining and c in self.compiled.rewritten:
+                    derive(c, 0, len(self.compiled.expansions[c]), remaining - 1)
+                else:
+                    word.append(tokens[c])
+                i += 1
+
+        derive(code, begin, end, remaining)
+        return word, keys
+
+    def group_word(self, key):
+        """Local word of the inside of a group"""
+        code, begin, remaining = key
+        return self.local_word(code, begin + 1, self.ends[code][begin], remaining)
+
+
+def _drop_empty_root(geometry):
+    """Remove the first spline if it has a single point, like the turtle
+    removes a branch without movement
+    """
+    offsets = geometry.offsets
+    if len(offsets) < 2 or offsets[1] - offsets[0] != 1:
+        return geometry
+
+    depths = None if geometry.depths is None else geometry.depths[1:]
+    return Geometry(geometry.points[3:], geometry.handles_left[3:],
+                    geometry.handles_right[3:], offsets[1:] - 1, depths)
+
+
+def instance(start, rules, times, length, angle, min_tokens=INSTANCE_MIN_TOKENS):
+    """Interpret a system with its repeated branches as instances
+
+    Returns InstancedGeometry, raises ValueError if can_instance is False
+    for the system.
+    """
+    if not can_instance(rules, start, 0):
+        raise ValueError("Only deterministic systems turning with + and - can be instanced")
+
+    instancer = _Instancer(rules, start, times, min_tokens)
+    get_angle = lambda: angle
+
+    word, keys = instancer.local_word(None, 0, len(instancer.start), times)
+    geometry, positions, directions = interpret_markers(word, length, get_angle)
+
+    # Local placements of the markers of every group, groups in order of discovery
+    index = {}
+    prototypes = []
+    local = []
+    pending = [keys]
+    while pending:
+        for key in pending.pop():
+            if key in index:
+                continue
+            index[key] = len(prototypes)
+            group_word, group_keys = instancer.group_word(key)
+            group_geometry, group_positions, group_directions = interpret_markers(
+                group_word, length, get_angle)
+            prototypes.append(_drop_empty_root(group_geometry))
+            local.append((group_keys, group_positions, group_directions))
+            pending.append(group_keys)
+
+    # Place the markers of the start word, then the markers inside placed groups
+    def marker_angles(directions):
+        return np.arctan2(-directions[:, 0], directions[:, 2])
+
+    queue = [(keys, positions, marker_angles(directions),
+              np.zeros((1, 3)), np.zeros(1))]
+    prototype = []
+    translation = []
+    angles = []
+    while queue:
+        group_keys, group_positions, group_angles, parent_translation, parent_angle = queue.pop()
+        for i, key in enumerate(group_keys):
+            p = index[key]
+            t = _yaw(np.repeat(group_positions[i:i + 1], len(parent_angle), axis=0),
+                     parent_angle) + parent_translation
+            a = parent_angle + group_angles[i]
+
+            prototype.append(np.full(len(a), p, dtype=np.int64))
+            translation.append(t)
+            angles.append(a)
+
+            child_keys, child_positions, child_directions = local[p]
+            if child_keys:
+                queue.append((child_keys, child_positions, marker_angles(child_directions),
+                              t, a))
+
+    if prototype:
+        instances = Instances(np.concatenate(prototype), np.concatenate(translation),
+                              np.concatenate(angles))
+    else:
+        instances = Instances(np.zeros(0, dtype=np.int64), np.zeros((0, 3)), np.zeros(0))
+
+    return InstancedGeometry(geometry, prototypes, instances)
+
+
+def flatten(instanced):
+    """Geometry with every instance expanded, the splines of the
+    instances follow the splines of instanced.geometry
+
+    The depths of the splines are not known, prototypes only have depths
+    relative to their branch.
+    """
+    parts = [instanced.geometry]
+    for p, t, a in zip(*instanced.instances):
+        prototype = instanced.prototypes[p]
+        moved = [(_yaw(values.reshape(-1, 3).astype(np.float64), np.full(len(values) // 3, a)) +
+                  t).astype(np.float32).ravel()
+                 for values in prototype[:3]]
+        parts.append(Geometry(moved[0], moved[1], moved[2], prototype.offsets))
+
+    offsets = [np.zeros(1, dtype=np.int64)]
+    total = 0
+    for part in parts:
+        offsets.append(part.offsets[1:] + total)
+        total += part.offsets[-1]
+
+    return Geometry(*(np.concatenate([part[i] for part in parts]) for i in range(3)),
+                    np.concatenate(offsets))
+
+
+def point_count(instanced):
+    """Number of points stored, prototypes are counted once"""
+    return (len(instanced.geometry.points) +
+            sum(len(p.points) for p in instanced.prototypes)) // 3
+
+
+class TestInstancingFunctions(unittest.TestCase):
+    def splines(self, geometry):
+        offsets = geometry.offsets.tolist()
+        splines = [geometry.points[b * 3:e * 3] for b, e in zip(offsets, offsets[1:])]
+        return sorted(splines, key=lambda points: np.round(points, 2).tolist())
+
+    def check(self, start, strings, times, min_tokens):
+        rules = rules_from_strings(strings)
+        start = [Token('SYMBOL', s) for s in start]
+        instanced = instance(start, rules, times, 1.0, pi / 7, min_tokens)
+        expected = interpret(apply_rules(start, rules, times, 0), 1.0, lambda: pi / 7)
+
+        flat = flatten(instanced)
+        self.assertEqual(len(flat.offsets), len(expected.offsets))
+        for a, b in zip(self.splines(flat), self.splines(expected)):
+            np.testing.assert_allclose(a, b, atol=1e-4)
+        return instanced
+
+    def test_flower_d(self):
+        instanced = self.check('X', ['X:=F[+X]F[-X]+X', 'F:=FF'], 5, 20)
+        self.assertGreater(len(instanced.instances.prototype), len(instanced.prototypes))
+        self.assertLess(point_count(instanced),
+                        len(flatten(instanced).points) // 3)
+
+    def test_nested_groups(self):
+        self.check('X', ['X:=F-[[X]+X]+F[+FX]-X', 'F:=FF'], 4, 10)
+
+    def test_start_groups(self):
+        self.check('F[X]F[X]', ['X:=F[+X]-X'], 4, 8)
+
+    def test_nothing_instanced(self):
+        instanced = self.check('X', ['X:=F[+X]F[-X]+X', 'F:=FF'], 2, 10 ** 6)
+        self.assertEqual(len(instanced.prototypes), 0)
+
+    def test_can_instance(self):
+        start = [Token('SYMBOL', 'F')]
+        self.assertTrue(can_instance(rules_from_strings(['F:=F[+F]-F']), start, 0))
+        self.assertFalse(can_instance(rules_from_strings(['F:=F[+F]-F']), start, 0.1))
+        self.assertFalse(can_instance(rules_from_strings(['F:=F(2)[+F]-F']), start, 0))
+        self.assertFalse(can_instance(rules_from_strings(['F:=F[+F]', 'F:=F'], [0.5, 0.5]),
+                                      start, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
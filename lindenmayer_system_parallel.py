@@ -0,0 +1,95 @@
+"""Derivation of a single system on several processes
+
+Every generation is cut into chunks that are rewritten on a process pool
+and joined again. Stochastic rules draw counter based random numbers keyed
+by rule seed, generation and position of the symbol in the generation, so
+the result does not depend on the number of processes or the chunk size.
+It is not the same word as apply_rules derives for the seed, which draws
+from one sequential generator.
+"""
+import unittest
+from multiprocessing import Pool
+from lindenmayer_system_parser import Token
+from lindenmayer_system_derivation import (SymbolTable, Word, apply_rules, compile_rules,
+                                           rules_from_strings, system_to_human)
+from lindenmayer_system_random import CounterRandom
+
+# Codes rewritten by a worker at once
+PARALLEL_CHUNK_SIZE = 1 << 20
+
+_worker_table = None
+
+
+def _init_worker(compiled):
+    global _worker_table
+    _worker_table = compiled
+
+
+def _rewrite_chunk(compiled, codes, rseed, generation, offset):
+    rng = CounterRandom(rseed, ('generation', generation))
+    return bytes(compiled.rewrite_positions(
+        codes, lambda positions: [rng.random_at(offset + p) for p in positions.tolist()]))
+
+
+def _rewrite_worker_chunk(codes, rseed, generation, offset):
+    return _rewrite_chunk(_worker_table, codes, rseed, generation, offset)
+
+
+def apply_rules_parallel(start, rules, times, rseed, processes=None,
+                         chunk_size=PARALLEL_CHUNK_SIZE, budget=None):
+    """Derive the system on a pool of processes, returns a Word
+
+    Generations shorter than chunk_size are rewritten in this process.
+    budget is checked after every generation.
+    """
+    table = SymbolTable()
+    compiled = compile_rules(rules, table)
+    codes = table.encode(start)
+
+    pool = None
+    try:
+        for generation in range(times):
+            if len(codes) <= chunk_size or processes == 1:
+                codes = _rewrite_chunk(compiled, codes, rseed, generation, 0)
+            else:
+                if pool is None:
+                    pool = Pool(processes, _init_worker, (compiled,))
+
+                chunks = [(codes[i:i + chunk_size], rseed, generation, i)
+                          for i in range(0, len(codes), chunk_size)]
+                codes = b''.join(pool.starmap(_rewrite_worker_chunk, chunks))
+
+            if budget is not None:
+                budget.check(tokens=len(codes))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return Word(codes, table)
+
+
+class TestParallelFunctions(unittest.TestCase):
+    def derive(self, strings, probabilities, processes, chunk_size):
+        rules = rules_from_strings(strings, probabilities)
+        word = apply_rules_parallel([Token('SYMBOL', 'X')], rules, 5, 1, processes, chunk_size)
+        return system_to_human(word)
+
+    def test_deterministic_matches_serial(self):
+        strings = ['X:=F[+X]F[-X]+X', 'F:=FF']
+        rules = rules_from_strings(strings)
+        expected = system_to_human(apply_rules([Token('SYMBOL', 'X')], rules, 5, 1))
+        self.assertEqual(self.derive(strings, None, 2, 50), expected)
+
+    def test_stochastic_independent_of_chunks(self):
+        strings = ['X:=F[+X]F[-X]+X', 'X:=F[-X]F[+X]-X', 'F:=FF']
+        probabilities = [0.5, 0.5, 1]
+        expected = self.derive(strings, probabilities, 1, 1 << 20)
+        self.assertEqual(self.derive(strings, probabilities, 2, 37), expected)
+        self.assertEqual(self.derive(strings, probabilities, 3, 1000), expected)
+        self.assertIn('[-X]F[+X]', expected)
+        self.assertIn('[+X]F[-X]', expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
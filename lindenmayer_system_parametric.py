@@ -0,0 +1,435 @@
+"""Parametric Lindenmayer systems
+
+Modules carry numeric parameters, F(2) or A(1, 0.5), that rules bind to
+names and pass on, A(x,y):x>1:=F(x)[+(30)A(x*0.7,y)]. The derived word
+keeps the parameters in a float array next to the symbol codes. A
+generation evaluates every argument expression once for all the modules
+a rule rewrites, instead of once per module.
+
+The rules of a symbol are tried in order. The first rule with as many
+parameters as the module and a condition that holds is applied.
+
+Context-sensitive rules, B<A>C:=..., also need matching neighbours. As in
+the classic definition, the neighbours skip over branches and ignored
+symbols: the left neighbour of a module after a branch is the module
+before that branch and the right neighbour of a module before a branch
+is the module after it. The neighbours of the whole word are found once
+per generation from arrays of the matching brackets, so matching stays
+linear in the length of the word.
+"""
+import unittest
+import numpy as np
+from math import pi
+from collections import namedtuple
+from lindenmayer_system_parser import Token, parse_word
+from lindenmayer_system_derivation import SymbolTable, Word, rules_from_strings
+from lindenmayer_system_turtle import (ACTIONS, NONE, FORWARD, PUSH, POP, ROTATIONS,
+                                       interpret)
+from lindenmayer_system_budget import Budget, BudgetExceeded
+
+ParametricRule = namedtuple('ParametricRule', ['parameters', 'condition', 'right',
+                                               'arguments', 'left_context',
+                                               'right_context'])
+ParametricRule.__doc__ = """Rule compiled by compile_parametric
+
+parameters -- names bound to the parameters of the rewritten module
+condition  -- Expression selecting the modules or None
+right      -- encoded right side
+arguments  -- tuple of the argument Expressions of every code of right
+left_context, right_context
+           -- tuples of (code, parameter names) of the neighbours, nearest
+              first
+"""
+
+
+class ParametricWord(Word):
+    """Word with the parameters of every module
+
+    counts -- uint8 array with the number of parameters of every code
+    values -- (n, width) float64 array, the parameters of module i are
+              values[i, :counts[i]]
+    """
+    __slots__ = ('counts', 'values')
+
+    def __init__(self, codes, table, counts, values):
+        super().__init__(codes, table)
+        self.counts = counts
+        self.values = values
+
+
+def compile_parametric(rules, table):
+    """Compile a rule dictionary to {code: tuple of ParametricRule}
+
+    Raises ValueError if a rule can never be applied because an earlier
+    rule without condition takes the same modules.
+    """
+    compiled = {}
+    for symbol, rewrite_rule in rules.items():
+        unconditional = set()
+        for rule in rewrite_rule:
+            arity = len(rule.parameters)
+            if arity in unconditional:
+                raise ValueError("A rule of {} follows a rule without condition for "
+                                 "the same parameters and is never applied".format(symbol))
+            if rule.condition is None and not rule.left_context and not rule.right_context:
+                unconditional.add(arity)
+
+        code = table.code(rewrite_rule[0].left)
+        compiled[code] = tuple(
+            ParametricRule(rule.parameters, rule.condition, table.encode(rule.right),
+                           rule.arguments or ((),) * len(rule.right),
+                           tuple((table.code(t), names) for t, names in reversed(rule.left_context)),
+                           tuple((table.code(t), names) for t, names in rule.right_context))
+            for rule in rewrite_rule)
+
+    return compiled
+
+
+def _width(compiled, arguments):
+    """Largest number of parameters of a module, at least 1"""
+    counts = [len(a) for a in arguments or ()]
+    for rewrite_rule in compiled.values():
+        for rule in rewrite_rule:
+            counts.append(len(rule.parameters))
+            counts.extend(len(a) for a in rule.arguments)
+
+    return max(counts + [1])
+
+
+def bracket_matches(codes, push, pop):
+    """Index of the matching bracket of every bracket in codes
+
+    Brackets of the same depth alternate between opening and closing, so
+    ordering them by depth pairs every [ with its ]. Other positions are 0.
+    """
+    is_push = codes == push
+    is_pop = codes == pop
+    depth = np.cumsum(is_push, dtype=np.int64) - np.cumsum(is_pop, dtype=np.int64)
+    brackets = np.flatnonzero(is_push | is_pop)
+    # The depth inside of the branch for both brackets
+    level = depth[brackets] + is_pop[brackets]
+    ordered = brackets[np.argsort(level, kind='stable')]
+
+    matches = np.zeros(len(codes), dtype=np.int64)
+    matches[ordered[0::2]] = ordered[1::2]
+    matches[ordered[1::2]] = ordered[0::2]
+    return matches
+
+
+def _resolve(pointer):
+    """Follow pointer to its fixed points, doubling the distance of
+    every pointer in each pass
+    """
+    while True:
+        following = pointer[pointer]
+        if np.array_equal(following, pointer):
+            return pointer
+        pointer = following
+
+
+def neighbours(codes, push, pop, ignored=()):
+    """(left, right) neighbour of every position of codes as arrays of
+    len(codes) + 1 indices, len(codes) stands for no neighbour and is its
+    own neighbour
+
+    Codes in ignored are skipped, as are whole branches. The left
+    neighbour of the first module in a branch is the module before the
+    branch, a module at the end of a branch has no right neighbour.
+    """
+    n = len(codes)
+    index = np.arange(n + 1)
+    is_push = np.zeros(n + 1, dtype=bool)
+    is_pop = np.zeros(n + 1, dtype=bool)
+    is_push[:n] = codes == push
+    is_pop[:n] = codes == pop
+    skip = np.zeros(n + 1, dtype=bool)
+    skip[:n] = np.isin(codes, list(ignored))
+    matches = np.zeros(n + 1, dtype=np.int64)
+    matches[:n] = bracket_matches(codes, push, pop)
+
+    # Nearest module at or before every position
+    before = index.copy()
+    before[skip | is_push] -= 1
+    before[is_pop] = matches[is_pop] - 1
+    before[before < 0] = n
+    before = _resolve(before)
+
+    # Nearest module at or after every position
+    after = index.copy()
+    after[skip] += 1
+    after[is_push] = matches[is_push] + 1
+    after[is_pop] = n
+    after = _resolve(np.minimum(after, n))
+
+    left = np.full(n + 1, n)
+    left[1:n] = before[:n - 1]
+    right = np.full(n + 1, n)
+    right[:n - 1] = after[1:n]
+    return left, right
+
+
+class _Arrays:
+    """Arrays of a word extended by a module without parameters for
+    missing neighbours, with the neighbours found when first needed
+    """
+    def __init__(self, compiled, codes, counts, values, table, ignore):
+        self.codes, self.counts, self.values = codes, counts, values
+        self.table = table
+        self.ignore = ignore
+        self.context = any(r.left_context or r.right_context
+                           for rewrite_rule in compiled.values() for r in rewrite_rule)
+        self._neighbours = None
+
+    def neighbours(self):
+        if self._neighbours is None:
+            codes = self.table.codes
+            ignored = [codes[t] for t in self.table.tokens if t.value in self.ignore and
+                       t.type in ('SYMBOL', 'DIRECTION')]
+            self._neighbours = neighbours(self.codes, codes.get(Token('PUSH', '[')),
+                                          codes.get(Token('POP', ']')), ignored)
+            # Missing neighbours match no code and have no parameters
+            self.codes = np.append(self.codes.astype(np.int16), -1)
+            self.counts = np.append(self.counts, 0)
+            self.values = np.vstack((self.values, np.zeros(self.values.shape[1])))
+        return self._neighbours
+
+
+def _match_context(arrays, rule, candidates):
+    """(mask, sources) of the candidates whose neighbours match the
+    contexts of rule, sources are the (names, neighbour indices) of the
+    context modules
+    """
+    mask = np.ones(len(candidates), dtype=bool)
+    sources = []
+    for context, step in zip((rule.left_context, rule.right_context), arrays.neighbours()):
+        position = candidates
+        for code, names in context:
+            position = step[position]
+            mask &= arrays.codes[position] == code
+            if names:
+                mask &= arrays.counts[position] == len(names)
+                sources.append((names, position))
+
+    return mask, sources
+
+
+def _bind(sources, values, chosen=None):
+    """Parameter arrays of the modules at the indices of sources, only
+    where chosen
+    """
+    return {name: values[index if chosen is None else index[chosen], i]
+            for names, index in sources for i, name in enumerate(names)}
+
+
+def _rewrite(compiled, table, ignore, codes, counts, values, budget):
+    """Apply one generation of rules to the arrays of a word"""
+    arrays = _Arrays(compiled, codes, counts, values, table, ignore)
+    # Modules taken by every rule and the size of their replacement
+    sizes = np.ones(len(codes), dtype=np.int64)
+    taken = []
+    for code, rewrite_rule in compiled.items():
+        candidates = np.flatnonzero(codes == code)
+        for rule in rewrite_rule:
+            if not len(candidates):
+                break
+            chosen = counts[candidates] == len(rule.parameters)
+            sources = [(rule.parameters, candidates)]
+            if rule.left_context or rule.right_context:
+                matching, context = _match_context(arrays, rule, candidates)
+                chosen &= matching
+                sources.extend(context)
+            if rule.condition is not None and chosen.any():
+                bound = _bind(sources, arrays.values, chosen)
+                chosen[chosen] = np.broadcast_to(rule.condition(bound), chosen.sum())
+            if chosen.any():
+                selected = candidates[chosen]
+                taken.append((rule, selected, _bind(sources, arrays.values, chosen)))
+                sizes[selected] = len(rule.right)
+                candidates = candidates[~chosen]
+
+    starts = np.cumsum(sizes) - sizes
+    total = int(sizes.sum())
+    if budget is not None:
+        budget.check(tokens=total)
+
+    out_codes = np.empty(total, dtype=np.uint8)
+    out_counts = np.empty(total, dtype=np.uint8)
+    out_values = np.zeros((total, values.shape[1]))
+
+    kept = np.ones(len(codes), dtype=bool)
+    for rule, selected, bound in taken:
+        kept[selected] = False
+    target = starts[kept]
+    out_codes[target] = codes[kept]
+    out_counts[target] = counts[kept]
+    out_values[target] = values[kept]
+
+    for rule, selected, bound in taken:
+        base = starts[selected]
+        for i, (code, arguments) in enumerate(zip(rule.right, rule.arguments)):
+            target = base + i
+            out_codes[target] = code
+            out_counts[target] = len(arguments)
+            for j, expression in enumerate(arguments):
+                out_values[target, j] = expression(bound)
+
+    return out_codes, out_counts, out_values
+
+
+def apply_parametric_rules(start, arguments, rules, times, budget=None, ignore=''):
+    """Derive a parametric or context-sensitive system, returns a
+    ParametricWord
+
+    start     -- tokens of the start word
+    arguments -- constant argument Expressions of every start token or
+                 None, see parse_word
+    budget    -- Budget of the tokens and the time, checked before every
+                 generation is stored
+    ignore    -- string of the symbols and directions contexts skip
+    """
+    table = SymbolTable()
+    compiled = compile_parametric(rules, table)
+    width = _width(compiled, arguments)
+
+    codes = np.frombuffer(table.encode(start), dtype=np.uint8)
+    counts = np.zeros(len(codes), dtype=np.uint8)
+    values = np.zeros((len(codes), width))
+    for i, expressions in enumerate(arguments or ()):
+        counts[i] = len(expressions)
+        for j, expression in enumerate(expressions):
+            values[i, j] = expression({})
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for i in range(times):
+            codes, counts, values = _rewrite(compiled, table, ignore, codes, counts, values,
+                                             budget)
+
+    return ParametricWord(codes.tobytes(), table, counts, values)
+
+
+def top_level_length(word):
+    """Summed length factors of the F outside of brackets, the stem is
+    that many times the length of F long
+    """
+    actions = np.array([ACTIONS.get(t, NONE) for t in word.table.tokens] or [NONE])
+    action = actions[np.frombuffer(word.codes, dtype=np.uint8)]
+    depth = np.cumsum(action == PUSH) - np.cumsum(action == POP)
+    forward = (action == FORWARD) & (depth == 0)
+
+    return float(np.where(word.counts[forward] > 0, word.values[forward, 0], 1).sum())
+
+
+def turtle_parameters(word, length, get_angle):
+    """(lengths, get_angle) to interpret a ParametricWord
+
+    F(l) moves l times length and a rotation with an argument turns by it
+    in degrees, modules without arguments use length and get_angle.
+    """
+    actions = np.array([ACTIONS.get(t, NONE) for t in word.table.tokens] or [NONE])
+    codes = np.frombuffer(word.codes, dtype=np.uint8)
+    action = actions[codes]
+
+    forward = action == FORWARD
+    lengths = np.where(word.counts[forward] > 0, word.values[forward, 0], 1) * length
+
+    rotation = np.isin(action, list(ROTATIONS))
+    has_angle = (word.counts[rotation] > 0).tolist()
+    angles = np.radians(word.values[rotation, 0]).tolist()
+    rotations = iter(range(len(angles)))
+
+    def get_parametric_angle():
+        i = next(rotations)
+        return angles[i] if has_angle[i] else get_angle()
+
+    return lengths, get_parametric_angle
+
+
+class TestParametricFunctions(unittest.TestCase):
+    def derive(self, start, strings, times, budget=None):
+        return apply_parametric_rules(*parse_word(start), rules_from_strings(strings), times,
+                                      budget)
+
+    def modules(self, word):
+        return ''.join(token.value + ('({})'.format(','.join('{:g}'.format(v) for v in
+                                                              word.values[i, :count]))
+                                      if count else '')
+                       for i, (token, count) in enumerate(zip(word, word.counts)))
+
+    def test_arguments(self):
+        word = self.derive('A(1,2)', ['A(x,y):=F(x)[+(y*10)A(x*0.5,y+1)]'], 2)
+        self.assertEqual(self.modules(word), 'F(1)[+(20)F(0.5)[+(30)A(0.25,4)]]')
+
+    def test_conditions(self):
+        strings = ['A(x):x<3:=A(x+1)F', 'A(x):=B(x)']
+        self.assertEqual(self.modules(self.derive('A(0)', strings, 5)), 'B(3)FFF')
+        # Modules with other numbers of parameters are not rewritten
+        self.assertEqual(self.modules(self.derive('A(0)A', strings, 1)), 'A(1)FA')
+
+    def test_context(self):
+        # A signal travelling along the word
+        strings = ['B<A:=B', 'B:=A']
+        self.assertEqual(self.modules(self.derive('BAAA', strings, 2)), 'AABA')
+        # Branches are skipped, the branch start sees the module before it
+        self.assertEqual(self.modules(self.derive('B[A]A[[A]]', ['B<A:=C'], 1)), 'B[C]C[[A]]')
+        self.assertEqual(self.modules(self.derive('A[B]CA[B]', ['A>C:=D'], 1)), 'D[B]CA[B]')
+        self.assertEqual(self.modules(self.derive('CABC', ['AB<C:=D'], 1)), 'CABD')
+        self.assertEqual(self.modules(self.derive('ACB', ['A<C>B:=D', 'C:=E'], 1)), 'ADB')
+        self.assertEqual(self.modules(self.derive('BCA', ['A<C>B:=D', 'C:=E'], 1)), 'BEA')
+
+    def test_context_ignore(self):
+        rules = rules_from_strings(['B<A:=C'])
+        self.assertEqual(self.modules(apply_parametric_rules(*parse_word('B+FA'), rules, 1)),
+                         'B+FA')
+        self.assertEqual(self.modules(apply_parametric_rules(*parse_word('B+FA'), rules, 1,
+                                                             ignore='+F')), 'B+FC')
+
+    def test_context_parameters(self):
+        strings = ['A(x)<B(y)>C(z):x<z:=B(x+y+z)', 'A(x)<B(y):=B(0)']
+        self.assertEqual(self.modules(self.derive('A(1)B(2)C(3)', strings, 1)), 'A(1)B(6)C(3)')
+        self.assertEqual(self.modules(self.derive('A(4)B(2)C(3)', strings, 1)), 'A(4)B(0)C(3)')
+        # A context with parameters needs as many parameters
+        self.assertEqual(self.modules(self.derive('AB(2)', strings, 1)), 'AB(2)')
+
+    def test_neighbours(self):
+        table = SymbolTable()
+        word = [Token('SYMBOL', c) if c.isalpha() else
+                Token('PUSH' if c == '[' else 'POP', c) for c in 'A[B[C]D]E']
+        codes = np.frombuffer(table.encode(word), dtype=np.uint8)
+        push, pop = table.code(Token('PUSH', '[')), table.code(Token('POP', ']'))
+        self.assertEqual(bracket_matches(codes, push, pop).tolist(),
+                         [0, 7, 0, 5, 0, 3, 0, 1, 0])
+        left, right = neighbours(codes, push, pop)
+        # Positions of A B C D E are 0 2 4 6 8, 9 is no neighbour
+        self.assertEqual(left[[0, 2, 4, 6, 8]].tolist(), [9, 0, 2, 2, 0])
+        self.assertEqual(right[[0, 2, 4, 6, 8]].tolist(), [8, 6, 9, 9, 9])
+
+    def test_unreachable_rule(self):
+        self.assertRaises(ValueError, self.derive, 'A(0)', ['A(x):=F', 'A(x):x>1:=B'], 1)
+
+    def test_plain_rules(self):
+        word = self.derive('X', ['X:=F[+X]-X', 'F:=FF'], 2)
+        self.assertEqual(self.modules(word), 'FF[+F[+X]-X]-F[+X]-X')
+
+    def test_turtle(self):
+        word = self.derive('A(2)', ['A(x):=F(x)+(90)F-F'], 1)
+        lengths, get_angle = turtle_parameters(word, 0.5, lambda: pi / 2)
+        self.assertEqual(lengths.tolist(), [1, 0.5, 0.5])
+        geometry = interpret(word, 0.5, get_angle, lengths=lengths)
+        np.testing.assert_allclose(geometry.points.reshape(-1, 3),
+                                   [[0, 0, 0], [0, 0, 1], [-0.5, 0, 1], [-0.5, 0, 1.5]],
+                                   atol=1e-6)
+
+    def test_top_level_length(self):
+        self.assertEqual(top_level_length(self.derive('A(2)', ['A(x):=F(x)+(90)F-F'], 1)), 4)
+        self.assertEqual(top_level_length(self.derive('F(2)[F(3)]F', [], 0)), 3)
+
+    def test_budget(self):
+        strings = ['A(x):=A(x)A(x+1)']
+        self.assertEqual(len(self.derive('A(1)', strings, 4, Budget(16))), 16)
+        with self.assertRaises(BudgetExceeded) as context:
+            self.derive('A(1)', strings, 20, Budget(1000))
+        self.assertEqual(context.exception.value, 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,51 +1,198 @@
 import re
+import ast
 import unittest
+import numpy as np
+from functools import lru_cache
 from collections import namedtuple
 
 SYMBOL     = r'(?P<SYMBOL>[a-zA-Z])'
 REPLACE    = r'(?P<REPLACE>\:=)'
-DIRECTION  = r'(?P<DIRECTION>\+|\-)'
+CONDITION  = r'(?P<CONDITION>:(?!=))'
+DIRECTION  = r'(?P<DIRECTION>\+|\-|\^|&|\\|/)'
+LEFT       = r'(?P<LEFT_CONTEXT><)'
+RIGHT      = r'(?P<RIGHT_CONTEXT>>)'
+ARGUMENTS  = r'(?P<ARGUMENTS>\()'
 PUSH       = r'(?P<PUSH>\[)'
 POP        = r'(?P<POP>\])'
 WS         = r'(?P<WS>\s+)'
 
+PATTERN = re.compile('|'.join([SYMBOL, REPLACE, CONDITION, DIRECTION, LEFT, RIGHT, ARGUMENTS,
+                               PUSH, POP, WS]))
+
+# Number of distinct rule strings kept by the parse cache
+PARSE_CACHE_SIZE = 1024
+
 Token = namedtuple('Token', ['type', 'value'])
 
+ParsedRule = namedtuple('ParsedRule', ['left', 'right', 'parameters', 'condition',
+                                       'arguments', 'left_context', 'right_context'])
+ParsedRule.__new__.__defaults__ = ((), None, None, (), ())
+ParsedRule.__doc__ = """Result of parse_rule
+
+left       -- SYMBOL token of the left side
+right      -- tuple of the tokens of the right side
+parameters -- names of the parameters of the left side, A(x,y):=...
+condition  -- Expression that has to hold for the rule to apply or None
+arguments  -- tuple of the argument Expressions of every right side token,
+              None if no token of the rule has arguments
+left_context, right_context
+           -- tuples of (token, parameter names) the neighbours of the
+              symbol have to match, A<B>C:=..., in the order they are written
+"""
+
+# Functions and constants of expressions, the numpy versions apply to the
+# parameters of all modules a rule rewrites at once
+FUNCTIONS = {
+    'sin': np.sin, 'cos': np.cos, 'tan': np.tan, 'asin': np.arcsin, 'acos': np.arccos,
+    'atan': np.arctan, 'atan2': np.arctan2, 'sqrt': np.sqrt, 'exp': np.exp, 'log': np.log,
+    'abs': np.abs, 'floor': np.floor, 'ceil': np.ceil, 'min': np.minimum, 'max': np.maximum,
+}
+CONSTANTS = {'pi': np.pi, 'e': np.e}
+
+_NAMESPACE = dict(FUNCTIONS, **CONSTANTS)
+_NAMESPACE.update(__builtins__={}, _and=np.logical_and, _or=np.logical_or,
+                  _not=np.logical_not)
+
+_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+              ast.UAdd, ast.USub, ast.Not, ast.And, ast.Or,
+              ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+
+def _call(name, args):
+    return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=args, keywords=[])
+
+
+class _Vectorize(ast.NodeTransformer):
+    """Replace the boolean operators, which do not apply to arrays, with
+    the numpy logical functions
+    """
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        function = '_and' if isinstance(node.op, ast.And) else '_or'
+        result = node.values[0]
+        for value in node.values[1:]:
+            result = _call(function, [result, value])
+        return result
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return _call('_not', [node.operand])
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        # a < b < c is a < b and b < c
+        operands = [node.left] + node.comparators
+        result = None
+        for op, left, right in zip(node.ops, operands, operands[1:]):
+            compare = ast.Compare(left=left, ops=[op], comparators=[right])
+            result = compare if result is None else _call('_and', [result, compare])
+        return result
+
+
+def _check_expression(tree, parameters):
+    """Raise SyntaxError for anything but arithmetic, comparisons and
+    calls of FUNCTIONS on numbers, parameters and CONSTANTS
+    """
+    called = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            if (not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or
+                node.keywords):
+                raise SyntaxError("Unknown function")
+            called.add(node.func)
+        elif isinstance(node, ast.Name):
+            if node not in called and node.id not in parameters and node.id not in CONSTANTS:
+                raise SyntaxError("Unknown parameter {}".format(node.id))
+        elif isinstance(node, ast.Constant):
+            if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+                raise SyntaxError("Only numbers are allowed")
+        elif not isinstance(node, (ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp,
+                                   ast.Compare, ast.Load) + _OPERATORS):
+            raise SyntaxError("Unsupported {}".format(type(node).__name__))
+
+
+class Expression:
+    """Expression of the parameters of a rule, compiled once
+
+    Called with a dictionary of parameter names to numpy arrays it returns
+    the values for all modules at once, a constant expression returns a
+    scalar. Expressions compare and hash by their source.
+    """
+    __slots__ = ('source', 'code')
+
+    def __init__(self, source, parameters=()):
+        try:
+            tree = ast.parse(source.strip(), mode='eval')
+        except SyntaxError:
+            raise SyntaxError("Invalid expression")
+        _check_expression(tree, parameters)
+        tree = ast.fix_missing_locations(_Vectorize().visit(tree))
+
+        self.source = source.strip()
+        self.code = compile(tree, '<expression>', 'eval')
+
+    def __call__(self, values):
+        return eval(self.code, _NAMESPACE, values)
+
+    def __eq__(self, other):
+        return isinstance(other, Expression) and self.source == other.source
+
+    def __hash__(self):
+        return hash(self.source)
+
+    def __repr__(self):
+        return 'Expression({!r})'.format(self.source)
+
+
+# Shared Token of every token text, parsed rules reuse the same objects
+_tokens = {}
+
+def _syntax_error(string, position, message):
+    error = SyntaxError("{} at position {}".format(message, position))
+    error.offset = position
+    error.text = string
+    return error
+
+def _split_arguments(string, position):
+    """Sources of the comma separated arguments in the parentheses opened at
+    position, returns (sources, position after the closing parenthesis)
+    """
+    depth = 0
+    sources = []
+    begin = position + 1
+    for i in range(position, len(string)):
+        c = string[i]
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                sources.append(string[begin:i])
+                return sources, i + 1
+        elif c == ',' and depth == 1:
+            sources.append(string[begin:i])
+            begin = i + 1
+
+    raise _syntax_error(string, position, "Unmatched (")
+
 class LindenmayerSystemParser:
-    parsed_sequence = []
+    """Parser of rules of the form SYMBOL := right side
 
-    def __init__(self):
-        self.pattern = re.compile('|'.join([SYMBOL, REPLACE, DIRECTION, PUSH, POP,  WS]))
-
-    def _tokenize(self, string):
-        for match in self.pattern.finditer(string):
-            token = Token(match.lastgroup, match.group())
-            if token.type != 'WS':
-                yield token
-        
-    def _startover(self, string):
-        self.tokens = self._tokenize(string)
-        self.current_token = None
-        self.next_token = None
-        self.parsed_sequence = []
-
-    def _advance(self):
-        self.current_token, self.next_token = self.next_token, next(self.tokens, Token('EMPTY', 'EMPTY'))
-        self.parsed_sequence.append(self.next_token)
-  
-    def _expect(self, symbol):
-        if not self._accept(symbol):
-            raise SyntaxError()
-
-    def _accept(self, symbol):
-        if self.next_token and self.next_token.type == symbol:
-            self._advance()
-            return True
-        else:
-            return False
+    The right side is any sequence of symbols and directions with balanced
+    brackets. Rules are parsed in a single pass without recursion, so the
+    length of a rule is not bounded by the recursion limit. The parser keeps
+    no state between calls.
 
-    def _scanner(self, string):
-        return self.pattern.scanner(string)
+    Parametric rules name the parameters of the left symbol and may add a
+    condition, A(x,y):x>1:=F(x)[+(30)A(x*0.7,y)]. Symbols and directions
+    of the right side take comma separated argument expressions.
+    Context-sensitive rules write the neighbours of the symbol around it,
+    B<A>C:=..., their parameters can be used like those of the symbol.
+    """
+    def __init__(self):
+        self.pattern = PATTERN
 
     def rule_valid(self, string):
         try:
@@ -55,39 +202,208 @@ class LindenmayerSystemParser:
             return False
 
     def parse(self, string):
-        self._startover(string)
-        self._advance()
-
-        # Apply start rule
-        self._rule()
-        
-        return self.parsed_sequence
-        
-    def _rule(self):
-        """rule ::= SYMBOL := movement"""
-        if self._accept('SYMBOL'):
-            if self._accept('REPLACE'):
-                self._grow()
-                if not self._accept("EMPTY"):
-                    raise SyntaxError()
+        """Parse a rule, returns its tokens followed by an EMPTY token
+
+        Raises SyntaxError with the position of the offending character.
+        """
+        return self.parse_parts(string)[0]
+
+    def parse_parts(self, string, expected='SYMBOL'):
+        """Parse a rule, returns (tokens followed by an EMPTY token,
+        parameters, condition, arguments, contexts)
+
+        arguments holds the tuple of argument Expressions of every token,
+        contexts the left and right context as tuples of (token, parameter
+        names). With expected 'right side' string is parsed as a right side
+        without left side, like a start word.
+        """
+        sequence = []
+        arguments = []
+        parameters = ()
+        names = ()
+        condition = None
+        contexts = ((), ())
+        # Positions of the open brackets
+        brackets = []
+        position = 0
+        previous_end = None
+        if expected != 'right side':
+            position, token, parameters, names, condition, contexts = self._parse_left(string)
+            sequence.extend((token, _tokens.setdefault(':=', Token('REPLACE', ':='))))
+            arguments.extend(((), ()))
+
+        while True:
+            match = self.pattern.search(string, position)
+            if match is None:
+                break
+            position = match.end()
+            kind = match.lastgroup
+            if kind == 'WS':
+                continue
+
+            if kind == 'ARGUMENTS':
+                # Arguments follow a symbol or direction directly, once
+                if (not sequence or arguments[-1] or match.start() != previous_end or
+                    sequence[-1].type not in ('SYMBOL', 'DIRECTION')):
+                    raise _syntax_error(string, match.start(), "Unexpected (")
+                sources, position = _split_arguments(string, match.start())
+                arguments[-1] = tuple(self._expression(string, match.start(), source, names)
+                                      for source in sources)
+                previous_end = position
+                continue
+
+            if kind == 'PUSH':
+                brackets.append(match.start())
+            elif kind == 'POP':
+                if not brackets:
+                    raise _syntax_error(string, match.start(), "Unmatched ]")
+                brackets.pop()
+            elif kind not in ('SYMBOL', 'DIRECTION'):
+                raise _syntax_error(string, match.start(),
+                                    "Unexpected {}".format(match.group()))
+
+            text = match.group()
+            token = _tokens.get(text)
+            if token is None:
+                token = _tokens.setdefault(text, Token(kind, text))
+            sequence.append(token)
+            arguments.append(())
+            previous_end = position
+
+        if brackets:
+            raise _syntax_error(string, brackets[-1], "Unmatched [")
+
+        sequence.append(Token('EMPTY', 'EMPTY'))
+        return sequence, parameters, condition, arguments, contexts
+
+    def _parse_left(self, string):
+        """Parse the left side up to :=, returns (position after :=,
+        symbol token, parameters, names of all parameters, condition,
+        contexts)
+
+        The left side is a symbol, optionally between a left context ending
+        in < and a right context starting with >. Every module of it may
+        name its parameters.
+        """
+        # Modules as [token, parameter names, position], in the groups left
+        # context, symbol and right context
+        groups = [[]]
+        separators = []
+        position = 0
+        previous_end = None
+
+        while True:
+            match = self.pattern.search(string, position)
+            kind = match.lastgroup if match else None
+            if kind == 'WS':
+                position = match.end()
+                continue
+            if kind in (None, 'REPLACE', 'CONDITION', 'PUSH', 'POP'):
+                break
+            position = match.end()
+
+            if kind == 'ARGUMENTS':
+                module = groups[-1][-1] if groups[-1] else None
+                if module is None or module[1] or match.start() != previous_end:
+                    raise _syntax_error(string, match.start(), "Unexpected (")
+                sources, position = _split_arguments(string, match.start())
+                module[1] = self._parameters(string, match.start(), sources)
+            elif kind in ('LEFT_CONTEXT', 'RIGHT_CONTEXT'):
+                if kind in separators or 'RIGHT_CONTEXT' in separators or not groups[-1]:
+                    raise _syntax_error(string, match.start(),
+                                        "Unexpected {}".format(match.group()))
+                separators.append(kind)
+                groups.append([])
             else:
-                raise SyntaxError()
-        else:
-            raise SyntaxError()
-
-    def _grow(self):
-        """order ::= DIRECTION order | [ order ] | SYMBOL order | SYMBOL"""
-
-        if self._accept('DIRECTION'):
-            self._grow()
-        elif self._accept('SYMBOL'):
-            self._grow()
-        elif self._accept('PUSH'):
-            self._grow()
-            self._expect('POP')
-            self._grow()
+                text = match.group()
+                token = _tokens.get(text)
+                if token is None:
+                    token = _tokens.setdefault(text, Token(kind, text))
+                groups[-1].append([token, (), match.start()])
+            previous_end = position
+
+        end = match.start() if match else len(string)
+        left_context = groups.pop(0) if 'LEFT_CONTEXT' in separators else []
+        right_context = groups.pop() if 'RIGHT_CONTEXT' in separators else []
+        symbol = groups[0]
+        if not symbol or symbol[0][0].type != 'SYMBOL':
+            raise _syntax_error(string, symbol[0][2] if symbol else end, "Expected symbol")
+        if len(symbol) > 1:
+            raise _syntax_error(string, symbol[1][2], "Expected :=")
+        if 'RIGHT_CONTEXT' in separators and not right_context:
+            raise _syntax_error(string, end, "Expected symbol")
+
+        parameters = symbol[0][1]
+        names = tuple(name for module in left_context + symbol + right_context
+                      for name in module[1])
+        if len(set(names)) != len(names):
+            raise _syntax_error(string, 0, "Expected distinct parameter names")
+
+        condition = None
+        if kind == 'CONDITION':
+            position = match.end()
+            replace = string.find(':=', position)
+            if replace == -1:
+                raise _syntax_error(string, len(string), "Expected :=")
+            condition = self._expression(string, position, string[position:replace], names)
+            position = replace + 2
+        elif kind == 'REPLACE':
+            position = match.end()
         else:
-            pass
+            raise _syntax_error(string, end, "Expected :=")
+
+        contexts = (tuple((token, n) for token, n, p in left_context),
+                    tuple((token, n) for token, n, p in right_context))
+        return position, symbol[0][0], parameters, names, condition, contexts
+
+    def _expression(self, string, position, source, parameters):
+        try:
+            return Expression(source, parameters)
+        except SyntaxError as error:
+            raise _syntax_error(string, position, "{} in {!r}".format(error.msg,
+                                                                      source.strip()))
+
+    def _parameters(self, string, position, sources):
+        names = tuple(source.strip() for source in sources)
+        if len(set(names)) != len(names) or not all(name.isidentifier() for name in names):
+            raise _syntax_error(string, position, "Expected distinct parameter names")
+        if any(name in FUNCTIONS or name in CONSTANTS for name in names):
+            raise _syntax_error(string, position, "Reserved parameter name")
+        return names
+
+_parser = LindenmayerSystemParser()
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_rule(string):
+    """Parse a rule string into a ParsedRule
+
+    The parser keeps no state so it can be called from any thread. Results
+    are immutable and cached by rule string, raises SyntaxError for invalid
+    rules.
+    """
+    p, parameters, condition, arguments, contexts = _parser.parse_parts(string)
+
+    right = tuple(t for t in p[2:] if t.type != 'EMPTY')
+    arguments = tuple(arguments[2:]) if any(arguments[2:]) else None
+    return ParsedRule(p[0], right, parameters, condition, arguments, *contexts)
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_word(string):
+    """Parse a start word like A(1,2)F, returns (tokens, arguments)
+
+    arguments holds the tuple of constant argument Expressions of every
+    token or is None if no token has arguments.
+    """
+    p, parameters, condition, arguments, contexts = _parser.parse_parts(string, 'right side')
+
+    return tuple(p[:-1]), tuple(arguments) if any(arguments) else None
+
+def rule_valid(string):
+    try:
+        parse_rule(string)
+        return True
+    except SyntaxError:
+        return False
 
 class TestParserFunctions(unittest.TestCase):
     def setUp(self):
@@ -107,6 +423,65 @@ class TestParserFunctions(unittest.TestCase):
 
     def test_pattern_05(self):
         self.assertTrue(self.parser.rule_valid("F:="))
+
+    def test_error_position(self):
+        with self.assertRaisesRegex(SyntaxError, 'Unmatched \\] at position 4'):
+            self.parser.parse("F:=F]")
+        with self.assertRaisesRegex(SyntaxError, 'Unmatched \\[ at position 4'):
+            self.parser.parse("F:=F[[F]")
+        with self.assertRaisesRegex(SyntaxError, 'Expected := at position 1'):
+            self.parser.parse("FF")
+
+    def test_long_rule(self):
+        rule = "F:=" + "[F" * 10000 + "]" * 10000
+        self.assertEqual(len(self.parser.parse(rule)), 30003)
+
+    def test_parse_rule(self):
+        parsed = parse_rule("X:=F[+X]")
+        self.assertEqual(parsed.left, Token('SYMBOL', 'X'))
+        self.assertEqual(''.join(t.value for t in parsed.right), "F[+X]")
+        self.assertIsInstance(parsed.right, tuple)
+
+    def test_parse_rule_cached(self):
+        self.assertIs(parse_rule("F:=FF"), parse_rule("F:=FF"))
+
+    def test_rotations(self):
+        self.assertEqual(''.join(t.value for t in parse_rule("F:=^F&F\\F/F").right),
+                         "^F&F\\F/F")
+
+    def test_parametric(self):
+        parsed = parse_rule("A(x,y): x > 1 and y < 2 := F(x*0.7)[+(30)A(x/2, sin(y))]B")
+        self.assertEqual(parsed.parameters, ('x', 'y'))
+        self.assertEqual(''.join(t.value for t in parsed.right), "F[+A]B")
+        self.assertEqual([e.source for e in parsed.arguments[3]], ['x/2', 'sin(y)'])
+        self.assertEqual(parsed.arguments[5], ())
+        self.assertIsNone(parse_rule("F:=F[+F]").arguments)
+
+        values = {'x': np.array([0.5, 2, 3]), 'y': np.array([1, 1, 3])}
+        self.assertEqual(parsed.condition(values).tolist(), [False, True, False])
+        np.testing.assert_allclose(parsed.arguments[0][0](values), [0.35, 1.4, 2.1])
+        self.assertEqual(Expression('1 < x < 3', ('x',))({'x': np.arange(4)}).tolist(),
+                         [False, False, True, False])
+
+    def test_parametric_invalid(self):
+        with self.assertRaisesRegex(SyntaxError, "Unknown parameter y in 'y' at position 7"):
+            parse_rule("A(x):=F(y)")
+        with self.assertRaisesRegex(SyntaxError, 'Unmatched \\( at position 4'):
+            parse_rule("F:=F(1")
+        for rule in ["A(x,x):=F", "A(1):=F", "F:=(1)", "F:=F(1)(2)", "F:=F(sin)",
+                     "F:=F(__import__('os'))", "F:=F(x.y)", "A(x):x>:=F", "F:=F()"]:
+            self.assertFalse(rule_valid(rule), rule)
+
+    def test_parse_word(self):
+        tokens, arguments = parse_word("A(1,2*pi)F")
+        self.assertEqual(tokens, (Token('SYMBOL', 'A'), Token('SYMBOL', 'F')))
+        self.assertEqual([e({}) for e in arguments[0]], [1, 2 * np.pi])
+        self.assertEqual(parse_word("FX"), ((Token('SYMBOL', 'F'), Token('SYMBOL', 'X')), None))
+
+    def test_parse_rule_invalid(self):
+        self.assertRaises(SyntaxError, parse_rule, "F:=F]")
+        self.assertFalse(rule_valid("F:=F]"))
+        self.assertTrue(rule_valid("F:="))
     
 
 if __name__ == '__main__':
@@ -0,0 +1,111 @@
+"""Opt-in measurements of the stages of a generation
+
+A Profile is passed down to generate and the operator, every stage records
+its wall time and the peak of the memory allocated while it ran, counts
+like tokens, splines and points are added by the stages. Without a
+profile the stages run under NO_PROFILE, which records nothing.
+"""
+import json
+import time
+import unittest
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Profile:
+    """Stages and counts of a single run
+
+    stages -- list of dictionaries with the name, seconds and peak_bytes of
+              every stage in the order they finished
+    counts -- dictionary of the counts reported by the stages
+    """
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.stages = []
+        self.counts = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Measure the body of the with statement as stage name
+
+        The memory is traced with tracemalloc unless it already traces, the
+        outer measurement is not disturbed by a nested stage.
+        """
+        record = {'name': name}
+        trace = self.memory and not tracemalloc.is_tracing()
+        if trace:
+            tracemalloc.start()
+        begin = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - begin
+            if trace:
+                record['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            self.stages.append(record)
+
+    def count(self, **counts):
+        self.counts.update(counts)
+
+    def seconds(self):
+        return sum(stage['seconds'] for stage in self.stages)
+
+    def as_dict(self):
+        return {'seconds': self.seconds(), 'stages': self.stages, 'counts': self.counts}
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=1)
+
+    def summary(self):
+        """Single line with the time of every stage"""
+        return ', '.join("{} {:.3f} s".format(stage['name'], stage['seconds'])
+                         for stage in self.stages)
+
+
+class _NoProfile:
+    """Profile that does not measure"""
+    @contextmanager
+    def stage(self, name):
+        yield {}
+
+    def count(self, **counts):
+        pass
+
+
+NO_PROFILE = _NoProfile()
+
+
+class TestProfileFunctions(unittest.TestCase):
+    def test_stages(self):
+        profile = Profile()
+        with profile.stage('derive') as record:
+            data = bytearray(1 << 20)
+            record['tokens'] = len(data)
+            del data
+        with profile.stage('turtle'):
+            pass
+        profile.count(points=3)
+
+        self.assertEqual([s['name'] for s in profile.stages], ['derive', 'turtle'])
+        self.assertGreaterEqual(profile.stages[0]['peak_bytes'], 1 << 20)
+        self.assertEqual(profile.stages[0]['tokens'], 1 << 20)
+        self.assertEqual(json.loads(profile.to_json())['counts'], {'points': 3})
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_error_recorded(self):
+        profile = Profile(memory=False)
+        with self.assertRaises(ValueError):
+            with profile.stage('parse'):
+                raise ValueError()
+        self.assertEqual(len(profile.stages), 1)
+        self.assertNotIn('peak_bytes', profile.stages[0])
+
+    def test_no_profile(self):
+        with NO_PROFILE.stage('derive') as record:
+            record['tokens'] = 1
+        NO_PROFILE.count(points=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
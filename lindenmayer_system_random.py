@@ -0,0 +1,63 @@
+import hashlib
+import unittest
+from random import Random
+
+
+def _key_seed(seed, key):
+    """Seed of key below seed, stable across processes"""
+    digest = hashlib.blake2b(repr((seed,) + tuple(key)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+MASK = (1 << 64) - 1
+
+
+def _splitmix64(x):
+    x = (x + 0x9E3779B97F4A7C15) & MASK
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK
+    return x ^ (x >> 31)
+
+
+class CounterRandom:
+    """Counter based random numbers
+
+    random_at(counter) depends only on the seed, the key and the counter,
+    so numbers can be drawn in any order and on any process. Every key,
+    e.g. a generation or a branch, is an independent stream of the seed.
+    """
+    def __init__(self, seed=0, key=()):
+        self.base = _key_seed(seed, tuple(key))
+
+    def random_at(self, counter):
+        return (_splitmix64(self.base + counter) >> 11) * (1.0 / (1 << 53))
+
+
+def random_stream(rng):
+    """Random generator for rng, which is a seed or already a generator
+
+    A seed gives the same numbers as random.seed(seed) without touching the
+    global generator.
+    """
+    if isinstance(rng, Random):
+        return rng
+    return Random(rng)
+
+
+class TestRandomFunctions(unittest.TestCase):
+    def test_random_stream(self):
+        rng = Random(1)
+        self.assertIs(random_stream(rng), rng)
+        self.assertEqual(random_stream(1).random(), Random(1).random())
+
+    def test_counter_random(self):
+        rng = CounterRandom(3, ('generation', 1))
+        values = [rng.random_at(i) for i in range(1000)]
+        self.assertEqual(values[10], CounterRandom(3, ('generation', 1)).random_at(10))
+        self.assertNotEqual(values[10], CounterRandom(3, ('generation', 2)).random_at(10))
+        self.assertTrue(all(0 <= v < 1 for v in values))
+        self.assertAlmostEqual(sum(values) / len(values), 0.5, places=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+import numpy as np
+from math import pi, radians
+from lindenmayer_system_parser import Token
+from lindenmayer_system_turtle import Geometry, interpret
+from lindenmayer_system_instancing import InstancedGeometry
+
+# Turning below this angle counts as straight
+EPSILON = 1e-9
+
+
+def turning_angles(geometry):
+    """Angle between the incoming and the outgoing segment of every point,
+    zero for the first and last point of a spline
+    """
+    points = geometry.points.reshape(-1, 3).astype(np.float64)
+    offsets = geometry.offsets
+
+    incoming = np.zeros_like(points)
+    incoming[1:] = points[1:] - points[:-1]
+    outgoing = np.zeros_like(points)
+    outgoing[:-1] = incoming[1:]
+
+    angles = np.arctan2(np.linalg.norm(np.cross(incoming, outgoing), axis=1),
+                        (incoming * outgoing).sum(axis=1))
+    angles[offsets[:-1]] = 0
+    angles[offsets[1:] - 1] = 0
+
+    return angles
+
+
+def simplify(geometry, tolerance):
+    """Drop the points where the spline (nearly) keeps its direction
+
+    A point is removed if the spline turns by at most tolerance radians at
+    it and the turning summed up since the last kept point stays below
+    tolerance, so gentle arcs keep a point every tolerance radians. The
+    first and last point of every spline and all handles of the kept
+    points are unchanged. A tolerance of 0 only merges exactly collinear
+    segments like those of F+-F.
+    """
+    offsets = geometry.offsets
+    count = offsets[-1]
+    if count == 0:
+        return geometry
+
+    tolerance = max(tolerance, EPSILON)
+    angles = turning_angles(geometry)
+
+    ends = np.zeros(count, dtype=bool)
+    ends[offsets[:-1]] = True
+    ends[offsets[1:] - 1] = True
+
+    # Turning since the start of the spline, a point is kept where it crosses a multiple of tolerance
+    counts = np.diff(offsets)
+    spline = np.repeat(np.arange(len(counts)), counts)
+    turned = np.cumsum(angles)
+    turned -= turned[offsets[:-1]][spline]
+    step = np.floor(turned / tolerance)
+    crossed = np.ones(count, dtype=bool)
+    crossed[1:] = step[1:] != step[:-1]
+
+    keep = ends | (angles > tolerance) | crossed
+    point_keep = np.repeat(keep, 3)
+
+    new_offsets = np.zeros(len(offsets), dtype=np.int64)
+    np.cumsum(np.bincount(spline[keep], minlength=len(counts)), out=new_offsets[1:])
+
+    return Geometry(geometry.points[point_keep], geometry.handles_left[point_keep],
+                    geometry.handles_right[point_keep], new_offsets, geometry.depths)
+
+
+def simplify_instanced(instanced, tolerance):
+    """Simplify the geometry and every prototype of InstancedGeometry"""
+    return InstancedGeometry(simplify(instanced.geometry, tolerance),
+                             [simplify(p, tolerance) for p in instanced.prototypes],
+                             instanced.instances)
+
+
+def point_count(geometry):
+    return len(geometry.points) // 3
+
+
+class TestSimplifyFunctions(unittest.TestCase):
+    def interpret(self, string, angles):
+        tokens = [Token('SYMBOL' if c.isalpha() else 'DIRECTION' if c in '+-' else
+                        'PUSH' if c == '[' else 'POP', c) for c in string]
+        angles = iter(angles)
+        return interpret(tokens, 1.0, lambda: next(angles))
+
+    def test_collinear_merged(self):
+        geometry = self.interpret('F+-F+-F', [0.3] * 4)
+        self.assertEqual(geometry.offsets.tolist(), [0, 4])
+        simplified = simplify(geometry, 0)
+        self.assertEqual(simplified.offsets.tolist(), [0, 2])
+        self.assertEqual(simplified.points.tolist(), [0, 0, 0, 0, 0, 3])
+
+    def test_corner_kept(self):
+        geometry = self.interpret('F+F[-F+-F]F', [pi / 2, pi / 2, 0.2, 0.2])
+        simplified = simplify(geometry, radians(5))
+        self.assertEqual(simplified.offsets.tolist(), [0, 3, 5])
+        self.assertEqual(simplified.handles_left[3:6].tolist(), geometry.handles_left[3:6].tolist())
+
+    def test_arc_keeps_points(self):
+        geometry = self.interpret('F+' * 100 + 'F', [radians(1)] * 100)
+        simplified = simplify(geometry, radians(10))
+        self.assertEqual(len(simplified.points) // 3, 12)
+        self.assertLess(np.max(turning_angles(simplified)), radians(12))
+
+    def test_empty(self):
+        geometry = Geometry(*(np.zeros(0, dtype=np.float32),) * 3 + (np.array([0]),))
+        self.assertIs(simplify(geometry, 0.1), geometry)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,270 @@
+"""Derived words and geometry kept on disk across sessions
+
+Entries are files named by the hash of everything that determines them,
+so the command line, batch runs and Blender share one directory without
+coordination. Files are written to a temporary name and renamed, a reader
+never sees a partial entry. Reading maps the file, the codes of a word and
+the arrays of geometry share the memory of the mapping.
+"""
+import os
+import json
+import mmap
+import time
+import struct
+import hashlib
+import tempfile
+import unittest
+import numpy as np
+from lindenmayer_system_parser import Token
+from lindenmayer_system_derivation import SymbolTable, Word
+from lindenmayer_system_turtle import Geometry
+from lindenmayer_system_export import write_binary, read_binary, binary_size
+
+# Changes with the format of the entries or the derivation
+STORE_VERSION = 1
+
+# Magic, version, number of codes, top level segments and bytes of the symbol table
+WORD_HEADER = struct.Struct('<4sIQQI')
+WORD_MAGIC = b'LSYW'
+
+# Bytes of all entries, the least recently used entries are removed beyond
+STORE_SIZE = 1 << 30
+
+# Seconds an entry is kept without being used
+STORE_AGE = 30 * 24 * 3600
+
+WORD_SUFFIX = '.lsw'
+GEOMETRY_SUFFIX = '.lsg'
+
+
+def default_directory():
+    """LSYSTEM_CACHE or lindenmayer_system in the user cache directory"""
+    directory = os.environ.get('LSYSTEM_CACHE')
+    if directory:
+        return directory
+
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'lindenmayer_system')
+
+
+def content_key(*values):
+    """Hex digest of values, which have to have a stable repr"""
+    return hashlib.sha256(repr((STORE_VERSION,) + values).encode()).hexdigest()
+
+
+def write_word(f, word, segments):
+    """Write a Word and its number of top level segments to a binary file
+
+    Header followed by the symbol table as JSON list of [type, value] and
+    the codes.
+    """
+    table = json.dumps([list(token) for token in word.table.tokens]).encode()
+    f.write(WORD_HEADER.pack(WORD_MAGIC, STORE_VERSION, len(word.codes), segments, len(table)))
+    f.write(table)
+    f.write(word.codes)
+
+
+def read_word(buffer):
+    """(Word, segments) of a buffer written by write_word, the codes are a
+    memoryview of buffer
+    """
+    magic, version, count, segments, size = WORD_HEADER.unpack_from(buffer)
+    if magic != WORD_MAGIC or version != STORE_VERSION:
+        raise ValueError("Not a Lindenmayer system word file")
+
+    position = WORD_HEADER.size
+    table = SymbolTable()
+    for token in json.loads(bytes(buffer[position:position + size]).decode()):
+        table.code(Token(*token))
+    position += size
+
+    return Word(memoryview(buffer)[position:position + count], table), segments
+
+
+def _map(path):
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class Store:
+    """Directory of words and geometry keyed by content_key
+
+    max_bytes -- summed size of the entries kept by evict
+    max_age   -- seconds an entry is kept without being read
+    """
+    def __init__(self, directory=None, max_bytes=STORE_SIZE, max_age=STORE_AGE):
+        self.directory = directory or default_directory()
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def _open(self, key, suffix):
+        """Map the entry and mark it as used or return None"""
+        path = self.path(key, suffix)
+        try:
+            buffer = _map(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return buffer
+
+    def _write(self, key, suffix, write):
+        """Write an entry with write(f) and evict old entries"""
+        f = tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False)
+        try:
+            with f:
+                write(f)
+            os.replace(f.name, self.path(key, suffix))
+        except BaseException:
+            os.remove(f.name)
+            raise
+
+        self.evict()
+
+    def get_word(self, key):
+        """(Word, segments) stored for key or None"""
+        buffer = self._open(key, WORD_SUFFIX)
+        if buffer is None:
+            return None
+        try:
+            return read_word(buffer)
+        except (ValueError, struct.error):
+            return None
+
+    def put_word(self, key, word, segments):
+        self._write(key, WORD_SUFFIX, lambda f: write_word(f, word, segments))
+
+    def get_geometry(self, key):
+        """Geometry stored for key or None, its arrays are read only"""
+        buffer = self._open(key, GEOMETRY_SUFFIX)
+        if buffer is None:
+            return None
+        try:
+            geometry = read_binary(buffer)
+        except (ValueError, struct.error):
+            return None
+
+        # The spline depths follow the binary format if they are known
+        size = binary_size(geometry)
+        if len(buffer) > size:
+            geometry = geometry._replace(depths=np.frombuffer(buffer, '<i8',
+                                                              len(geometry.offsets) - 1, size))
+        return geometry
+
+    def put_geometry(self, key, geometry):
+        def write(f):
+            write_binary(f, geometry)
+            if geometry.depths is not None:
+                f.write(geometry.depths.astype('<i8').tobytes())
+
+        self._write(key, GEOMETRY_SUFFIX, write)
+
+    def entries(self):
+        """(path, size, last use) of every entry, least recently used first"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith((WORD_SUFFIX, GEOMETRY_SUFFIX)):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self):
+        """Remove entries older than max_age and the least recently used
+        entries beyond max_bytes
+        """
+        entries = self.entries()
+        total = sum(size for path, size, used in entries)
+        expired = time.time() - self.max_age
+
+        for path, size, used in entries:
+            if used >= expired and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Mapped by another process on some systems, removed next time
+                continue
+            total -= size
+
+    def clear(self):
+        for path, size, used in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class TestStoreFunctions(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = Store(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_word_round_trip(self):
+        table = SymbolTable()
+        word = Word(table.encode([Token('SYMBOL', 'F'), Token('PUSH', '['),
+                                  Token('DIRECTION', '+'), Token('SYMBOL', 'F'),
+                                  Token('POP', ']')]), table)
+        key = content_key('F', 1)
+        self.assertIsNone(self.store.get_word(key))
+
+        self.store.put_word(key, word, 1)
+        stored, segments = self.store.get_word(key)
+        self.assertEqual(list(stored), list(word))
+        self.assertEqual(segments, 1)
+        self.assertEqual(len(stored), 5)
+
+    def test_geometry_round_trip(self):
+        points = np.arange(9, dtype=np.float32)
+        geometry = Geometry(points, points + 1, points + 2, np.array([0, 2, 3]),
+                            np.array([0, 1]))
+        self.store.put_geometry('a', geometry)
+        stored = self.store.get_geometry('a')
+        for values, expected in zip(stored, geometry):
+            self.assertEqual(values.tolist(), expected.tolist())
+        self.assertFalse(stored.points.flags.writeable)
+
+        self.store.put_geometry('b', geometry._replace(depths=None))
+        self.assertIsNone(self.store.get_geometry('b').depths)
+
+    def test_content_key(self):
+        self.assertEqual(content_key('F', (1, 2)), content_key('F', (1, 2)))
+        self.assertNotEqual(content_key('F', (1, 2)), content_key('F', (1, 3)))
+
+    def test_evict_size(self):
+        points = np.zeros(300, dtype=np.float32)
+        geometry = Geometry(points, points, points, np.array([0, 100]))
+        self.store.max_bytes = binary_size(geometry) * 2
+        for i, key in enumerate('abc'):
+            self.store.put_geometry(key, geometry)
+            # Distinct use times in the order of insertion
+            used = time.time() - 10 + i
+            os.utime(self.store.path(key, GEOMETRY_SUFFIX), (used, used))
+            self.store.evict()
+        self.assertIsNone(self.store.get_geometry('a'))
+        self.assertIsNotNone(self.store.get_geometry('c'))
+
+    def test_evict_age(self):
+        table = SymbolTable()
+        self.store.put_word('old', Word(table.encode([Token('SYMBOL', 'F')]), table), 1)
+        os.utime(self.store.path('old', WORD_SUFFIX), (0, 0))
+        self.store.evict()
+        self.assertEqual(self.store.entries(), [])
+
+    def test_damaged_entry(self):
+        with open(self.store.path('bad', WORD_SUFFIX), 'wb') as f:
+            f.write(b'LSYW')
+        self.assertIsNone(self.store.get_word('bad'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,363 @@
+import unittest
+import numpy as np
+from array import array
+from itertools import islice
+from collections import namedtuple
+from math import sin, cos, pi
+from random import Random
+from lindenmayer_system_parser import Token
+from lindenmayer_system_random import random_stream
+from lindenmayer_system_budget import Budget, BudgetExceeded, CHECK_INTERVAL
+
+Geometry = namedtuple('Geometry', ['points', 'handles_left', 'handles_right', 'offsets',
+                                   'depths'])
+Geometry.__new__.__defaults__ = (None,)
+Geometry.__doc__ = """Bezier splines created by the turtle
+
+points, handles_left and handles_right are flat float32 arrays with three
+coordinates per point, the points of spline i are offsets[i]:offsets[i + 1].
+depths is the int64 bracket depth of every spline or None if unknown.
+"""
+
+NONE, FORWARD, PUSH, POP = range(4)
+
+# Rotations as (axis, sign), axis 0 is X (pitch), 1 is Y (yaw), 2 is Z (roll)
+ROTATIONS = {4: (1, 1), 5: (1, -1), 6: (0, 1), 7: (0, -1), 8: (2, 1), 9: (2, -1)}
+
+# Records the turtle state without drawing, see interpret_markers
+MARKER = 10
+
+ACTIONS = {
+    Token('SYMBOL', 'F'): FORWARD,
+    Token('PUSH', '['): PUSH,
+    Token('POP', ']'): POP,
+    Token('DIRECTION', '+'): 4,
+    Token('DIRECTION', '-'): 5,
+    Token('DIRECTION', '^'): 6,
+    Token('DIRECTION', '&'): 7,
+    Token('DIRECTION', '\\'): 8,
+    Token('DIRECTION', '/'): 9,
+    Token('MARKER', 'MARKER'): MARKER,
+}
+
+
+def _actions(system):
+    """Map the tokens of a system to turtle actions"""
+    if hasattr(system, 'codes'):
+        table = [ACTIONS.get(t, NONE) for t in system.table.tokens]
+        return map(table.__getitem__, system.codes)
+
+    return (ACTIONS.get(t, NONE) for t in system)
+
+
+def _checked(actions, budget, points):
+    """Pass actions through, checking budget with the number of actions and
+    points() after every CHECK_INTERVAL actions
+    """
+    tokens = 0
+    while True:
+        chunk = list(islice(actions, CHECK_INTERVAL))
+        if not chunk:
+            return
+        yield from chunk
+        tokens += len(chunk)
+        budget.check(tokens=tokens, points=points())
+
+
+def _rotate(direction, amount, axis):
+    """Rotate direction like direction * Matrix.Rotation(amount, 3, axis)"""
+    x, y, z = direction
+    c = cos(amount)
+    s = sin(amount)
+    if axis == 0:
+        return (x, c * y + s * z, c * z - s * y)
+    if axis == 1:
+        return (c * x - s * z, y, s * x + c * z)
+    return (c * x + s * y, c * y - s * x, z)
+
+
+def _walk(system, get_angle, direction, budget=None):
+    """Run the turtle state machine and record the forward movements
+
+    Returns the events (spline, direction, adds point) in order, the
+    splines (parent, parent events before the branch, depth, direction
+    when created, removed) and the splines standing for markers. A marker
+    is an empty branch that is removed again. The points created so far are
+    checked against budget while walking.
+    """
+    ev_spline = array('q')
+    ev_direction = array('d')
+    ev_new = array('b')
+
+    sp_parent = array('q', [-1])
+    sp_parent_events = array('q', [0])
+    sp_depth = array('q', [0])
+    sp_direction = array('d', direction)
+    sp_removed = array('b', [0])
+    sp_points = [1]
+    sp_events = [0]
+    markers = array('q')
+
+    changed = True
+    spline = 0
+    points = 1
+    # Saved states are (direction, changed, spline) records of immutable
+    # values, a branch stores references instead of copying the turtle
+    stack = []
+
+    actions = _actions(system)
+    if budget is not None:
+        actions = _checked(actions, budget, lambda: points)
+
+    for action in actions:
+        if action == NONE:
+            continue
+
+        if action == FORWARD:
+            new = changed or sp_points[spline] == 1
+            changed = False
+            if new:
+                sp_points[spline] += 1
+                points += 1
+            ev_spline.append(spline)
+            ev_direction.extend(direction)
+            ev_new.append(new)
+            sp_events[spline] += 1
+        elif action == PUSH or action == MARKER:
+            sp_parent.append(spline)
+            sp_parent_events.append(sp_events[spline])
+            sp_depth.append(len(stack) + 1)
+            sp_direction.extend(direction)
+            sp_removed.append(action == MARKER)
+            sp_points.append(1)
+            sp_events.append(0)
+            points += 1
+            if action == MARKER:
+                markers.append(len(sp_points) - 1)
+            else:
+                stack.append((direction, changed, spline))
+                spline = len(sp_points) - 1
+        elif action == POP:
+            if sp_points[spline] == 1:
+                sp_removed[spline] = 1
+            direction, changed, spline = stack.pop()
+        else:
+            axis, sign = ROTATIONS[action]
+            changed = True
+            direction = _rotate(direction, sign * get_angle(), axis)
+
+    events = (np.frombuffer(ev_spline, dtype=np.int64),
+              np.frombuffer(ev_direction).reshape(-1, 3),
+              np.frombuffer(ev_new, dtype=np.int8).astype(bool))
+    splines = (np.frombuffer(sp_parent, dtype=np.int64),
+               np.frombuffer(sp_parent_events, dtype=np.int64),
+               np.frombuffer(sp_depth, dtype=np.int64),
+               np.frombuffer(sp_direction).reshape(-1, 3),
+               np.frombuffer(sp_removed, dtype=np.int8).astype(bool))
+
+    return events, splines, np.frombuffer(markers, dtype=np.int64)
+
+
+def _normalized(vectors):
+    norm = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norm, out=np.zeros_like(vectors), where=norm != 0)
+
+
+def interpret(system, length, get_angle, direction=(0, 0, 1), budget=None, lengths=None):
+    """Interpret a system with a turtle and return its Geometry
+
+    system    -- iterable of tokens or a derived Word
+    length    -- length of a single F
+    get_angle -- called for every rotation, returns the rotation angle
+    direction -- initial facing direction of the turtle
+    budget    -- Budget of the tokens, points and time of the walk
+    lengths   -- length of every F in the order of the system, replaces
+                 length for the movements
+    """
+    return interpret_markers(system, length, get_angle, direction, budget, lengths)[0]
+
+
+def interpret_markers(system, length, get_angle, direction=(0, 0, 1), budget=None,
+                      lengths=None):
+    """Interpret a system like interpret, returns (Geometry, positions,
+    directions) with the turtle position and direction at every MARKER
+    token as (n, 3) arrays
+    """
+    (ev_spline, ev_direction, ev_new), splines, markers = _walk(system, get_angle,
+                                                                tuple(direction), budget)
+    sp_parent, sp_parent_events, sp_depth, sp_direction, sp_removed = splines
+    spline_count = len(sp_parent)
+
+    # Displacement of every event relative to the start of its spline
+    order = np.argsort(ev_spline, kind='stable')
+    ev_spline = ev_spline[order]
+    ev_direction = ev_direction[order]
+    ev_new = ev_new[order]
+    if lengths is None:
+        moves = ev_direction * length
+    else:
+        moves = ev_direction * np.asarray(lengths, dtype=np.float64)[order, np.newaxis]
+    cumulative = np.zeros((len(ev_spline) + 1, 3))
+    np.cumsum(moves, axis=0, out=cumulative[1:])
+    first_event = np.searchsorted(ev_spline, np.arange(spline_count))
+    displacement = cumulative[1:] - cumulative[first_event[ev_spline]]
+
+    # Start of every spline is the parent position at the time of branching
+    relative = np.zeros((spline_count, 3))
+    has_events = sp_parent_events > 0
+    index = first_event[sp_parent[has_events]] + sp_parent_events[has_events] - 1
+    relative[has_events] = displacement[index]
+    start = np.zeros((spline_count, 3))
+    for depth in range(1, sp_depth.max() + 1):
+        mask = sp_depth == depth
+        start[mask] = start[sp_parent[mask]] + relative[mask]
+
+    # A point ends with the last event before the next new point
+    is_last = np.ones(len(ev_spline), dtype=bool)
+    is_last[:-1] = ev_new[1:] | (ev_spline[1:] != ev_spline[:-1])
+    point_spline = ev_spline[is_last]
+    point_co = start[point_spline] + displacement[is_last]
+    point_direction = moves[is_last]
+
+    # Interleave the start points with the event points of every spline
+    counts = np.bincount(point_spline, minlength=spline_count) + 1
+    offsets = np.zeros(spline_count + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+    total = offsets[-1]
+    is_start = np.zeros(total, dtype=bool)
+    is_start[offsets[:-1]] = True
+
+    co = np.empty((total, 3))
+    co[is_start] = start
+    co[~is_start] = point_co
+
+    # Direction of the movement into every point, the branch direction for the start
+    incoming = np.empty((total, 3))
+    incoming[is_start] = sp_direction * length
+    incoming[~is_start] = point_direction
+
+    handles_left = co - incoming / 5
+    if lengths is None:
+        handles_right = co + _normalized(incoming) * (length / 5)
+    else:
+        handles_right = co + incoming / 5
+    handles_right[is_start] = co[is_start]
+
+    # Right handle points along the next movement unless it is the last point
+    has_next = np.zeros(total, dtype=bool)
+    has_next[:-1] = ~is_start[1:]
+    following = np.roll(incoming, -1, axis=0)
+    handles_right[has_next] = co[has_next] + following[has_next] / 5
+
+    # Drop splines removed at the end of their branch
+    keep = ~sp_removed
+    keep[0] = True
+    point_keep = np.repeat(keep, counts)
+    offsets = np.zeros(keep.sum() + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts[keep])
+
+    def flat(values):
+        return values[point_keep].astype(np.float32).ravel()
+
+    geometry = Geometry(flat(co), flat(handles_left), flat(handles_right), offsets,
+                        sp_depth[keep])
+    return geometry, start[markers], sp_direction[markers]
+
+
+def angle_function(angle, random_angle, rng):
+    """Angle source of the operator
+
+    random_angle varies the angle randomly with numbers drawn from rng, an
+    angle seed or random number generator.
+    """
+    if random_angle != 0:
+        rng = random_stream(rng)
+        variation = pi / 4 * random_angle
+
+        def get_angle():
+            return angle + variation * (1 - rng.random() * 2)
+
+        return get_angle
+
+    return lambda: angle
+
+
+class TestTurtleFunctions(unittest.TestCase):
+    def interpret(self, string, length=1.0, angle=pi / 2):
+        tokens = [Token('SYMBOL' if c.isalpha() else 'DIRECTION' if c in '+-^&\\/' else
+                        'PUSH' if c == '[' else 'POP', c) for c in string]
+        return interpret(tokens, length, lambda: angle)
+
+    def points(self, geometry, spline):
+        begin, end = geometry.offsets[spline:spline + 2]
+        return geometry.points[begin * 3:end * 3].reshape(-1, 3).tolist()
+
+    def test_straight_segments_merge(self):
+        geometry = self.interpret('FFF')
+        self.assertEqual(self.points(geometry, 0), [[0, 0, 0], [0, 0, 3]])
+        np.testing.assert_allclose(geometry.handles_left, [0, 0, -0.2, 0, 0, 2.8])
+        np.testing.assert_allclose(geometry.handles_right, [0, 0, 0.2, 0, 0, 3.2])
+
+    def test_yaw(self):
+        geometry = self.interpret('F+F')
+        np.testing.assert_allclose(geometry.points.reshape(-1, 3),
+                                   [[0, 0, 0], [0, 0, 1], [-1, 0, 1]], atol=1e-6)
+        np.testing.assert_allclose(geometry.handles_right.reshape(-1, 3)[1],
+                                   [-0.2, 0, 1], atol=1e-6)
+
+    def test_branch_starts_at_parent_position(self):
+        geometry = self.interpret('F[+F]F')
+        self.assertEqual(len(geometry.offsets), 3)
+        self.assertEqual(self.points(geometry, 0), [[0, 0, 0], [0, 0, 2]])
+        np.testing.assert_allclose(self.points(geometry, 1), [[0, 0, 1], [-1, 0, 1]],
+                                   atol=1e-6)
+
+    def test_depths(self):
+        geometry = self.interpret('F[+F[-F]]F[+F]')
+        self.assertEqual(geometry.depths.tolist(), [0, 1, 2, 1])
+
+    def test_budget(self):
+        tokens = [Token('SYMBOL', 'F'), Token('DIRECTION', '+')] * CHECK_INTERVAL
+        geometry = interpret(iter(tokens), 1.0, lambda: 0.1, budget=Budget(max_points=10 ** 6))
+        self.assertEqual(len(geometry.points) // 3, CHECK_INTERVAL + 1)
+        with self.assertRaises(BudgetExceeded) as context:
+            interpret(iter(tokens), 1.0, lambda: 0.1, budget=Budget(max_points=1000))
+        self.assertEqual(context.exception.value, CHECK_INTERVAL // 2 + 1)
+
+    def test_empty_branch_removed(self):
+        geometry = self.interpret('F[+][-[F]]')
+        self.assertEqual(len(geometry.offsets), 3)
+        np.testing.assert_allclose(self.points(geometry, 1), [[0, 0, 1], [1, 0, 1]],
+                                   atol=1e-6)
+
+    def test_pitch_and_roll(self):
+        geometry = self.interpret('^F/F')
+        np.testing.assert_allclose(geometry.points.reshape(-1, 3),
+                                   [[0, 0, 0], [0, 1, 0], [-1, 1, 0]], atol=1e-6)
+
+    def test_markers(self):
+        tokens = [Token('SYMBOL', 'F'), Token('DIRECTION', '+'), Token('MARKER', 'MARKER'),
+                  Token('SYMBOL', 'F'), Token('MARKER', 'MARKER')]
+        geometry, positions, directions = interpret_markers(tokens, 1.0, lambda: pi / 2)
+        self.assertEqual(geometry.offsets.tolist(), [0, 3])
+        np.testing.assert_allclose(positions, [[0, 0, 1], [-1, 0, 1]], atol=1e-6)
+        np.testing.assert_allclose(directions, [[-1, 0, 0], [-1, 0, 0]], atol=1e-6)
+
+    def test_lengths(self):
+        tokens = [Token('SYMBOL', 'F'), Token('DIRECTION', '+'), Token('SYMBOL', 'F'),
+                  Token('SYMBOL', 'F')]
+        geometry = interpret(tokens, 1.0, lambda: pi / 2, lengths=[2, 0.5, 0.25])
+        np.testing.assert_allclose(geometry.points.reshape(-1, 3),
+                                   [[0, 0, 0], [0, 0, 2], [-0.75, 0, 2]], atol=1e-6)
+        np.testing.assert_allclose(geometry.handles_left.reshape(-1, 3)[2],
+                                   [-0.7, 0, 2], atol=1e-6)
+
+    def test_random_angle_seed(self):
+        get_angle = angle_function(1, 0.5, Random(1))
+        first = [get_angle() for i in range(3)]
+        get_angle = angle_function(1, 0.5, Random(1))
+        self.assertEqual(first, [get_angle() for i in range(3)])
+
+
+if __name__ == '__main__':
+    unittest.main()